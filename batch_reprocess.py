@@ -0,0 +1,274 @@
+"""録画データの一括再処理CLI
+
+録画済みWebMファイルのディレクトリと、感情座標・ユーザー名を記載した
+マニフェストを受け取り、文字起こし → 表情認識 → AI応答生成 → DB保存 の
+パイプライン（services/pipeline.py）をプロセスプールで実行します。
+
+- OpenAI APIへのリクエストは全ワーカー共通のレート制限に従います
+- 処理結果はチェックポイントファイルに追記され、再実行時は完了済みをスキップします
+
+使用例:
+    python batch_reprocess.py recordings/ --manifest manifest.csv --workers 4
+
+マニフェスト形式（CSV または JSONL）:
+    file,username,emotion_x,emotion_y
+    2025-01-01_001.webm,山田太郎,0.5,-0.3
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+
+logger = logging.getLogger("batch_reprocess")
+
+# ワーカープロセス内のグローバル状態（_init_worker で設定）
+_next_request_at = None
+_request_interval = 0.0
+_client = None
+
+
+def load_manifest(manifest_path: str) -> list[dict]:
+    """
+    マニフェストを読み込み
+
+    Args:
+        manifest_path: CSV（ヘッダー付き）または JSONL ファイルのパス
+
+    Returns:
+        [{"file": str, "username": str, "emotion": (x, y)}, ...]
+    """
+    with open(manifest_path, encoding="utf-8") as f:
+        if manifest_path.endswith(".jsonl"):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+
+    entries = []
+    for row in rows:
+        entries.append(
+            {
+                "file": row["file"],
+                "username": row.get("username") or None,
+                "emotion": (
+                    float(row.get("emotion_x") or 0.0),
+                    float(row.get("emotion_y") or 0.0),
+                ),
+            }
+        )
+    return entries
+
+
+def load_checkpoint(checkpoint_path: str) -> set[str]:
+    """チェックポイントから処理完了済みのファイル名を読み込み"""
+    completed = set()
+    if not os.path.exists(checkpoint_path):
+        return completed
+    with open(checkpoint_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 中断時に途中まで書かれた行は無視
+                continue
+            # 発話がない録画は再実行しても結果が変わらないため、完了扱いにする
+            if record.get("status") in ("completed", "no_speech"):
+                completed.add(record["file"])
+    return completed
+
+
+def _throttle(_request):
+    """全ワーカー共通のレート制限（httpxのリクエストフック）"""
+    with _next_request_at.get_lock():
+        now = time.time()
+        slot = max(now, _next_request_at.value)
+        _next_request_at.value = slot + _request_interval
+    delay = slot - now
+    if delay > 0:
+        time.sleep(delay)
+
+
+def _init_worker(next_request_at, request_interval: float, api_key: str):
+    """ワーカープロセスの初期化（OpenAIクライアントは1プロセスにつき1つ）"""
+    global _next_request_at, _request_interval, _client
+    import httpx
+    from openai import OpenAI
+
+    from services.media_worker import set_inline
+    from services.rate_limiter import PRIORITY_BATCH, set_default_priority
+
+    # 同じプロセス内で対話セッションと競合した場合はバッチ処理を後回しにする
+    set_default_priority(PRIORITY_BATCH)
+    # ワーカープロセス自体が並列に動くため、メディア処理はこのプロセス内で実行する
+    set_inline()
+    _next_request_at = next_request_at
+    _request_interval = request_interval
+    http_client = None
+    if request_interval > 0:
+        http_client = httpx.Client(event_hooks={"request": [_throttle]})
+    # 再試行は call_openai() で行うため、クライアント側では行わない
+    _client = OpenAI(api_key=api_key, http_client=http_client, max_retries=0)
+
+
+def _process_recording(path: str, emotion: tuple[float, float], username: str | None) -> dict:
+    """ワーカープロセスで1件の録画を処理（親プロセスへは要約のみ返す）"""
+    from services.pipeline import process_session
+
+    session, status = asyncio.run(
+        process_session(path, emotion, username=username, client=_client)
+    )
+    saved = session.get("saved", False)
+    result = {
+        "status": status,
+        "saved": saved,
+        "stage_status": session.get("stage_status", {}),
+        "timings": session.get("timings", {}),
+    }
+    if username and not saved and status != "no_speech":
+        # 保存できなかった録画は完了扱いにせず、再実行時に処理し直す
+        result["status"] = "error"
+        result["error"] = "対話履歴を保存できませんでした"
+    return result
+
+
+def run_batch(
+    recordings_dir: str,
+    manifest_path: str,
+    checkpoint_path: str,
+    workers: int,
+    requests_per_minute: float,
+    api_key: str,
+) -> dict:
+    """
+    マニフェストに記載された録画を一括処理
+
+    Returns:
+        {"completed": int, "no_speech": int, "error": int, "skipped": int, "missing": int}
+    """
+    entries = load_manifest(manifest_path)
+    done = load_checkpoint(checkpoint_path)
+    counts = {"completed": 0, "no_speech": 0, "error": 0, "skipped": 0, "missing": 0}
+
+    pending = []
+    for entry in entries:
+        if entry["file"] in done:
+            counts["skipped"] += 1
+            continue
+        path = os.path.join(recordings_dir, entry["file"])
+        if not os.path.exists(path):
+            logger.warning(f"録画ファイルが見つかりません: {path}")
+            counts["missing"] += 1
+            continue
+        pending.append((entry, path))
+
+    logger.info(
+        f"{len(pending)}件を処理します（完了済み {counts['skipped']}件をスキップ）"
+    )
+
+    interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+    next_request_at = multiprocessing.Value("d", 0.0)
+    max_in_flight = workers * 2
+
+    with open(checkpoint_path, "a", encoding="utf-8") as checkpoint, ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(next_request_at, interval, api_key),
+    ) as executor:
+        in_flight = {}
+        queue = iter(pending)
+        exhausted = False
+        while in_flight or not exhausted:
+            # 投入済みタスク数を制限して、親プロセスのメモリ使用量を一定に保つ
+            while not exhausted and len(in_flight) < max_in_flight:
+                item = next(queue, None)
+                if item is None:
+                    exhausted = True
+                    break
+                entry, path = item
+                future = executor.submit(
+                    _process_recording, path, entry["emotion"], entry["username"]
+                )
+                in_flight[future] = entry
+
+            if not in_flight:
+                break
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                entry = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.warning(f"処理エラー（{entry['file']}）: {e}")
+                    result = {"status": "error", "error": str(e)}
+
+                counts[result["status"] if result["status"] in ("completed", "no_speech") else "error"] += 1
+                record = {
+                    "file": entry["file"],
+                    "finished_at": datetime.now().isoformat(),
+                    **result,
+                }
+                checkpoint.write(json.dumps(record, ensure_ascii=False) + "\n")
+                checkpoint.flush()
+                logger.info(f"{entry['file']}: {result['status']}")
+
+    return counts
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="録画データの一括再処理")
+    parser.add_argument("recordings_dir", help="WebM録画ファイルのディレクトリ")
+    parser.add_argument("--manifest", required=True, help="マニフェスト（CSV / JSONL）")
+    parser.add_argument(
+        "--checkpoint",
+        default=None,
+        help="チェックポイントファイル（デフォルト: <manifest>.checkpoint.jsonl）",
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--requests-per-minute",
+        type=float,
+        default=300.0,
+        help="全ワーカー合計のOpenAI APIリクエスト上限（0で無制限）",
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    from services.config import get_setting
+
+    api_key = get_setting("OPENAI_API_KEY")
+    if not api_key:
+        logger.error("OPENAI_API_KEY が設定されていません")
+        return 1
+
+    counts = run_batch(
+        args.recordings_dir,
+        args.manifest,
+        args.checkpoint or f"{args.manifest}.checkpoint.jsonl",
+        max(1, args.workers),
+        args.requests_per_minute,
+        api_key,
+    )
+    logger.info(
+        "完了: {completed} / 発話なし: {no_speech} / エラー: {error} / スキップ: {skipped} / ファイルなし: {missing}".format(
+            **counts
+        )
+    )
+
+    # ワーカーがローカルに保存した履歴をPostgreSQLへ同期してから終了する
+    from services.storage import get_storage
+
+    if not get_storage().flush(timeout=60.0):
+        logger.warning("一部の履歴がPostgreSQLへ未同期です（次回の起動時に同期されます）")
+    return 0 if counts["error"] == 0 else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
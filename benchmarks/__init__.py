@@ -0,0 +1 @@
+"""ベンチマーク（ローカルのOpenAI互換サーバーと合成録画データを使用）"""
@@ -0,0 +1,201 @@
+"""ローカルのOpenAI互換サーバー（ベンチマーク・オフライン検証用）
+
+文字起こし（/v1/audio/transcriptions）、チャット（/v1/chat/completions）、
+Vision（画像付きのチャット）に固定の応答を返します。
+応答までの遅延・ジッター・失敗率（500 / 429）を設定できます。
+
+単体で起動する場合:
+    python -m benchmarks.fake_openai --port 8900 --latency 0.5 --jitter 0.2
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1 streamlit run frontdesign.py
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FAKE_TRANSCRIPTION = "今日は少し疲れましたが、友達と話せて楽しかったです。"
+# verbose_json 形式の発話の区間（開始秒, 終了秒, テキスト）
+FAKE_SEGMENTS = ((0.0, 2.4, "今日は少し疲れましたが、"), (2.4, 5.1, "友達と話せて楽しかったです。"))
+FAKE_CHAT_RESPONSE = "お疲れさまでした。友達との時間が心の支えになったのですね。"
+FAKE_EMOTIONS = ("happy", "neutral", "sad", "surprised")
+
+
+class FakeOpenAIConfig:
+    """応答の遅延と失敗の設定"""
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        failure_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        seed: int | None = None,
+    ):
+        """
+        Args:
+            latency: 平均遅延（秒）
+            jitter: 遅延のばらつき（秒、±jitter の一様分布）
+            failure_rate: 500エラーを返す確率（0.0 ～ 1.0）
+            rate_limit_rate: 429エラーを返す確率（0.0 ～ 1.0）
+            seed: 乱数シード（再現性のため）
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.request_count = 0
+
+    def next_outcome(self) -> tuple[float, int]:
+        """(遅延秒, HTTPステータス) を決定"""
+        with self.lock:
+            self.request_count += 1
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            roll = self.random.random()
+        if roll < self.failure_rate:
+            return delay, 500
+        if roll < self.failure_rate + self.rate_limit_rate:
+            return delay, 429
+        return delay, 200
+
+    def fake_emotion(self) -> tuple[str, float]:
+        """Visionの応答の (感情, 信頼度) を決定（シードにより再現可能）"""
+        with self.lock:
+            return self.random.choice(FAKE_EMOTIONS), round(self.random.uniform(0.5, 0.95), 2)
+
+
+def _chat_response(body: dict, config: FakeOpenAIConfig) -> dict:
+    """チャット / Vision の応答を生成"""
+    messages = body.get("messages", [])
+    has_image = any(
+        isinstance(message.get("content"), list)
+        and any(part.get("type") == "image_url" for part in message["content"])
+        for message in messages
+    )
+    if has_image:
+        emotion, confidence = config.fake_emotion()
+        content = json.dumps({"emotion": emotion, "confidence": confidence, "description": ""})
+        prompt_tokens = 850
+    else:
+        content = FAKE_CHAT_RESPONSE
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in messages)
+
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-4o-mini"),
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(content),
+            "total_tokens": prompt_tokens + len(content),
+        },
+    }
+
+
+def _make_handler(config: FakeOpenAIConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, status: int, payload: dict, headers: dict | None = None):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b""
+
+            delay, status = config.next_outcome()
+            time.sleep(delay)
+            if status == 500:
+                self._send_json(500, {"error": {"message": "fake server error", "type": "server_error"}})
+                return
+            if status == 429:
+                self._send_json(
+                    429,
+                    {"error": {"message": "fake rate limit", "type": "rate_limit_error"}},
+                    headers={"Retry-After": "0.1"},
+                )
+                return
+
+            path = self.path.split("?")[0].rstrip("/")
+            if path.endswith("/audio/transcriptions"):
+                self._send_json(
+                    200,
+                    {
+                        "text": FAKE_TRANSCRIPTION,
+                        "language": "japanese",
+                        "duration": FAKE_SEGMENTS[-1][1],
+                        "segments": [
+                            {"id": index, "start": start, "end": end, "text": text}
+                            for index, (start, end, text) in enumerate(FAKE_SEGMENTS)
+                        ],
+                    },
+                )
+            elif path.endswith("/chat/completions"):
+                self._send_json(200, _chat_response(json.loads(raw or b"{}"), config))
+            else:
+                self._send_json(404, {"error": {"message": f"unknown path: {path}"}})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start_fake_openai_server(
+    config: FakeOpenAIConfig | None = None, host: str = "127.0.0.1", port: int = 0
+) -> tuple[ThreadingHTTPServer, str]:
+    """
+    バックグラウンドスレッドでサーバーを起動
+
+    Returns:
+        (server, base_url) のタプル。base_url は OpenAI(base_url=...) に渡す値
+    """
+    config = config or FakeOpenAIConfig()
+    server = ThreadingHTTPServer((host, port), _make_handler(config))
+    server.daemon_threads = True
+    server.config = config
+    thread = threading.Thread(target=server.serve_forever, name="fake-openai", daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ローカルのOpenAI互換サーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    config = FakeOpenAIConfig(args.latency, args.jitter, args.failure_rate, args.rate_limit_rate)
+    server, base_url = start_fake_openai_server(config, args.host, args.port)
+    print(f"Fake OpenAI server: {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""合成WebM録画データの生成（OpenCV・PyAV使用）
+
+ベンチマーク用に、顔を模した図形が動く VP8 の WebM 動画を生成します。
+OpenCV の VideoWriter は音声トラックを書き込めないため、PyAV で合成音声（Opus）の
+トラックを追加し、無音除去・音声の特徴量・無音を除いた音声の送信までを計測できるようにします。
+合成音声は、声の高さ程度の倍音を音節の速さで振幅変調した「発話」と無音を交互に並べたものです。
+"""
+
+import os
+import tempfile
+
+import cv2
+import numpy as np
+
+
+def make_synthetic_webm(
+    path: str,
+    seconds: float = 30.0,
+    fps: float = 30.0,
+    size: tuple[int, int] = (640, 480),
+    audio: bool = True,
+) -> str:
+    """
+    合成WebM動画を生成
+
+    Args:
+        path: 出力先のファイルパス
+        seconds: 動画の長さ（秒）
+        fps: フレームレート
+        size: (幅, 高さ)
+        audio: 合成音声のトラックを含めるか（Falseの場合は映像のみ）
+
+    Returns:
+        出力したファイルパス
+    """
+    if audio:
+        with tempfile.TemporaryDirectory(prefix="abc_fixture_") as workdir:
+            video_only = make_synthetic_webm(
+                os.path.join(workdir, "video.webm"), seconds, fps, size, audio=False
+            )
+            return _add_synthetic_audio(video_only, path, seconds)
+
+    width, height = size
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"VP80"), fps, size)
+    if not writer.isOpened():
+        raise RuntimeError("VP8エンコーダーが利用できません（OpenCVのビルドを確認してください）")
+
+    rng = np.random.default_rng(0)
+    background = rng.integers(40, 80, size=(height, width, 3), dtype=np.uint8)
+    try:
+        for i in range(int(seconds * fps)):
+            frame = background.copy()
+            t = i / fps
+            cx = int(width / 2 + width / 6 * np.sin(t))
+            cy = int(height / 2 + height / 10 * np.cos(t * 0.7))
+            radius = min(width, height) // 5
+            # 顔・目・口を模した図形
+            cv2.circle(frame, (cx, cy), radius, (180, 200, 230), -1)
+            cv2.circle(frame, (cx - radius // 3, cy - radius // 4), radius // 8, (40, 40, 40), -1)
+            cv2.circle(frame, (cx + radius // 3, cy - radius // 4), radius // 8, (40, 40, 40), -1)
+            mouth = int(radius / 4 * (1 + np.sin(t * 3)))
+            cv2.ellipse(frame, (cx, cy + radius // 3), (radius // 3, max(1, mouth // 2)), 0, 0, 180, (60, 60, 160), 3)
+            writer.write(frame)
+    finally:
+        writer.release()
+    return path
+
+
+def synthetic_speech(seconds: float, sample_rate: int = 48000) -> np.ndarray:
+    """
+    発話を模した合成音声（モノラル float32）
+
+    2秒の「発話」と1秒の無音を交互に並べます。発話は基本周波数 120～180Hz の倍音を
+    1秒あたり約4音節の速さで振幅変調したもので、先頭と末尾は無音です。
+    """
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    pitch = 150.0 + 30.0 * np.sin(2 * np.pi * 0.5 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / sample_rate
+    voice = sum(np.sin(phase * harmonic) / harmonic for harmonic in (1, 2, 3, 4))
+    syllables = 0.6 + 0.4 * np.sin(2 * np.pi * 4.0 * t)
+    speaking = ((t % 3.0) >= 0.5) & ((t % 3.0) < 2.5) & (t < seconds - 0.5)
+    samples = 0.2 * voice * syllables * speaking
+    # 録音の雑音（無音区間の判定が雑音レベルを基準にするため）
+    samples += np.random.default_rng(0).normal(0.0, 0.001, size=t.shape)
+    return samples.astype(np.float32)
+
+
+def _add_synthetic_audio(video_path: str, path: str, seconds: float) -> str:
+    """映像のみのWebMに合成音声（Opus）のトラックを追加して path に書き出す"""
+    import av
+
+    sample_rate = 48000
+    samples = synthetic_speech(seconds, sample_rate)
+    with av.open(video_path) as source, av.open(path, "w", format="webm") as output:
+        video_in = source.streams.video[0]
+        video_out = output.add_stream_from_template(video_in)
+        audio_out = output.add_stream("libopus", rate=sample_rate, layout="mono")
+
+        # 音声を先にエンコードし、映像のパケットと時刻順に並べて書き込む（Opusのフレームは20ms）
+        packets = []
+        frame_size = sample_rate // 50
+        for start in range(0, len(samples), frame_size):
+            chunk = samples[start:start + frame_size]
+            if len(chunk) < frame_size:
+                chunk = np.pad(chunk, (0, frame_size - len(chunk)))
+            frame = av.AudioFrame.from_ndarray(chunk[np.newaxis, :], format="flt", layout="mono")
+            frame.sample_rate = sample_rate
+            frame.pts = start
+            packets.extend(audio_out.encode(frame))
+        packets.extend(audio_out.encode(None))
+
+        for packet in source.demux(video_in):
+            if packet.dts is None:
+                continue
+            packet.stream = video_out
+            packets.append(packet)
+
+        def packet_time(packet) -> float:
+            return float((packet.dts if packet.dts is not None else packet.pts or 0) * packet.time_base)
+
+        for packet in sorted(packets, key=packet_time):
+            output.mux(packet)
+    return path
+
+
+def synthetic_webm_bytes(seconds: float = 30.0, fps: float = 30.0, size: tuple[int, int] = (640, 480)) -> bytes:
+    """合成WebM動画を生成して bytes で返す"""
+    with tempfile.NamedTemporaryFile(suffix=".webm", delete=False) as f:
+        path = f.name
+    try:
+        make_synthetic_webm(path, seconds, fps, size)
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(path)
@@ -0,0 +1,514 @@
+"""Streamlitアプリの同時セッション負荷試験
+
+streamlit.testing.v1.AppTest で frontdesign.py をブラウザなしで実行し、N人のユーザーが
+ユーザー名入力 → ステップ1（感情入力）→ ステップ2（録画の分析）→ ステップ3（AI応答・保存）
+を同時に進める状況を再現します。AppTest は1つのプロセスで1つのセッションを順に実行する前提のため、
+ユーザーごとに別のプロセス（spawn）で AppTest を実行し、Streamlitの内部には手を加えません。
+各プロセスは1人分のウォームアップ（モジュールの読み込み・キャッシュの作成）を終えてから、
+全員そろって計測を開始します。
+録画は合成WebM（benchmarks/fixtures.py）、OpenAI API はローカルの疑似サーバー
+（benchmarks/fake_openai.py）、保存先は一時ディレクトリのSQLite（services/storage.py）を使います。
+WebRTCの録画はブラウザなしでは行えないため、ステップ2では録画停止時と同じように
+recorded_video_path と analysis_trigger をセッション状態に設定して分析を開始します。
+
+同時ユーザー数ごとに、操作（スクリプトの再実行）ごとのレイテンシ、1セッションあたりのメモリ、
+スレッド数、セッションのスループットを計測し、キャパシティの目安を出力します。
+メモリはセッションを実行したプロセスの常駐メモリ（RSS）の、ウォームアップ後からの増分です。
+他のセッションの割り当てが混ざらないため、1セッションの分を直接計測できます。
+メディア処理ワーカー（services/media_worker.py）は別プロセスのため、メモリには含まれません
+（各プロセスのワーカー数は既定で1つ）。
+セッションごとにプロセスが分かれるため、GILの競合は含まれません。1つのサーバープロセスで
+同時に実行した場合のレイテンシは、これより大きくなることがあります。
+
+使用例:
+    python -m benchmarks.load_test --users 1,4,8,16 --json load.json
+    # リリース前にベースラインと比較（p95・セッションあたりのメモリが20%以上悪化した場合は終了コード1）
+    python -m benchmarks.load_test --baseline load.json --max-regression 0.2
+"""
+
+import argparse
+import gc
+import json
+import math
+import multiprocessing
+import os
+import queue
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from benchmarks.fake_openai import FakeOpenAIConfig, start_fake_openai_server
+from benchmarks.fixtures import make_synthetic_webm
+from benchmarks.run import find_regressions, print_table, raise_rate_limits
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "frontdesign.py")
+
+# 1セッションで計測する操作（この順に実行）
+STEPS = ("first_render", "username", "emotion_input", "analysis", "result_rerun")
+
+# キャパシティの判定に使う操作（analysis は疑似APIの遅延が大半のため除く）
+INTERACTIVE_STEPS = ("first_render", "username", "emotion_input", "result_rerun")
+
+# スレッド数・メモリを記録する間隔（秒）
+SAMPLE_INTERVAL_SECONDS = 0.05
+
+# 動作を確認したStreamlitのバージョン（下限を含み上限を含まない、AppTest の公開APIのみ使用）
+SUPPORTED_STREAMLIT_VERSIONS = ((1, 37), (2, 0))
+
+# セッションのプロセスがウォームアップを終えるまで待つ最大時間（秒）
+WARMUP_TIMEOUT_SECONDS = 300.0
+
+
+def current_rss_mb() -> float:
+    """このプロセスの常駐メモリ（MB、/proc がない環境では最大常駐メモリ）"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS はバイト、それ以外はKB
+        return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def check_streamlit_version():
+    """AppTest の動作を確認したバージョンのStreamlitか確認する"""
+    import streamlit
+
+    version = tuple(int(part) for part in re.findall(r"\d+", streamlit.__version__)[:2])
+    low, high = SUPPORTED_STREAMLIT_VERSIONS
+    if not low <= version < high:
+        raise RuntimeError(
+            f"streamlit {streamlit.__version__} は未対応です"
+            f"（対応: {'.'.join(map(str, low))} 以上 {'.'.join(map(str, high))} 未満）"
+        )
+
+
+class ResourceSampler:
+    """計測中のスレッド数とメモリの最大値を定期的に記録"""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL_SECONDS):
+        self.interval = interval
+        self.peak_threads = threading.active_count()
+        self.peak_rss_mb = current_rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="load-test-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            self.peak_rss_mb = max(self.peak_rss_mb, current_rss_mb())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def simulate_user(username: str, video_path: str, timeout: float) -> dict:
+    """
+    1人のユーザーとしてステップ1 → 3 まで進める
+
+    Returns:
+        {
+            "app": AppTest,  # セッション（メモリの計測が終わるまで保持する）
+            "latencies": dict[str, float],  # 操作ごとの所要時間（秒、STEPS の名前）
+            "error": str | None,  # 途中で失敗した場合の理由
+        }
+    """
+    from streamlit.testing.v1 import AppTest
+
+    from services.recording_store import new_recording_path
+
+    app = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    latencies = {}
+    outcome = {"app": app, "latencies": latencies, "error": None}
+
+    def timed(step: str, run):
+        started = time.perf_counter()
+        run()
+        latencies[step] = time.perf_counter() - started
+        if app.exception:
+            raise RuntimeError(f"{step}: {app.exception[0].value}")
+
+    try:
+        timed("first_render", app.run)
+
+        # ユーザー名の入力（送信時に履歴をDBから読み込む）
+        app.text_input[0].input(username)
+        timed("username", app.button[0].click().run)
+        if app.session_state["username"] != username:
+            raise RuntimeError("username: ユーザー名が設定されませんでした")
+
+        app.slider[0].set_value(0.3)
+        app.slider[1].set_value(-0.2)
+        timed("emotion_input", app.button[0].click().run)
+        if app.session_state["current_step"] != 2:
+            raise RuntimeError("emotion_input: ステップ2に進みませんでした")
+
+        # 録画の停止時と同じ状態にして分析を開始（分析後にステップ3でAI応答の生成・保存まで進む）
+        recording_path = new_recording_path(app.session_state["recording_session_id"])
+        shutil.copyfile(video_path, recording_path)
+        app.session_state["recorded_video_path"] = recording_path
+        app.session_state["analysis_trigger"] = True
+        timed("analysis", app.run)
+        if app.session_state["current_step"] != 3 or app.session_state["ai_response"] is None:
+            raise RuntimeError("analysis: AI応答まで進みませんでした")
+
+        timed("result_rerun", app.run)
+    except Exception as e:
+        outcome["error"] = str(e) or type(e).__name__
+    return outcome
+
+
+def summarize(latencies: list[float], users: int, errors: int, wall: float) -> dict:
+    """benchmarks/run.py の measure() と同じ形式の1行"""
+    count = len(latencies)
+    latencies = sorted(latencies) or [0.0]
+    return {
+        "concurrency": users,
+        "iterations": users,
+        "errors": errors,
+        "throughput_per_s": round(count / wall, 3) if wall > 0 else 0.0,
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+    }
+
+
+def run_session_process(
+    username: str, video_path: str, timeout: float, secrets_path: str, start, outcomes
+):
+    """
+    1人分のセッションを実行するプロセス（spawn で起動）
+
+    ウォームアップ後に start（Barrier）で全員そろうのを待ってから計測し、結果を outcomes に送る。
+    メモリは、ウォームアップ後の常駐メモリからの増分をこのプロセスだけで計測する。
+    """
+    from streamlit import config
+
+    from services import media_worker
+
+    config.set_option("secrets.files", [secrets_path])
+    try:
+        outcome = _run_session(username, video_path, timeout, start)
+        if outcome is not None:
+            outcomes.put(outcome)
+    finally:
+        # 終了時にメディア処理のワーカーを待ち続けないよう、先にプールを閉じる
+        media_worker.shutdown()
+
+
+def _run_session(username: str, video_path: str, timeout: float, start) -> dict | None:
+    """ウォームアップ → 開始待ち → 計測（開始前に中止された場合はNone）"""
+    outcome = {"latencies": {}, "error": None}
+    try:
+        check_streamlit_version()
+        warmup = simulate_user(f"{username}_warmup", video_path, timeout)
+        if warmup["error"]:
+            raise RuntimeError(f"ウォームアップに失敗しました: {warmup['error']}")
+        del warmup
+        gc.collect()
+    except Exception as e:
+        outcome["error"] = str(e) or type(e).__name__
+        start.abort()
+        return outcome
+
+    rss_before = current_rss_mb()
+    threads_before = threading.active_count()
+    try:
+        start.wait()
+    except threading.BrokenBarrierError:
+        return None
+    with ResourceSampler() as sampler:
+        session = simulate_user(username, video_path, timeout)
+        # 終了後も残るメモリは、セッション（AppTest）を保持したまま計測する
+        rss_after = current_rss_mb()
+    outcome.update(
+        latencies=session["latencies"],
+        error=session["error"],
+        rss_before_mb=rss_before,
+        rss_peak_mb=sampler.peak_rss_mb,
+        rss_after_mb=rss_after,
+        threads_before=threads_before,
+        threads_peak=sampler.peak_threads,
+    )
+    return outcome
+
+
+def run_level(users: int, video_path: str, timeout: float, secrets_path: str) -> tuple[dict, dict]:
+    """
+    users 人を別々のプロセスで同時に実行
+
+    Returns:
+        (操作ごとの行 {step: row}, セッションの集計)
+    """
+    stamp = datetime.now().strftime("%H%M%S")
+    context = multiprocessing.get_context("spawn")
+    start = context.Barrier(users + 1)
+    outcomes = context.Queue()
+    processes = [
+        context.Process(
+            target=run_session_process,
+            args=(f"load_{stamp}_{users}_{i}", video_path, timeout, secrets_path, start, outcomes),
+            name=f"load-test-session-{i}",
+        )
+        for i in range(users)
+    ]
+    for process in processes:
+        process.start()
+
+    results = []
+    try:
+        start.wait(timeout=WARMUP_TIMEOUT_SECONDS)
+        started = time.perf_counter()
+        for _ in processes:
+            results.append(outcomes.get(timeout=timeout * len(STEPS)))
+        wall = time.perf_counter() - started
+    except (threading.BrokenBarrierError, queue.Empty):
+        start.abort()
+        while True:
+            try:
+                results.append(outcomes.get(timeout=1.0))
+            except queue.Empty:
+                break
+        errors = [outcome["error"] for outcome in results if outcome["error"]]
+        raise RuntimeError(f"セッションのプロセスが完了しませんでした: {errors[:1] or '応答なし'}")
+    finally:
+        for process in processes:
+            process.join(timeout=10.0)
+            if process.is_alive():
+                process.terminate()
+
+    failures = [outcome["error"] for outcome in results if outcome["error"]]
+    rows = {}
+    for step in STEPS:
+        values = [outcome["latencies"][step] for outcome in results if step in outcome["latencies"]]
+        rows[step] = summarize(values, users, users - len(values), wall)
+    completed = [outcome for outcome in results if not outcome["error"]]
+    rows["session"] = summarize(
+        [sum(outcome["latencies"].values()) for outcome in completed], users, len(failures), wall
+    )
+
+    def per_session(key: str) -> float:
+        return max((max(outcome[key] - outcome["rss_before_mb"], 0.0) for outcome in results), default=0.0)
+
+    session = {
+        "users": users,
+        "completed": len(completed),
+        "wall_s": round(wall, 3),
+        "sessions_per_s": round(len(completed) / wall, 3) if wall > 0 else 0.0,
+        # 1プロセス（アプリを読み込んだだけの1インスタンス）の常駐メモリと、全プロセスの合計の最大
+        "rss_before_mb": round(min(outcome["rss_before_mb"] for outcome in results), 1),
+        "rss_peak_mb": round(sum(outcome["rss_peak_mb"] for outcome in results), 1),
+        # 実行中（分析の一時データを含む）と、終了後もセッション状態として残る分（最大のセッション）
+        "rss_mb_per_session": round(per_session("rss_peak_mb"), 2),
+        "retained_mb_per_session": round(per_session("rss_after_mb"), 2),
+        "threads_before": min(outcome["threads_before"] for outcome in results),
+        "threads_peak": max(outcome["threads_peak"] for outcome in results),
+        "threads_per_session": max(
+            outcome["threads_peak"] - outcome["threads_before"] for outcome in results
+        ),
+        "failures": failures[:5],
+    }
+    return rows, session
+
+
+def estimate_capacity(results: dict, target_p95_ms: float, memory_budget_mb: float | None) -> dict:
+    """
+    計測結果から1インスタンスで受け付けられる同時ユーザー数の目安を求める
+
+    - 応答性: 画面操作（INTERACTIVE_STEPS）の p95 が target_p95_ms 以下で、失敗がない最大のユーザー数
+    - メモリ: memory_budget_mb から開始時のメモリを引き、実行中のセッションあたりのメモリ
+      （計測した中で最大）で割った人数
+    """
+    sessions = results["sessions"]
+    within_target = [
+        session["users"]
+        for session in sessions
+        if session["completed"] == session["users"]
+        and all(
+            row["p95_ms"] <= target_p95_ms
+            for step in INTERACTIVE_STEPS
+            for row in results["benchmarks"][step]
+            if row["concurrency"] == session["users"]
+        )
+    ]
+    mb_per_session = max((session["rss_mb_per_session"] for session in sessions), default=0.0)
+    capacity = {
+        "target_p95_ms": target_p95_ms,
+        "max_users_within_target": max(within_target, default=0),
+        "mb_per_session": mb_per_session,
+        "threads_per_session": max((session["threads_per_session"] for session in sessions), default=0.0),
+        "peak_sessions_per_s": max((session["sessions_per_s"] for session in sessions), default=0.0),
+        "memory_budget_mb": memory_budget_mb,
+        "max_users_by_memory": None,
+    }
+    if memory_budget_mb and mb_per_session > 0:
+        baseline_mb = min(session["rss_before_mb"] for session in sessions)
+        capacity["max_users_by_memory"] = max(
+            math.floor((memory_budget_mb - baseline_mb) / mb_per_session), 0
+        )
+    return capacity
+
+
+def find_memory_regressions(results: dict, baseline: dict, max_regression: float) -> list[str]:
+    """ベースラインと比べてセッションあたりのメモリが max_regression（割合）以上増えた同時ユーザー数"""
+    base_sessions = {session["users"]: session for session in baseline.get("sessions", [])}
+    regressions = []
+    for session in results["sessions"]:
+        base = base_sessions.get(session["users"])
+        if (
+            base
+            and base["rss_mb_per_session"] > 0
+            and session["rss_mb_per_session"] > base["rss_mb_per_session"] * (1 + max_regression)
+        ):
+            regressions.append(
+                f"memory (users={session['users']}): "
+                f"{base['rss_mb_per_session']}MB → {session['rss_mb_per_session']}MB / session"
+            )
+    return regressions
+
+
+def run_load_test(
+    user_levels: list[int],
+    video_seconds: float,
+    latency: float,
+    jitter: float,
+    timeout: float,
+    target_p95_ms: float,
+    memory_budget_mb: float | None,
+) -> dict:
+    """負荷試験を実行して結果を返す"""
+    check_streamlit_version()
+    raise_rate_limits()
+    workdir = tempfile.mkdtemp(prefix="abc_load_")
+    server, base_url = start_fake_openai_server(
+        FakeOpenAIConfig(latency=latency, jitter=jitter, seed=0)
+    )
+
+    # アプリの設定は一時ディレクトリと疑似サーバーに向ける（利用者の secrets.toml は読まない）
+    secrets_path = os.path.join(workdir, "secrets.toml")
+    with open(secrets_path, "w", encoding="utf-8") as f:
+        f.write('OPENAI_API_KEY = "load-test"\n')
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["STORAGE_BACKEND"] = "sqlite"
+    os.environ["SQLITE_PATH"] = os.path.join(workdir, "load.sqlite3")
+    os.environ["RECORDING_DIR"] = os.path.join(workdir, "recordings")
+    # 環境変数はセッションのプロセスに引き継がれる（メディア処理のワーカーはプロセスごとに1つ）
+    os.environ.setdefault("MEDIA_WORKERS", "1")
+
+    import streamlit
+
+    video_path = make_synthetic_webm(os.path.join(workdir, "session.webm"), seconds=video_seconds)
+    results = {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "video_seconds": video_seconds,
+            "video_bytes": os.path.getsize(video_path),
+            "fake_latency": latency,
+            "fake_jitter": jitter,
+            "db_backend": "sqlite",
+            "cpu_count": os.cpu_count(),
+            "process_per_session": True,
+            "streamlit_version": streamlit.__version__,
+        },
+        "benchmarks": {step: [] for step in (*STEPS, "session")},
+        "sessions": [],
+    }
+    try:
+        for users in user_levels:
+            rows, session = run_level(users, video_path, timeout, secrets_path)
+            for step, row in rows.items():
+                results["benchmarks"][step].append(row)
+            results["sessions"].append(session)
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results["capacity"] = estimate_capacity(results, target_p95_ms, memory_budget_mb)
+    return results
+
+
+def print_sessions(results: dict):
+    print()
+    print(
+        f"{'users':>6}{'done':>6}{'sess/s':>9}{'MB/sess':>10}{'kept MB':>10}"
+        f"{'peak MB':>10}{'threads':>9}{'thr/sess':>10}"
+    )
+    for session in results["sessions"]:
+        print(
+            f"{session['users']:>6}{session['completed']:>6}{session['sessions_per_s']:>9}"
+            f"{session['rss_mb_per_session']:>10}{session['retained_mb_per_session']:>10}"
+            f"{session['rss_peak_mb']:>10}{session['threads_peak']:>9}{session['threads_per_session']:>10}"
+        )
+        for failure in session["failures"]:
+            print(f"  failed: {failure}")
+
+    capacity = results["capacity"]
+    print()
+    print(
+        f"capacity: {capacity['max_users_within_target']} users within p95 {capacity['target_p95_ms']}ms, "
+        f"{capacity['mb_per_session']} MB and {capacity['threads_per_session']} threads per session, "
+        f"peak {capacity['peak_sessions_per_s']} sessions/s"
+    )
+    if capacity["max_users_by_memory"] is not None:
+        print(f"memory: up to {capacity['max_users_by_memory']} users in {capacity['memory_budget_mb']} MB")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Streamlitアプリの同時セッション負荷試験")
+    parser.add_argument("--users", default="1,4,8", help="同時ユーザー数（カンマ区切り）")
+    parser.add_argument("--video-seconds", type=float, default=30.0)
+    parser.add_argument("--latency", type=float, default=0.2, help="疑似APIの平均遅延（秒）")
+    parser.add_argument("--jitter", type=float, default=0.05, help="疑似APIの遅延のばらつき（秒）")
+    parser.add_argument("--timeout", type=float, default=120.0, help="1回の再実行のタイムアウト（秒）")
+    parser.add_argument("--target-p95-ms", type=float, default=1000.0, help="画面操作のp95の目標（ミリ秒）")
+    parser.add_argument("--memory-budget-mb", type=float, help="1インスタンスに割り当てるメモリ（MB）")
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    parser.add_argument("--baseline", help="比較するベースライン結果（JSON）")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="許容するp95・メモリの悪化率")
+    args = parser.parse_args(argv)
+
+    levels = [int(level) for level in args.users.split(",") if level]
+    results = run_load_test(
+        levels,
+        args.video_seconds,
+        args.latency,
+        args.jitter,
+        args.timeout,
+        args.target_p95_ms,
+        args.memory_budget_mb,
+    )
+    print_table(results)
+    print_sessions(results)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    failed = any(session["completed"] < session["users"] for session in results["sessions"])
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.max_regression)
+        regressions += find_memory_regressions(results, baseline, args.max_regression)
+        for line in regressions:
+            print(f"REGRESSION: {line}")
+        if regressions:
+            return 1
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+"""ベンチマークの実行
+
+フレーム抽出・パイプライン全体・DB保存について、同時実行数ごとの
+スループットと p50 / p95 レイテンシを計測します。
+OpenAI API はローカルのOpenAI互換サーバー（benchmarks/fake_openai.py）で代替し、
+DB保存は DATABASE_URL が設定されていればPostgreSQL、なければSQLite（services/storage.py）で計測します。
+
+使用例:
+    python -m benchmarks.run --concurrency 1,4,8 --iterations 32
+    python -m benchmarks.run --json results.json
+    python -m benchmarks.run --baseline results.json --max-regression 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from benchmarks.fake_openai import FakeOpenAIConfig, start_fake_openai_server
+from benchmarks.fixtures import make_synthetic_webm
+
+SAMPLE_CONVERSATION = {
+    "transcription": "今日は少し疲れましたが、友達と話せて楽しかったです。" * 4,
+    "emotion": (0.3, -0.2),
+    "face_emotion": {
+        "emotions": ["happy", "neutral"],
+        "dominant_emotion": "happy",
+        "confidence": 0.8,
+        "frame_count": 2,
+    },
+    "ai_response": "お疲れさまでした。友達との時間が心の支えになったのですね。" * 4,
+}
+
+
+def raise_rate_limits():
+    """ベンチマークではレート制限で頭打ちにならないよう上限を引き上げる"""
+    for model in ("WHISPER_1", "GPT_4O", "GPT_4O_MINI"):
+        os.environ.setdefault(f"RATE_LIMIT_{model}_RPM", "1000000")
+        os.environ.setdefault(f"RATE_LIMIT_{model}_TPM", "1000000000")
+
+
+def measure(operation, concurrency: int, iterations: int) -> dict:
+    """
+    operation を同時実行数 concurrency で合計 iterations 回実行して計測
+
+    Returns:
+        {"concurrency", "iterations", "errors", "throughput_per_s", "p50_ms", "p95_ms", "max_ms"}
+    """
+    latencies: list[float] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def run_once(_):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            ok = operation()
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if ok is False:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(run_once, range(iterations)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "iterations": iterations,
+        "errors": errors,
+        "throughput_per_s": round(iterations / wall, 3),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+    }
+
+
+def run_benchmarks(
+    concurrency_levels: list[int],
+    iterations: int,
+    video_seconds: float,
+    latency: float,
+    jitter: float,
+    failure_rate: float,
+) -> dict:
+    """全ベンチマークを実行して結果を返す"""
+    raise_rate_limits()
+
+    from openai import OpenAI
+
+    from services.database import get_db_connection, release_db_connection, save_conversation_to_db
+    from services.storage import SQLiteBackend
+    from services.face_analysis import extract_frames_from_webm
+    from services.pipeline import process_session
+
+    workdir = tempfile.mkdtemp(prefix="abc_bench_")
+    try:
+        video_path = make_synthetic_webm(os.path.join(workdir, "session.webm"), seconds=video_seconds)
+        with open(video_path, "rb") as f:
+            video_data = f.read()
+
+        server, base_url = start_fake_openai_server(
+            FakeOpenAIConfig(latency=latency, jitter=jitter, failure_rate=failure_rate, seed=0)
+        )
+        client = OpenAI(api_key="benchmark", base_url=base_url, max_retries=0)
+
+        conn = get_db_connection()
+        if conn is not None:
+            release_db_connection(conn)
+            db_backend = "postgres"
+            save = save_conversation_to_db
+        else:
+            db_backend = "sqlite"
+            save = SQLiteBackend(os.path.join(workdir, "bench.sqlite3")).save_conversation
+
+        def frames():
+            return len(extract_frames_from_webm(video_data)) > 0
+
+        def pipeline():
+            _, status = asyncio.run(process_session(video_data, (0.3, -0.2), username=None, client=client))
+            return status == "completed"
+
+        def db_save():
+            data = dict(SAMPLE_CONVERSATION, timestamp=datetime.now().isoformat())
+            return save(data, "benchmark_user")
+
+        results = {
+            "meta": {
+                "created_at": datetime.now().isoformat(timespec="seconds"),
+                "video_seconds": video_seconds,
+                "video_bytes": len(video_data),
+                "fake_latency": latency,
+                "fake_jitter": jitter,
+                "fake_failure_rate": failure_rate,
+                "db_backend": db_backend,
+            },
+            "benchmarks": {},
+        }
+        try:
+            for name, operation in (("frame_extraction", frames), ("pipeline", pipeline), ("db_save", db_save)):
+                results["benchmarks"][name] = [
+                    measure(operation, level, iterations) for level in concurrency_levels
+                ]
+        finally:
+            server.shutdown()
+        return results
+    finally:
+        # 録画・SQLiteのファイルを残さない
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def find_regressions(results: dict, baseline: dict, max_regression: float) -> list[str]:
+    """ベースラインと比べて p95 が max_regression（割合）以上悪化した項目"""
+    regressions = []
+    for name, rows in results["benchmarks"].items():
+        base_rows = {row["concurrency"]: row for row in baseline.get("benchmarks", {}).get(name, [])}
+        for row in rows:
+            base = base_rows.get(row["concurrency"])
+            if base and base["p95_ms"] > 0 and row["p95_ms"] > base["p95_ms"] * (1 + max_regression):
+                regressions.append(
+                    f"{name} (concurrency={row['concurrency']}): p95 {base['p95_ms']}ms → {row['p95_ms']}ms"
+                )
+    return regressions
+
+
+def print_table(results: dict):
+    print(f"{'benchmark':<18}{'conc':>6}{'thr/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'errors':>8}")
+    for name, rows in results["benchmarks"].items():
+        for row in rows:
+            print(
+                f"{name:<18}{row['concurrency']:>6}{row['throughput_per_s']:>10}"
+                f"{row['p50_ms']:>10}{row['p95_ms']:>10}{row['max_ms']:>10}{row['errors']:>8}"
+            )
+    print(f"(DB: {results['meta']['db_backend']}, video: {results['meta']['video_bytes']:,} bytes)")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="サービス層のベンチマーク")
+    parser.add_argument("--concurrency", default="1,4,8", help="同時実行数（カンマ区切り）")
+    parser.add_argument("--iterations", type=int, default=16, help="同時実行数ごとの実行回数")
+    parser.add_argument("--video-seconds", type=float, default=30.0)
+    parser.add_argument("--latency", type=float, default=0.2, help="疑似APIの平均遅延（秒）")
+    parser.add_argument("--jitter", type=float, default=0.05, help="疑似APIの遅延のばらつき（秒）")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="疑似APIの500エラー率")
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    parser.add_argument("--baseline", help="比較するベースライン結果（JSON）")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="許容するp95の悪化率")
+    args = parser.parse_args(argv)
+
+    levels = [int(level) for level in args.concurrency.split(",") if level]
+    results = run_benchmarks(
+        levels, args.iterations, args.video_seconds, args.latency, args.jitter, args.failure_rate
+    )
+    print_table(results)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = find_regressions(results, json.load(f), args.max_regression)
+        for line in regressions:
+            print(f"REGRESSION: {line}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
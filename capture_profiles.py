@@ -0,0 +1,85 @@
+"""WebRTC録画のキャプチャプロファイル
+
+ブラウザから送信する映像の解像度・フレームレート、音声の設定と、
+サーバー側で録画ファイルを書き出す MediaRecorder の設定をまとめて定義します。
+
+表情認識は5秒に1フレームしか使わないため、既定では解像度とフレームレートを
+抑えた "analysis-optimized" を使用します（CAPTURE_PROFILE で変更可能）。
+"""
+
+from services.config import get_setting
+
+DEFAULT_PROFILE = "analysis-optimized"
+
+# 音声はWhisperでの文字起こし用にモノラル・ノイズ抑制を有効にする
+_SPEECH_AUDIO = {
+    "channelCount": 1,
+    "echoCancellation": True,
+    "noiseSuppression": True,
+    "autoGainControl": True,
+}
+
+CAPTURE_PROFILES = {
+    "browser-default": {
+        "label": "ブラウザの既定値",
+        "description": "ブラウザ・カメラの既定の解像度とフレームレートで録画します。",
+        "media_stream_constraints": {"video": True, "audio": True},
+        "recorder_format": None,
+        "recorder_options": None,
+    },
+    "analysis-optimized": {
+        "label": "分析向け（推奨）",
+        "description": "640×480・15fps。表情認識に十分な画質で、ファイルサイズを抑えます。",
+        "media_stream_constraints": {
+            "video": {
+                "width": {"ideal": 640, "max": 640},
+                "height": {"ideal": 480, "max": 480},
+                "frameRate": {"ideal": 15, "max": 15},
+            },
+            "audio": _SPEECH_AUDIO,
+        },
+        "recorder_format": "webm",
+        "recorder_options": None,
+    },
+    "low-bandwidth": {
+        "label": "低帯域",
+        "description": "320×240・8fps。回線が遅い環境向けです。",
+        "media_stream_constraints": {
+            "video": {
+                "width": {"ideal": 320, "max": 320},
+                "height": {"ideal": 240, "max": 240},
+                "frameRate": {"ideal": 8, "max": 8},
+            },
+            "audio": _SPEECH_AUDIO,
+        },
+        "recorder_format": "webm",
+        "recorder_options": None,
+    },
+}
+
+
+def get_default_profile_name() -> str:
+    """設定（CAPTURE_PROFILE）で指定された既定のプロファイル名"""
+    name = get_setting("CAPTURE_PROFILE", DEFAULT_PROFILE)
+    return name if name in CAPTURE_PROFILES else DEFAULT_PROFILE
+
+
+def get_capture_profile(name: str | None = None) -> dict:
+    """
+    キャプチャプロファイルを取得
+
+    Args:
+        name: プロファイル名（None または未定義の場合は既定のプロファイル）
+
+    Returns:
+        {
+            "label": str,
+            "description": str,
+            "media_stream_constraints": dict,  # webrtc_streamer に渡す値
+            "recorder_format": str | None,  # MediaRecorder の format
+            "recorder_options": dict | None,  # MediaRecorder の options（コンテナ設定）
+        }
+    """
+    if name not in CAPTURE_PROFILES:
+        name = get_default_profile_name()
+    return CAPTURE_PROFILES[name]
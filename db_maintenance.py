@@ -0,0 +1,122 @@
+"""conversation_history のパーティション管理・保持期間の適用（定期実行用CLI）
+
+- 今月から --months-ahead か月先までのパーティションを作成します
+- 保持期間（--retention-months）を過ぎたパーティションを削除します。
+  --archive-dir を指定した場合は、削除前にパーティションごとにファイルへ書き出します
+- 期間の一部だけが保持期間を過ぎたパーティション（移行前のテーブル・デフォルトパーティション）は、
+  保持期間を過ぎた行だけを削除します
+
+パーティション単位の削除は DROP TABLE のため、行ごとの DELETE と違って
+テーブルの肥大化やVACUUMの負荷が発生しません。
+
+使用例（cronなどで毎日実行）:
+    python db_maintenance.py --retention-months 12 --archive-dir archives/
+"""
+
+import argparse
+import logging
+import os
+import sys
+from datetime import datetime
+
+logger = logging.getLogger("db_maintenance")
+
+
+def run_maintenance(
+    months_ahead: int | None,
+    retention_months: int,
+    archive_dir: str | None = None,
+    archive_format: str = "csv",
+) -> dict:
+    """
+    パーティションの作成と保持期間の適用
+
+    Args:
+        months_ahead: 事前に作成するパーティションの月数（Noneの場合は HISTORY_PARTITION_MONTHS_AHEAD）
+        retention_months: 保持する月数（今月を含まない。0の場合は削除しない）
+        archive_dir: 削除する行の書き出し先（Noneの場合は書き出さずに削除）
+        archive_format: 書き出す形式（"csv" / "jsonl" / "parquet"）
+
+    Returns:
+        {"created": list[str], "dropped": list[str], "deleted_rows": int}
+    """
+    from services import database
+
+    if not database.init_database():
+        raise RuntimeError("データベースに接続できません（DATABASE_URL を確認してください）")
+    created = database.ensure_partitions(months_ahead)
+    if created is None:
+        raise RuntimeError("パーティションを作成できませんでした")
+    summary = {"created": created, "dropped": [], "deleted_rows": 0}
+    if retention_months <= 0:
+        return summary
+
+    from history_transfer import export_history
+
+    cutoff = database.add_months(database.month_start(datetime.now()), -retention_months)
+    logger.info(f"{cutoff:%Y-%m-%d} より前の行を削除します")
+    if archive_dir:
+        os.makedirs(archive_dir, exist_ok=True)
+
+    for name in database.expired_partitions(cutoff) or []:
+        if archive_dir:
+            path = os.path.join(archive_dir, f"{name}.{archive_format}")
+            count = export_history(path, archive_format, table=name)
+            logger.info(f"{name}: {count}行を書き出しました（{path}）")
+        if database.drop_partition(name):
+            summary["dropped"].append(name)
+
+    # パーティション単位で削除できない行（移行前のテーブル・デフォルトパーティション）
+    if archive_dir:
+        path = os.path.join(archive_dir, f"conversation_history_before_{cutoff:%Y%m%d}.{archive_format}")
+        count = export_history(path, archive_format, until=cutoff)
+        if count == 0:
+            os.remove(path)
+        else:
+            logger.info(f"{count}行を書き出しました（{path}）")
+    deleted = database.delete_rows_before(cutoff)
+    if deleted < 0:
+        raise RuntimeError("保持期間を過ぎた行を削除できませんでした")
+    summary["deleted_rows"] = deleted
+    return summary
+
+
+def main(argv: list[str] | None = None) -> int:
+    from services.config import get_setting
+
+    parser = argparse.ArgumentParser(description="conversation_history のパーティション管理・保持期間の適用")
+    parser.add_argument(
+        "--months-ahead",
+        type=int,
+        default=None,
+        help="事前に作成するパーティションの月数（デフォルト: HISTORY_PARTITION_MONTHS_AHEAD）",
+    )
+    parser.add_argument(
+        "--retention-months",
+        type=int,
+        default=int(get_setting("HISTORY_RETENTION_MONTHS", 0)),
+        help="保持する月数（デフォルト: HISTORY_RETENTION_MONTHS、0の場合は削除しない）",
+    )
+    parser.add_argument("--archive-dir", default=None, help="削除する行を書き出すディレクトリ")
+    parser.add_argument("--archive-format", choices=("csv", "jsonl", "parquet"), default="csv")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    try:
+        summary = run_maintenance(
+            args.months_ahead, args.retention_months, args.archive_dir, args.archive_format
+        )
+    except (RuntimeError, OSError) as e:
+        logger.error(str(e))
+        return 1
+    logger.info(
+        f"作成: {', '.join(summary['created']) or 'なし'} / "
+        f"削除: {', '.join(summary['dropped']) or 'なし'} / "
+        f"削除した行: {summary['deleted_rows']}"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
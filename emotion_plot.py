@@ -0,0 +1,137 @@
+"""ステップ1の感情プロット（Plotly）
+
+グリッド線・クリック用の不可視グリッド・レイアウトは変化しないため、
+プロセスにつき1回だけ構築してキャッシュします。セッションごとの図は
+初回にだけ作成してセッション状態に保持し、再実行ごとには
+現在の点・保存済みの点のトレースの座標だけを更新します。
+"""
+
+import numpy as np
+import plotly.graph_objects as go
+import streamlit as st
+
+# クリック可能なグリッドの間隔
+GRID_STEP = 0.1
+
+# セッションごとの図を保持するセッション状態のキー
+FIGURE_STATE_KEY = "emotion_figure"
+
+
+@st.cache_resource
+def _base_figure() -> go.Figure:
+    """感情プロットの基本図（グリッド線・クリック用グリッド・レイアウト）"""
+    fig = go.Figure()
+
+    # 背景グリッド
+    for i in (-1, 1):
+        fig.add_hline(
+            y=i * 0.5,
+            line_width=0.5,
+            line_color="lightgray",
+            line_dash="dot",
+            opacity=0.3,
+        )
+        fig.add_vline(
+            x=i * 0.5,
+            line_width=0.5,
+            line_color="lightgray",
+            line_dash="dot",
+            opacity=0.3,
+        )
+
+    fig.add_hline(y=0, line_width=2, line_color="black", opacity=0.5)
+    fig.add_vline(x=0, line_width=2, line_color="black", opacity=0.5)
+
+    # クリック可能なグリッド（-1.0 ～ 1.0 を GRID_STEP 間隔で敷き詰める）
+    ticks = np.round(np.arange(-1.0, 1.0 + GRID_STEP / 2, GRID_STEP), 2)
+    grid_x, grid_y = np.meshgrid(ticks, ticks)
+    fig.add_trace(
+        go.Scatter(
+            x=grid_x.ravel(),
+            y=grid_y.ravel(),
+            mode="markers",
+            marker=dict(size=8, opacity=0.01, color="gray"),
+            showlegend=False,
+            hoverinfo="skip",
+        )
+    )
+
+    fig.update_layout(
+        xaxis=dict(
+            range=[-1.1, 1.1], title="Pleasure (不快 ← 0 → 快)", zeroline=False
+        ),
+        yaxis=dict(
+            range=[-1.1, 1.1],
+            title="Arousal (非覚醒 ← 0 → 覚醒)",
+            zeroline=False,
+            scaleanchor="x",
+            scaleratio=1,
+        ),
+        title="Current Emotion Point (グラフ上をクリックして移動)",
+        width=500,
+        height=500,
+        dragmode="select",
+        hovermode="closest",
+        plot_bgcolor="white",
+        paper_bgcolor="white",
+    )
+    return fig
+
+
+def _session_figure() -> go.Figure:
+    """点のトレースを含む図を作成（セッションにつき1回。キャッシュ済みの基本図は変更しない）"""
+    base = _base_figure()
+    current = go.Scatter(
+        x=[0.0],
+        y=[0.0],
+        mode="markers",
+        marker=dict(size=20, color="red", line=dict(width=3, color="darkred")),
+        showlegend=False,
+        hovertemplate="<b>現在の座標</b><br>X: %{x:.2f}<br>Y: %{y:.2f}<extra></extra>",
+    )
+    saved = go.Scatter(
+        x=[0.0],
+        y=[0.0],
+        mode="markers",
+        marker=dict(
+            size=15,
+            color="lightblue",
+            line=dict(width=2, color="blue"),
+            opacity=0.7,
+            symbol="circle-open",
+        ),
+        showlegend=False,
+        visible=False,
+        hovertemplate="<b>保存済み座標</b><br>X: %{x:.2f}<br>Y: %{y:.2f}<extra></extra>",
+    )
+    # クリック用グリッドを最前面に置くため、点のトレースを先に並べる
+    return go.Figure(data=[current, saved, *base.data], layout=base.layout)
+
+
+def build_emotion_figure(
+    current: tuple[float, float], saved: tuple[float, float]
+) -> go.Figure:
+    """
+    現在の点と保存済みの点を描いた感情プロットを取得
+
+    Args:
+        current: スライダーの現在値 (x, y)
+        saved: 保存済みの感情座標 (x, y)
+
+    Returns:
+        st.plotly_chart に渡す図。セッション状態に保持した図の点の座標だけを更新して返す
+    """
+    fig = st.session_state.get(FIGURE_STATE_KEY)
+    if fig is None:
+        fig = _session_figure()
+        st.session_state[FIGURE_STATE_KEY] = fig
+
+    x, y = current
+    saved_x, saved_y = saved
+    with fig.batch_update():
+        fig.data[0].x = [x]
+        fig.data[0].y = [y]
+        fig.data[1].x = [saved_x]
+        fig.data[1].y = [saved_y]
+        fig.data[1].visible = abs(saved_x - x) > 0.01 or abs(saved_y - y) > 0.01
+    return fig
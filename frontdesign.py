@@ -1,17 +1,34 @@
 """メインページ - ステップバイステップで自動進行"""
 
 import os
-import tempfile
+import time
 import asyncio
+
+# 初回描画までの時間（コールドスタート）の計測開始
+_script_started_at = time.perf_counter()
+
 import streamlit as st
-import plotly.graph_objects as go
 from datetime import datetime
-from aiortc.contrib.media import MediaRecorder
-from streamlit_webrtc import WebRtcMode, webrtc_streamer, RTCConfiguration
-from utils import init_session_state, get_openai_client, save_conversation
-from services.transcription import transcribe_video
-from services.face_analysis import analyze_face_emotion
-from services.ai_chat import generate_ai_response
+from utils import (
+    init_session_state,
+    get_openai_client,
+    save_conversation,
+    search_conversation_history,
+    load_emotion_trends,
+    start_metrics_endpoint,
+    is_diagnostics_enabled,
+)
+from capture_profiles import (
+    CAPTURE_PROFILES,
+    get_capture_profile,
+    get_default_profile_name,
+)
+from services.metrics import get_registry
+from services.recording_store import discard_recording, new_recording_path
+from warmup import report_first_render, start_background_warmup
+
+# 重いモジュール（plotly, cv2, aiortc, streamlit_webrtc, openai, psycopg2, numpy）と
+# 分析・AI応答のサービスは使用するステップで読み込み、初回描画後にバックグラウンドで事前読み込みする
 
 # asyncioの例外ハンドラーを設定して、aioiceの内部エラーを抑制
 def suppress_aioice_errors(loop, context):
@@ -52,6 +69,7 @@ st.set_page_config(
 
 # セッション状態の初期化
 init_session_state()
+start_metrics_endpoint()
 
 # ユーザー名のチェックと入力フォーム
 if "username" not in st.session_state or not st.session_state["username"]:
@@ -80,16 +98,21 @@ if "username" not in st.session_state or not st.session_state["username"]:
                 st.rerun()
             else:
                 st.error("ユーザー名を入力してください。")
-    
+
+    report_first_render(time.perf_counter() - _script_started_at)
+    start_background_warmup()
     st.stop()  # ユーザー名が設定されるまで処理を停止
 
+# 録画中に状態表示を更新する間隔（秒）
+RECORDING_STATUS_INTERVAL = 2
+
+# 対話履歴の検索結果の1ページあたりの件数
+HISTORY_SEARCH_PAGE_SIZE = 10
+
 # 現在のステップを管理（1: 感情入力, 2: 録画録音, 3: 対話結果）
 if "current_step" not in st.session_state:
     st.session_state["current_step"] = 1
 
-# OpenAIクライアントの取得
-client = get_openai_client()
-
 st.title("🧘 AI対話振り返りメディテーション（MVP）")
 # ユーザー名の表示
 st.caption(f"👤 ユーザー: {st.session_state['username']}")
@@ -108,167 +131,89 @@ st.markdown("---")
 # ステップ1: 感情入力
 # ============================
 if st.session_state["current_step"] == 1:
+    from emotion_plot import build_emotion_figure
+
     st.subheader("ステップ1: 🎭 感情入力")
     st.markdown("今の気持ちを2次元の感情プロットで入力してください。")
 
-    left, right = st.columns([1, 1], gap="large")
+    @st.fragment
+    def render_emotion_input():
+        """感情入力（スライダー・プロット操作はこのフラグメントだけを再実行）"""
+        left, right = st.columns([1, 1], gap="large")
 
-    with left:
-        st.write("**① 今の感情を入力（2D）**")
+        with left:
+            st.write("**① 今の感情を入力（2D）**")
 
-        x = st.slider(
-            "X軸：不快 ← 0 → 快",
-            min_value=-1.0,
-            max_value=1.0,
-            value=float(st.session_state["emotion_coords"][0]),
-            step=0.01,
-        )
-        y = st.slider(
-            "Y軸：非覚醒（落ち着き） ← 0 → 覚醒",
-            min_value=-1.0,
-            max_value=1.0,
-            value=float(st.session_state["emotion_coords"][1]),
-            step=0.01,
-        )
+            x = st.slider(
+                "X軸：不快 ← 0 → 快",
+                min_value=-1.0,
+                max_value=1.0,
+                value=float(st.session_state["emotion_coords"][0]),
+                step=0.01,
+            )
+            y = st.slider(
+                "Y軸：非覚醒（落ち着き） ← 0 → 覚醒",
+                min_value=-1.0,
+                max_value=1.0,
+                value=float(st.session_state["emotion_coords"][1]),
+                step=0.01,
+            )
 
-        if st.button(
-            "この座標で決定 / 次へ進む", type="primary", width='stretch'
-        ):
-            st.session_state["emotion_coords"] = (float(x), float(y))
-            st.session_state["current_step"] = 2
-            st.success(f"保存しました: {st.session_state['emotion_coords']}")
-            st.rerun()
-
-    with right:
-        st.write("**感情プロット（可視化・クリックで移動）**")
-
-        # Plotlyグラフ作成
-        fig = go.Figure()
-
-        # 背景グリッド
-        for i in range(-1, 2):
-            if i != 0:
-                fig.add_hline(
-                    y=i * 0.5,
-                    line_width=0.5,
-                    line_color="lightgray",
-                    line_dash="dot",
-                    opacity=0.3,
-                )
-                fig.add_vline(
-                    x=i * 0.5,
-                    line_width=0.5,
-                    line_color="lightgray",
-                    line_dash="dot",
-                    opacity=0.3,
-                )
+            if st.button(
+                "この座標で決定 / 次へ進む", type="primary", width='stretch'
+            ):
+                st.session_state["emotion_coords"] = (float(x), float(y))
+                st.session_state["current_step"] = 2
+                st.success(f"保存しました: {st.session_state['emotion_coords']}")
+                st.rerun()
 
-        fig.add_hline(y=0, line_width=2, line_color="black", opacity=0.5)
-        fig.add_vline(x=0, line_width=2, line_color="black", opacity=0.5)
-
-        # 現在の点
-        fig.add_trace(
-            go.Scatter(
-                x=[x],
-                y=[y],
-                mode="markers",
-                marker=dict(size=20, color="red", line=dict(width=3, color="darkred")),
-                showlegend=False,
-                hovertemplate="<b>現在の座標</b><br>X: %{x:.2f}<br>Y: %{y:.2f}<extra></extra>",
-            )
-        )
+        with right:
+            st.write("**感情プロット（可視化・クリックで移動）**")
 
-        # 保存済みの点
-        saved_x, saved_y = st.session_state["emotion_coords"]
-        if abs(saved_x - x) > 0.01 or abs(saved_y - y) > 0.01:
-            fig.add_trace(
-                go.Scatter(
-                    x=[saved_x],
-                    y=[saved_y],
-                    mode="markers",
-                    marker=dict(
-                        size=15,
-                        color="lightblue",
-                        line=dict(width=2, color="blue"),
-                        opacity=0.7,
-                        symbol="circle-open",
-                    ),
-                    showlegend=False,
-                    hovertemplate="<b>保存済み座標</b><br>X: %{x:.2f}<br>Y: %{y:.2f}<extra></extra>",
-                )
-            )
+            # Plotlyグラフ作成（図はセッションごとに保持し、点の座標のみ毎回更新）
+            fig = build_emotion_figure((x, y), st.session_state["emotion_coords"])
 
-        # クリック可能なグリッド
-        grid_step = 0.1
-        grid_x_points = [
-            i * grid_step
-            for i in range(int(-1.0 / grid_step), int(1.0 / grid_step) + 1)
-        ]
-        grid_y_points = [
-            i * grid_step
-            for i in range(int(-1.0 / grid_step), int(1.0 / grid_step) + 1)
-        ]
-        grid_x_all = [gx for gx in grid_x_points for _ in grid_y_points]
-        grid_y_all = [gy for gy in grid_y_points for _ in grid_x_points]
-
-        fig.add_trace(
-            go.Scatter(
-                x=grid_x_all,
-                y=grid_y_all,
-                mode="markers",
-                marker=dict(size=8, opacity=0.01, color="gray"),
-                showlegend=False,
-                hoverinfo="skip",
+            selection = st.plotly_chart(
+                fig, width='stretch', on_select="rerun", key="emotion_plot"
             )
-        )
 
-        fig.update_layout(
-            xaxis=dict(
-                range=[-1.1, 1.1], title="Pleasure (不快 ← 0 → 快)", zeroline=False
-            ),
-            yaxis=dict(
-                range=[-1.1, 1.1],
-                title="Arousal (非覚醒 ← 0 → 覚醒)",
-                zeroline=False,
-                scaleanchor="x",
-                scaleratio=1,
-            ),
-            title="Current Emotion Point (グラフ上をクリックして移動)",
-            width=500,
-            height=500,
-            dragmode="select",
-            hovermode="closest",
-            plot_bgcolor="white",
-            paper_bgcolor="white",
-        )
-
-        selection = st.plotly_chart(
-            fig, width='stretch', on_select="rerun", key="emotion_plot"
-        )
+            if selection and hasattr(selection, "selection") and selection.selection.points:
+                try:
+                    for point_data in selection.selection.points:
+                        if len(point_data) >= 2:
+                            clicked_x = max(-1.0, min(1.0, float(point_data[0])))
+                            clicked_y = max(-1.0, min(1.0, float(point_data[1])))
+                            st.session_state["emotion_coords"] = (clicked_x, clicked_y)
+                            st.success(
+                                f"座標を更新しました: ({clicked_x:.2f}, {clicked_y:.2f})"
+                            )
+                            st.rerun(scope="fragment")
+                            break
+                except (AttributeError, IndexError, ValueError):
+                    pass
 
-        if selection and hasattr(selection, "selection") and selection.selection.points:
-            try:
-                for point_data in selection.selection.points:
-                    if len(point_data) >= 2:
-                        clicked_x = max(-1.0, min(1.0, float(point_data[0])))
-                        clicked_y = max(-1.0, min(1.0, float(point_data[1])))
-                        st.session_state["emotion_coords"] = (clicked_x, clicked_y)
-                        st.success(
-                            f"座標を更新しました: ({clicked_x:.2f}, {clicked_y:.2f})"
-                        )
-                        st.rerun()
-                        break
-            except (AttributeError, IndexError, ValueError):
-                pass
+            st.info(
+                f"スライダー現在値: (x, y)=({x:.2f}, {y:.2f}) / 保存済み: {st.session_state['emotion_coords']}"
+            )
 
-        st.info(
-            f"スライダー現在値: (x, y)=({x:.2f}, {y:.2f}) / 保存済み: {st.session_state['emotion_coords']}"
-        )
+    render_emotion_input()
 
 # ============================
 # ステップ2: 録画録音
 # ============================
 elif st.session_state["current_step"] == 2:
+    from aiortc.contrib.media import MediaRecorder
+    from streamlit_webrtc import WebRtcMode, webrtc_streamer, RTCConfiguration
+
+    from services.embeddings import prepare_similar_sessions
+    from services.pipeline import analyze_recording
+
+    # OpenAIクライアントの取得
+    client = get_openai_client()
+
+    # ステップ3の似ている過去の対話の検索に備え、録画中にユーザーの検索インデックスを準備する
+    prepare_similar_sessions(st.session_state.get("username"), client)
+
     st.subheader("ステップ2: 📹 録画・録音")
     st.markdown("録画を開始して、終了後に自動で分析へ進みます。")
     st.info(
@@ -280,20 +225,41 @@ elif st.session_state["current_step"] == 2:
         "recording_path" not in st.session_state
         or st.session_state["recording_path"] is None
     ):
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".webm")
-        st.session_state["recording_path"] = temp_file.name
-        temp_file.close()
+        st.session_state["recording_path"] = new_recording_path(
+            st.session_state["recording_session_id"]
+        )
 
-    # クロージャでrecording_pathをキャプチャ（別スレッドからアクセスするため）
-    recording_path_value = st.session_state["recording_path"]
+    @st.fragment
+    def render_recorder():
+        """録画コントロール（WebRTCの状態変化ではこのフラグメントだけを再実行）"""
+        st.write("**② 録画コントロール**")
 
-    def in_recorder_factory():
-        st.session_state["recorder_created"] = True
-        st.session_state["recorder_created_at"] = datetime.now().isoformat(timespec="seconds")
-        return MediaRecorder(recording_path_value)
+        # キャプチャプロファイル（解像度・フレームレート・録画形式）
+        if "capture_profile" not in st.session_state:
+            st.session_state["capture_profile"] = get_default_profile_name()
+        profile_names = list(CAPTURE_PROFILES)
+        st.selectbox(
+            "録画品質",
+            profile_names,
+            format_func=lambda name: CAPTURE_PROFILES[name]["label"],
+            key="capture_profile",
+            help="次回の録画開始から適用されます。",
+        )
+        capture_profile = get_capture_profile(st.session_state["capture_profile"])
+        st.caption(capture_profile["description"])
+
+        # クロージャでrecording_pathと録画設定をキャプチャ（別スレッドからアクセスするため）
+        recording_path_value = st.session_state["recording_path"]
+        recorder_format = capture_profile["recorder_format"]
+        recorder_options = capture_profile["recorder_options"]
+
+        def in_recorder_factory():
+            st.session_state["recorder_created"] = True
+            st.session_state["recorder_created_at"] = datetime.now().isoformat(timespec="seconds")
+            return MediaRecorder(
+                recording_path_value, format=recorder_format, options=recorder_options
+            )
 
-    with left2:
-        st.write("**② 録画コントロール**")
         try:
             # STUN/TURNサーバーの設定（複数のSTUNサーバーを使用）
             # Streamlit Cloud環境では、TURNサーバーが必要な場合があります
@@ -317,7 +283,7 @@ elif st.session_state["current_step"] == 2:
             ctx = webrtc_streamer(
                 key="recorder",
                 mode=WebRtcMode.SENDRECV,
-                media_stream_constraints={"video": True, "audio": True},
+                media_stream_constraints=capture_profile["media_stream_constraints"],
                 in_recorder_factory=in_recorder_factory,
                 async_processing=False,
                 rtc_configuration=rtc_configuration,
@@ -332,26 +298,23 @@ elif st.session_state["current_step"] == 2:
                     st.session_state["recording_started_at"] = datetime.now().isoformat(
                         timespec="seconds"
                     )
-                    st.session_state["recorded_video_data"] = None
+                    # 前回の録画ファイルは不要になるため削除
+                    discard_recording(st.session_state["recorded_video_path"])
+                    st.session_state["recorded_video_path"] = None
                     st.session_state["transcription_result"] = None
                     st.session_state["transcription_status"] = "idle"
+                    st.session_state["transcript_segments_result"] = None
                     st.session_state["face_emotion_result"] = None
                     st.session_state["face_emotion_status"] = "idle"
+                    st.session_state["acoustic_features_result"] = None
                     st.session_state["ai_response"] = None
+                    st.session_state["similar_sessions"] = None
                     st.session_state["analysis_trigger"] = False
+                    # 状態表示のポーリングを開始するため、ページ全体を1回だけ再実行
+                    st.rerun()
 
                 if is_playing:
                     st.success("✅ 録画中...")
-                    # 録画中のデバッグ情報
-                    recording_path = st.session_state.get("recording_path")
-                    if recording_path:
-                        if os.path.exists(recording_path):
-                            file_size = os.path.getsize(recording_path)
-                            st.caption(f"📹 録画ファイル: {os.path.basename(recording_path)} ({file_size:,} bytes)")
-                        else:
-                            st.caption(f"⚠️ 録画ファイル: {os.path.basename(recording_path)} (まだ作成されていません)")
-                    if st.session_state.get("recorder_created"):
-                        st.caption(f"🎙️ レコーダー作成時刻: {st.session_state.get('recorder_created_at', 'N/A')}")
                 else:
                     # 接続は確立されているが、録画が開始されていない場合
                     if hasattr(ctx.state, 'ice_connection_state') and ctx.state.ice_connection_state == "connected":
@@ -366,11 +329,9 @@ elif st.session_state["current_step"] == 2:
                                 st.warning(
                                     "⚠️ 録画ファイルが小さすぎます。音声が録音されていない可能性があります。ブラウザのマイク許可を確認してください。"
                                 )
-                            with open(recording_path, "rb") as f:
-                                recorded_bytes = f.read()
-                            st.session_state["recorded_video_data"] = recorded_bytes
+                            # 録画データはメモリに読み込まず、ファイルパスのみ保持する
+                            st.session_state["recorded_video_path"] = recording_path
                             st.session_state["analysis_trigger"] = True
-                            os.remove(recording_path)
                             st.session_state["recording_path"] = None
                             st.success("録画データを受け取りました。分析を開始します。")
                             st.rerun()
@@ -480,11 +441,8 @@ elif st.session_state["current_step"] == 2:
                             st.warning(
                                 "⚠️ 録画ファイルが小さすぎます。音声が録音されていない可能性があります。ブラウザのマイク許可を確認してください。"
                             )
-                        with open(recording_path, "rb") as f:
-                            recorded_bytes = f.read()
-                        st.session_state["recorded_video_data"] = recorded_bytes
+                        st.session_state["recorded_video_path"] = recording_path
                         st.session_state["analysis_trigger"] = True
-                        os.remove(recording_path)
                         st.session_state["recording_path"] = None
                         st.success("録画データを受け取りました。分析を開始します。")
                         st.rerun()
@@ -492,14 +450,36 @@ elif st.session_state["current_step"] == 2:
                         st.error(f"録画ファイルの処理中にエラーが発生しました: {cleanup_error}")
             st.info("停止中")
 
-    with right2:
-        st.write("**③ 状態**")
+    def render_recording_status():
+        """録画の状態表示（録画中は定期的にこのフラグメントだけを再実行）"""
         if st.session_state["recording_started_at"]:
             st.write(f"開始時刻: {st.session_state['recording_started_at']}")
+        if st.session_state["was_playing"]:
+            # 録画中のデバッグ情報
+            recording_path = st.session_state.get("recording_path")
+            if recording_path:
+                if os.path.exists(recording_path):
+                    file_size = os.path.getsize(recording_path)
+                    st.caption(f"📹 録画ファイル: {os.path.basename(recording_path)} ({file_size:,} bytes)")
+                else:
+                    st.caption(f"⚠️ 録画ファイル: {os.path.basename(recording_path)} (まだ作成されていません)")
+            if st.session_state.get("recorder_created"):
+                st.caption(f"🎙️ レコーダー作成時刻: {st.session_state.get('recorder_created_at', 'N/A')}")
+
+    with left2:
+        render_recorder()
+
+    with right2:
+        st.write("**③ 状態**")
+        # 録画中のみポーリングする
+        st.fragment(
+            render_recording_status,
+            run_every=RECORDING_STATUS_INTERVAL if st.session_state["was_playing"] else None,
+        )()
         st.info("録画を止めると自動で分析に進みます。")
 
         # 文字起こしが完了している場合、手動で次へ進むボタンを表示
-        if st.session_state.get("transcription_status") == "completed":
+        if st.session_state.get("transcription_status") in ("completed", "no_speech"):
             st.markdown("---")
             if st.button(
                 "✅ 次のステップへ（対話結果）",
@@ -517,84 +497,78 @@ elif st.session_state["current_step"] == 2:
 
         # 録画データがある場合、文字起こしと表情認識処理を自動実行
         if (
-            st.session_state["recorded_video_data"] is not None
+            st.session_state["recorded_video_path"] is not None
             and client is not None
             and "OPENAI_API_KEY" in st.secrets
         ):
-            # 文字起こし処理
+            # 文字起こしと表情認識を並行実行（services/pipeline.py）
             with st.status(
-                "録画データから音声を抽出して文字起こし中...", expanded=True
+                "録画データから文字起こしと表情認識を並行実行中...", expanded=True
             ) as status:
+                st.write("Whisper APIに送信中...（動画ファイルから音声を抽出）")
+                st.write("動画ファイルから5秒ごとにフレームを抽出し、GPT-4o Vision APIに送信中...")
+                st.session_state["transcription_status"] = "processing"
+                st.session_state["face_emotion_status"] = "processing"
                 try:
-                    st.write("動画ファイルを読み込んでいます...")
-                    st.write("Whisper APIに送信中...（動画ファイルから音声を抽出）")
-                    st.session_state["transcription_status"] = "processing"
-
-                    # バックエンドサービスを呼び出し
-                    transcription_text, transcription_status = transcribe_video(
-                        st.session_state["recorded_video_data"], client
-                    )
-
-                    if transcription_status == "completed":
-                        st.session_state["transcription_result"] = transcription_text
-                        st.session_state["transcription_status"] = "completed"
-                        status.update(
-                            label="文字起こし完了！",
-                            state="complete",
-                            expanded=False,
+                    run = asyncio.run(
+                        analyze_recording(
+                            st.session_state["recorded_video_path"], client
                         )
-                    else:
-                        st.session_state["transcription_status"] = "error"
-                        st.error("文字起こし処理中にエラーが発生しました")
-                        status.update(label="エラー発生", state="error")
+                    )
                 except Exception as e:
+                    run = {"results": {}, "statuses": {}, "timings": {}}
+                    st.error(f"分析エラー: {e}")
+
+                if run["statuses"].get("transcription") == "completed":
+                    transcript = run["results"]["transcription"]
+                    st.session_state["transcription_result"] = transcript["text"]
+                    st.session_state["transcript_segments_result"] = transcript["segments"]
+                    st.session_state["transcription_status"] = "completed"
+                elif run["statuses"].get("transcription") == "no_speech":
+                    # 録画全体が無音（ステップ3で録画し直しを案内する）
+                    st.session_state["transcription_result"] = ""
+                    st.session_state["transcript_segments_result"] = None
+                    st.session_state["transcription_status"] = "no_speech"
+                elif run["statuses"].get("transcription") == "timeout":
                     st.session_state["transcription_status"] = "error"
-                    st.error(f"文字起こしエラー: {e}")
-                    status.update(label="エラー発生", state="error")
+                    st.error("文字起こしが制限時間内に完了しませんでした。もう一度お試しください")
+                else:
+                    st.session_state["transcription_status"] = "error"
+                    st.error("文字起こし処理中にエラーが発生しました")
+
+                face_emotion = run["results"].get("face_analysis")
+                st.session_state["face_emotion_result"] = face_emotion
+                if face_emotion is not None:
+                    st.session_state["face_emotion_status"] = "completed"
+                    if face_emotion.get("partial"):
+                        st.info(
+                            f"表情認識は制限時間内に分析できた{face_emotion['frame_count']}フレームで推定しました"
+                        )
+                else:
+                    st.session_state["face_emotion_status"] = "error"
+                    st.warning("表情認識処理中にエラーが発生しました（続行します）")
 
-            # 表情認識処理
-            with st.status(
-                "録画データからフレームを抽出して表情認識中...", expanded=True
-            ) as status_face:
-                try:
-                    st.write("動画ファイルから5秒ごとにフレームを抽出しています...")
-                    st.write("GPT-4o Vision APIに送信中...")
-                    st.session_state["face_emotion_status"] = "processing"
+                # 音声の特徴量（文字起こし用の音声の前処理で計算済み）
+                audio = run["results"].get("audio")
+                st.session_state["acoustic_features_result"] = audio.get("features") if audio else None
 
-                    # バックエンドサービスを呼び出し
-                    face_emotion, face_status = analyze_face_emotion(
-                        st.session_state["recorded_video_data"], client
+                if st.session_state["transcription_status"] == "completed":
+                    status.update(
+                        label="文字起こし・表情認識完了！",
+                        state="complete",
+                        expanded=False,
                     )
-
-                    if face_status == "completed":
-                        st.session_state["face_emotion_result"] = face_emotion
-                        st.session_state["face_emotion_status"] = "completed"
-                        status_face.update(
-                            label="表情認識完了！",
-                            state="complete",
-                            expanded=False,
-                        )
-                    else:
-                        st.session_state["face_emotion_status"] = "error"
-                        st.warning("表情認識処理中にエラーが発生しました（続行します）")
-                        st.session_state["face_emotion_result"] = None
-                        status_face.update(
-                            label="表情認識エラー（続行）",
-                            state="error",
-                            expanded=False,
-                        )
-                except Exception as e:
-                    st.session_state["face_emotion_status"] = "error"
-                    st.warning(f"表情認識エラー: {e}（続行します）")
-                    st.session_state["face_emotion_result"] = None
-                    status_face.update(
-                        label="表情認識エラー（続行）",
-                        state="error",
+                elif st.session_state["transcription_status"] == "no_speech":
+                    status.update(
+                        label="発話が検出されませんでした",
+                        state="complete",
                         expanded=False,
                     )
+                else:
+                    status.update(label="エラー発生", state="error")
 
             # 文字起こしが完了したら自動的に次のステップへ（ここで遷移）
-            if st.session_state["transcription_status"] == "completed":
+            if st.session_state["transcription_status"] in ("completed", "no_speech"):
                 st.session_state["current_step"] = 3
                 st.rerun()
         else:
@@ -606,6 +580,31 @@ elif st.session_state["current_step"] == 2:
 # ステップ3: 対話結果
 # ============================
 elif st.session_state["current_step"] == 3:
+    from history_analytics import (
+        BUCKET_LABELS,
+        build_face_emotion_figure,
+        build_trajectory_figure,
+    )
+    from session_timeline import build_timeline_figure, has_timeline
+
+    from services.ai_chat import describe_acoustic_features, generate_ai_response
+    from services.embeddings import find_similar_sessions
+
+    # OpenAIクライアントの取得
+    client = get_openai_client()
+
+    def get_similar_sessions() -> list:
+        """似ている過去の対話（録画ごとに1回だけ検索し、再実行時はセッション状態の結果を使う）"""
+        if st.session_state["similar_sessions"] is None:
+            st.session_state["similar_sessions"] = find_similar_sessions(
+                st.session_state.get("username"),
+                st.session_state["transcription_result"],
+                st.session_state["emotion_coords"],
+                exclude_client_id=st.session_state.get("saved_client_id"),
+                client=client,
+            )
+        return st.session_state["similar_sessions"]
+
     st.subheader("ステップ3: 💬 対話・結果")
     st.markdown("文字起こし結果とAI応答を確認できます。")
 
@@ -615,6 +614,24 @@ elif st.session_state["current_step"] == 3:
         st.subheader("📝 文字起こし結果")
         if st.session_state["transcription_status"] == "completed":
             st.success(st.session_state["transcription_result"])
+            if st.session_state.get("acoustic_features_result"):
+                st.caption(
+                    "🎙️ 声の様子（録音から推定）\n\n"
+                    + "\n".join(describe_acoustic_features(st.session_state["acoustic_features_result"]))
+                )
+
+            # 発話と表情のタイムライン（時刻付きのデータがある場合）
+            if has_timeline(
+                st.session_state.get("transcript_segments_result"),
+                st.session_state.get("face_emotion_result"),
+            ):
+                st.plotly_chart(
+                    build_timeline_figure(
+                        st.session_state.get("transcript_segments_result"),
+                        st.session_state.get("face_emotion_result"),
+                    ),
+                    width='stretch',
+                )
 
             # 自動的にAI応答を生成（まだ生成されていない場合）
             if (
@@ -624,12 +641,16 @@ elif st.session_state["current_step"] == 3:
             ):
                 with st.spinner("AI応答を自動生成中..."):
                     try:
+                        # 似ている過去の対話を応答の文脈として渡す
+                        similar_sessions = get_similar_sessions()
                         # バックエンドサービスを呼び出し
                         ai_response, response_status = generate_ai_response(
                             st.session_state["transcription_result"],
                             st.session_state["emotion_coords"],
                             face_emotion=st.session_state.get("face_emotion_result"),
                             client=client,
+                            similar_sessions=similar_sessions,
+                            acoustic_features=st.session_state.get("acoustic_features_result"),
                         )
 
                         if response_status == "completed":
@@ -646,8 +667,17 @@ elif st.session_state["current_step"] == 3:
                                 ),
                                 "ai_response": st.session_state["ai_response"],
                                 "timestamp": datetime.now().isoformat(),
+                                "acoustic_features": st.session_state.get(
+                                    "acoustic_features_result"
+                                ),
+                                "transcript_segments": st.session_state.get(
+                                    "transcript_segments_result"
+                                ),
                             }
                             save_conversation(conversation_data, st.session_state.get("username"))
+                            # 似ている過去の対話を検索し直す場合に、保存したこの対話自体を除くため
+                            # （保存前に検索した結果にはこの対話は含まれない）
+                            st.session_state["saved_client_id"] = conversation_data.get("client_id")
 
                             st.rerun()
                         else:
@@ -664,6 +694,13 @@ elif st.session_state["current_step"] == 3:
                     st.rerun()
         elif st.session_state["transcription_status"] == "error":
             st.error("文字起こし処理中にエラーが発生しました。")
+    elif st.session_state["transcription_status"] == "no_speech":
+        st.markdown("---")
+        st.subheader("📝 文字起こし結果")
+        st.info(
+            "録画から発話が検出されませんでした。マイクの設定を確認し、"
+            "「最初からやり直す」からもう一度録画してください。"
+        )
 
     # AI応答の表示
     if st.session_state["ai_response"]:
@@ -671,6 +708,20 @@ elif st.session_state["current_step"] == 3:
         st.subheader("💬 AI応答")
         st.info(st.session_state["ai_response"])
 
+    # 似ている過去の対話の表示
+    if st.session_state["transcription_result"] and st.session_state.get("username"):
+        similar_sessions = get_similar_sessions()
+        if similar_sessions:
+            st.markdown("---")
+            st.subheader("🔁 似ている過去の対話")
+            for session in similar_sessions:
+                with st.expander(
+                    f"{str(session.get('timestamp', ''))[:10]}（類似度: {session['score']:.2f}）"
+                ):
+                    st.write(f"**感情座標:** ({session['emotion'][0]:.2f}, {session['emotion'][1]:.2f})")
+                    st.write(f"**あなた:** {session['transcription']}")
+                    st.write(f"**AI:** {session['ai_response']}")
+
     # 対話履歴の表示
     if st.session_state["conversation_history"]:
         st.markdown("---")
@@ -691,14 +742,113 @@ elif st.session_state["current_step"] == 3:
                 st.write(f"**あなた:** {conv['transcription']}")
                 st.write(f"**AI:** {conv['ai_response']}")
 
+    # 対話履歴の検索（保存先の全文検索インデックスを使用）
+    @st.fragment
+    def render_history_search():
+        st.markdown("---")
+        st.subheader("🔍 対話履歴の検索")
+        query = st.text_input(
+            "キーワード",
+            key="history_search_query",
+            placeholder="あなたの発言やAI応答に含まれる言葉",
+        ).strip()
+        # 検索語が変わったら1ページ目に戻す
+        if query != st.session_state.get("history_search_last_query"):
+            st.session_state["history_search_last_query"] = query
+            st.session_state["history_search_page"] = 0
+        if not query:
+            return
+
+        page = st.session_state.get("history_search_page", 0)
+        found = search_conversation_history(
+            st.session_state["username"], query, page, HISTORY_SEARCH_PAGE_SIZE
+        )
+        total = found["total"]
+        if total == 0:
+            st.info("該当する対話は見つかりませんでした。")
+            return
+
+        first = page * HISTORY_SEARCH_PAGE_SIZE + 1
+        last = page * HISTORY_SEARCH_PAGE_SIZE + len(found["results"])
+        st.caption(f"{total}件中 {first}～{last}件目")
+        for conv in found["results"]:
+            with st.expander(f"{conv.get('timestamp', '')[:16].replace('T', ' ')}"):
+                st.write(f"**感情座標:** {conv['emotion']}")
+                st.write(f"**あなた:** {conv['transcription']}")
+                st.write(f"**AI:** {conv['ai_response']}")
+
+        prev_col, next_col = st.columns(2)
+        with prev_col:
+            if st.button("◀ 前へ", disabled=page == 0, width='stretch'):
+                st.session_state["history_search_page"] = page - 1
+                st.rerun(scope="fragment")
+        with next_col:
+            if st.button("次へ ▶", disabled=last >= total, width='stretch'):
+                st.session_state["history_search_page"] = page + 1
+                st.rerun(scope="fragment")
+
+    render_history_search()
+
+    # 履歴の分析（保存先で集計した結果だけを描画）
+    @st.fragment
+    def render_history_analytics():
+        st.markdown("---")
+        st.subheader("📈 感情の推移")
+        bucket = st.radio(
+            "集計単位",
+            list(BUCKET_LABELS),
+            index=1,
+            format_func=BUCKET_LABELS.get,
+            horizontal=True,
+            key="history_analytics_bucket",
+        )
+        trends = load_emotion_trends(st.session_state["username"], bucket)
+        if trends["total"] == 0:
+            st.info("保存された対話はまだありません。")
+            return
+
+        st.caption(
+            f"対話数: {trends['total']}件（{len(trends['trajectory'])}{BUCKET_LABELS[bucket]}分）"
+        )
+        st.plotly_chart(build_trajectory_figure(trends["trajectory"], bucket), width='stretch')
+        if trends["face_emotions"]:
+            st.plotly_chart(build_face_emotion_figure(trends["face_emotions"]), width='stretch')
+
+    render_history_analytics()
+
     # 最初からやり直すボタン
     st.markdown("---")
     if st.button("🔄 最初からやり直す", type="primary", width='stretch'):
         st.session_state["current_step"] = 1
         st.session_state["is_recording"] = False
+        discard_recording(st.session_state["recorded_video_path"])
+        st.session_state["recorded_video_path"] = None
         st.session_state["transcription_result"] = None
         st.session_state["transcription_status"] = "idle"
+        st.session_state["transcript_segments_result"] = None
         st.session_state["face_emotion_result"] = None
         st.session_state["face_emotion_status"] = "idle"
+        st.session_state["acoustic_features_result"] = None
         st.session_state["ai_response"] = None
+        st.session_state["saved_client_id"] = None
+        st.session_state["similar_sessions"] = None
         st.rerun()
+
+# ============================
+# 診断パネル（SHOW_DIAGNOSTICS = true または debug_mode の場合のみ）
+# ============================
+if is_diagnostics_enabled():
+    st.markdown("---")
+    with st.expander("🩺 診断情報（処理ステージごとの計測値）"):
+        registry = get_registry()
+        summary = registry.summary()
+        if summary:
+            st.dataframe(summary, width="stretch")
+            st.caption("直近の計測イベント")
+            st.dataframe(registry.recent_events(), width="stretch")
+        else:
+            st.caption("まだ計測値がありません。")
+
+# 初回描画後に、以降のステップで使うモジュールと接続を事前に準備する
+report_first_render(time.perf_counter() - _script_started_at)
+start_background_warmup()
@@ -0,0 +1,116 @@
+"""ステップ3の履歴分析（感情の推移・表情の分布・対話の頻度）
+
+集計は保存先（services/storage.py の emotion_trends）で行い、ここでは集計結果だけを
+Plotlyの図にします。集計区間が多い場合はNumPyで間引いてからブラウザに送ります。
+"""
+
+import numpy as np
+
+# 推移の図に描く点の上限
+MAX_TRAJECTORY_POINTS = 300
+
+# 集計単位の表示名
+BUCKET_LABELS = {"hour": "時間", "day": "日", "week": "週", "month": "月"}
+
+
+def downsample_trajectory(trajectory: list[dict], max_points: int = MAX_TRAJECTORY_POINTS) -> list[dict]:
+    """
+    集計区間を連続する max_points 個のグループにまとめる
+
+    各グループの感情座標は対話数で重み付けした平均、対話数は合計、区間は先頭の区間の開始時刻とします。
+
+    Args:
+        trajectory: emotion_trends() の "trajectory"（古い順）
+        max_points: まとめた後の区間数の上限
+
+    Returns:
+        trajectory と同じ形式のリスト（区間数が max_points 以下の場合はそのまま）
+    """
+    if len(trajectory) <= max_points:
+        return trajectory
+
+    counts = np.array([entry["count"] for entry in trajectory], dtype=np.float64)
+    emotion_x = np.array([entry["emotion_x"] for entry in trajectory], dtype=np.float64)
+    emotion_y = np.array([entry["emotion_y"] for entry in trajectory], dtype=np.float64)
+
+    # 各グループの先頭のインデックス（区間数がほぼ等しくなるように分ける）
+    starts = np.linspace(0, len(trajectory), max_points, endpoint=False).astype(np.int64)
+    group_counts = np.add.reduceat(counts, starts)
+    weights = np.maximum(group_counts, 1.0)
+    group_x = np.add.reduceat(emotion_x * counts, starts) / weights
+    group_y = np.add.reduceat(emotion_y * counts, starts) / weights
+
+    return [
+        {
+            "bucket": trajectory[start]["bucket"],
+            "count": int(count),
+            "emotion_x": float(x),
+            "emotion_y": float(y),
+        }
+        for start, count, x, y in zip(starts, group_counts, group_x, group_y)
+    ]
+
+
+def build_trajectory_figure(trajectory: list[dict], bucket: str) -> dict:
+    """感情座標の平均の推移（折れ線）と対話数（棒）の図"""
+    points = downsample_trajectory(trajectory)
+    times = [entry["bucket"] for entry in points]
+    label = BUCKET_LABELS.get(bucket, bucket)
+    return {
+        "data": [
+            {
+                "type": "scatter",
+                "x": times,
+                "y": [round(entry["emotion_x"], 3) for entry in points],
+                "mode": "lines+markers",
+                "name": "Pleasure（快/不快）",
+                "hovertemplate": "%{x}<br>Pleasure: %{y:.2f}<extra></extra>",
+            },
+            {
+                "type": "scatter",
+                "x": times,
+                "y": [round(entry["emotion_y"], 3) for entry in points],
+                "mode": "lines+markers",
+                "name": "Arousal（覚醒/落ち着き）",
+                "hovertemplate": "%{x}<br>Arousal: %{y:.2f}<extra></extra>",
+            },
+            {
+                "type": "bar",
+                "x": times,
+                "y": [entry["count"] for entry in points],
+                "name": "対話数",
+                "yaxis": "y2",
+                "opacity": 0.3,
+                "hovertemplate": "%{x}<br>対話数: %{y}<extra></extra>",
+            },
+        ],
+        "layout": {
+            "title": {"text": f"感情の推移（{label}ごとの平均）"},
+            "xaxis": {"type": "date"},
+            "yaxis": {"range": [-1.1, 1.1], "title": {"text": "感情座標"}},
+            "yaxis2": {"overlaying": "y", "side": "right", "title": {"text": "対話数"}, "rangemode": "tozero"},
+            "legend": {"orientation": "h", "y": -0.2},
+            "height": 400,
+            "hovermode": "x unified",
+        },
+    }
+
+
+def build_face_emotion_figure(face_emotions: dict[str, int]) -> dict:
+    """表情分析の主な感情の分布（件数の多い順の棒グラフ）"""
+    ordered = sorted(face_emotions.items(), key=lambda item: item[1], reverse=True)
+    return {
+        "data": [
+            {
+                "type": "bar",
+                "x": [name for name, _ in ordered],
+                "y": [count for _, count in ordered],
+                "hovertemplate": "%{x}: %{y}件<extra></extra>",
+            }
+        ],
+        "layout": {
+            "title": {"text": "表情の分布"},
+            "yaxis": {"title": {"text": "件数"}, "rangemode": "tozero"},
+            "height": 300,
+        },
+    }
@@ -0,0 +1,406 @@
+"""対話履歴の一括エクスポート・インポートCLI
+
+conversation_history（PostgreSQL）の行を、ユーザー名・期間で絞り込んで
+CSV / JSONL / Parquet ファイルに書き出し、または読み込みます。
+バックアップ、Supabaseプロジェクト間の移行、オフラインでの分析に使用します。
+
+- CSV は COPY で直接ストリーミングします（行をPythonに読み込みません）
+- JSONL / Parquet はサーバー側カーソルで一定件数ずつ読み込みます
+- インポートは一時テーブルへ COPY した後、client_id が既に存在する行を除いて追加します
+  （同じファイルを再度インポートしても重複しません）
+
+どの形式でもメモリ使用量は行数によらず一定です。
+Parquet を使用する場合は pyarrow が必要です。
+
+使用例:
+    python history_transfer.py export backup.csv
+    python history_transfer.py export yamada.parquet --username 山田太郎 --since 2025-01-01
+    python history_transfer.py import backup.jsonl
+"""
+
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import sys
+from datetime import datetime
+from typing import Iterator
+
+logger = logging.getLogger("history_transfer")
+
+# エクスポート・インポートする列（id はインポート先で採番する）
+COLUMNS = (
+    "client_id",
+    "username",
+    "timestamp",
+    "transcription",
+    "emotion_x",
+    "emotion_y",
+    "face_emotion",
+    "ai_response",
+    "acoustic_features",
+    "transcript_segments",
+)
+
+# JSON文字列として保存されている列（JSONL では値をオブジェクトとして書き出す）
+JSON_COLUMNS = ("face_emotion", "acoustic_features", "transcript_segments")
+
+FORMATS = ("csv", "jsonl", "parquet")
+
+# サーバー側カーソル・Parquetの1回あたりの読み書き件数
+BATCH_SIZE = 5000
+
+
+def detect_format(path: str, format_name: str | None = None) -> str:
+    """ファイル形式（指定がなければ拡張子から判定）"""
+    if format_name:
+        return format_name
+    extension = os.path.splitext(path)[1].lower().lstrip(".")
+    if extension in FORMATS:
+        return extension
+    raise ValueError(f"ファイル形式を判定できません（--format を指定してください）: {path}")
+
+
+def _where_clause(
+    username: str | None, since: datetime | None, until: datetime | None, prefix: str = ""
+) -> tuple[str, list]:
+    """ユーザー名・期間の絞り込み条件（WHERE句とパラメータ）"""
+    conditions = []
+    params = []
+    if username is not None:
+        conditions.append(f"{prefix}username = %s")
+        params.append(username)
+    if since is not None:
+        conditions.append(f"{prefix}timestamp >= %s")
+        params.append(since)
+    if until is not None:
+        conditions.append(f"{prefix}timestamp < %s")
+        params.append(until)
+    return (" WHERE " + " AND ".join(conditions)) if conditions else "", params
+
+
+def _pyarrow():
+    """pyarrow を読み込む（未インストールの場合はエラーメッセージ付きで失敗）"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet形式には pyarrow が必要です（pip install pyarrow）") from None
+    return pyarrow
+
+
+def _parquet_schema(pa):
+    return pa.schema(
+        [
+            ("client_id", pa.string()),
+            ("username", pa.string()),
+            ("timestamp", pa.timestamp("us")),
+            ("transcription", pa.string()),
+            ("emotion_x", pa.float32()),
+            ("emotion_y", pa.float32()),
+            ("face_emotion", pa.string()),
+            ("ai_response", pa.string()),
+            ("acoustic_features", pa.string()),
+            ("transcript_segments", pa.string()),
+        ]
+    )
+
+
+# ============================
+# エクスポート
+# ============================
+
+
+def _export_csv(conn, path: str, select_sql: str, params: list) -> int:
+    """COPY TO STDOUT でファイルに直接書き出す"""
+    with conn.cursor() as cur, open(path, "w", encoding="utf-8", newline="") as f:
+        # COPY にはパラメータを渡せないため、値を埋め込んだSQLを組み立てる
+        query = cur.mogrify(select_sql, params).decode()
+        cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", f)
+        return cur.rowcount
+
+
+def _iter_batches(conn, select_sql: str, params: list) -> Iterator[list[tuple]]:
+    """サーバー側カーソルで BATCH_SIZE 件ずつ読み込む"""
+    with conn.cursor(name="history_export") as cur:
+        cur.itersize = BATCH_SIZE
+        cur.execute(select_sql, params)
+        while True:
+            rows = cur.fetchmany(BATCH_SIZE)
+            if not rows:
+                break
+            yield rows
+
+
+def _export_jsonl(conn, path: str, select_sql: str, params: list) -> int:
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for rows in _iter_batches(conn, select_sql, params):
+            for row in rows:
+                record = dict(zip(COLUMNS, row))
+                record["timestamp"] = record["timestamp"].isoformat() if record["timestamp"] else None
+                # 表情分析結果などはJSON文字列のまま保存されているため、オブジェクトとして書き出す
+                for column in JSON_COLUMNS:
+                    if record[column]:
+                        try:
+                            record[column] = json.loads(record[column])
+                        except ValueError:
+                            pass
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += len(rows)
+    return count
+
+
+def _export_parquet(conn, path: str, select_sql: str, params: list) -> int:
+    pa = _pyarrow()
+    schema = _parquet_schema(pa)
+    count = 0
+    with pa.parquet.ParquetWriter(path, schema) as writer:
+        for rows in _iter_batches(conn, select_sql, params):
+            columns = list(zip(*rows))
+            writer.write_batch(pa.RecordBatch.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema,
+            ))
+            count += len(rows)
+    if count == 0:
+        logger.info("該当する行がないため、空のファイルを作成しました")
+    return count
+
+
+EXPORTERS = {"csv": _export_csv, "jsonl": _export_jsonl, "parquet": _export_parquet}
+
+
+def export_history(
+    path: str,
+    format_name: str,
+    username: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    table: str = "conversation_history",
+) -> int:
+    """
+    対話履歴をファイルに書き出す
+
+    Args:
+        path: 出力ファイルのパス
+        format_name: "csv" / "jsonl" / "parquet"
+        username: 絞り込むユーザー名（Noneの場合はすべて）
+        since: この日時以降の行のみ
+        until: この日時より前の行のみ
+        table: 読み込むテーブル（パーティションを個別に書き出す場合に指定）
+
+    Returns:
+        書き出した行数
+    """
+    from services import database
+
+    conn = database.get_db_connection()
+    if conn is None:
+        raise RuntimeError("データベースに接続できません（DATABASE_URL を確認してください）")
+
+    where, params = _where_clause(username, since, until)
+    select_sql = f"SELECT {', '.join(COLUMNS)} FROM {table}{where} ORDER BY timestamp, id"
+    try:
+        count = EXPORTERS[format_name](conn, path, select_sql, params)
+        database.release_db_connection(conn)
+        return count
+    except Exception:
+        database.release_db_connection(conn, broken=True)
+        raise
+
+
+# ============================
+# インポート
+# ============================
+
+
+class _StreamReader(io.RawIOBase):
+    """bytes のイテレーターを COPY FROM STDIN に渡せるファイルとして読み込む"""
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._chunk = b""
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        if self._position >= len(self._chunk):
+            self._chunk = next(self._chunks, b"")
+            self._position = 0
+        end = len(self._chunk) if size < 0 else self._position + size
+        data = self._chunk[self._position : end]
+        self._position += len(data)
+        return data
+
+
+# CSVでNULLを表す値（空文字列とNULLを区別するため）
+CSV_NULL = "\\N"
+
+
+def _csv_chunks(records: Iterator[dict]) -> Iterator[bytes]:
+    """レコードを BATCH_SIZE 件ずつCSV（ヘッダーなし、NULLは CSV_NULL）に変換"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    pending = 0
+    for record in records:
+        row = dict(record)
+        for column in JSON_COLUMNS:
+            value = row.get(column)
+            if value is not None and not isinstance(value, str):
+                row[column] = json.dumps(value, ensure_ascii=False)
+        writer.writerow([CSV_NULL if row.get(column) is None else row[column] for column in COLUMNS])
+        pending += 1
+        if pending >= BATCH_SIZE:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if pending:
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _read_jsonl(path: str) -> Iterator[dict]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _read_parquet(path: str) -> Iterator[dict]:
+    pa = _pyarrow()
+    parquet_file = pa.parquet.ParquetFile(path)
+    # 列を追加する前に書き出したファイルも読み込めるよう、ファイルにある列だけを読む
+    columns = [column for column in COLUMNS if column in parquet_file.schema_arrow.names]
+    for batch in parquet_file.iter_batches(batch_size=BATCH_SIZE, columns=columns):
+        yield from batch.to_pylist()
+
+
+def _copy_into_staging(cur, path: str, format_name: str):
+    """ファイルの内容を一時テーブル conversation_import に COPY する"""
+    if format_name == "csv":
+        with open(path, encoding="utf-8", newline="") as f:
+            # ヘッダーの列だけを読み込む（列を追加する前に書き出したファイルにも対応）
+            header = next(csv.reader([f.readline()]), [])
+            if not header:
+                return
+            unknown = [column for column in header if column not in COLUMNS]
+            if unknown:
+                raise ValueError(f"未対応の列があります: {', '.join(unknown)}")
+            cur.copy_expert(
+                f"COPY conversation_import ({', '.join(header)}) FROM STDIN WITH (FORMAT csv)", f
+            )
+        return
+    columns = ", ".join(COLUMNS)
+    records = _read_jsonl(path) if format_name == "jsonl" else _read_parquet(path)
+    cur.copy_expert(
+        f"COPY conversation_import ({columns}) FROM STDIN WITH (FORMAT csv, NULL '{CSV_NULL}')",
+        _StreamReader(_csv_chunks(records)),
+    )
+
+
+def import_history(
+    path: str,
+    format_name: str,
+    username: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+) -> tuple[int, int]:
+    """
+    ファイルから対話履歴を読み込んで追加
+
+    ファイル全体を1つのトランザクションで追加します（途中で失敗した場合は何も追加されません）。
+    client_id がない行には内容から決まるIDを付け、再インポート時の重複を防ぎます。
+
+    Args:
+        path: 入力ファイルのパス（export_history() の出力と同じ列）
+        format_name: "csv" / "jsonl" / "parquet"
+        username / since / until: 追加する行の絞り込み（export_history() と同じ）
+
+    Returns:
+        (ファイルの行数, 追加した行数)
+    """
+    from services import database
+
+    if not database.init_database():
+        raise RuntimeError("データベースに接続できません（DATABASE_URL を確認してください）")
+    conn = database.get_db_connection()
+    if conn is None:
+        raise RuntimeError("データベースに接続できません（DATABASE_URL を確認してください）")
+
+    columns = ", ".join(COLUMNS)
+    where, params = _where_clause(username, since, until, prefix="i.")
+    # timestamp はパーティションキーのため、時刻のない行は追加しない
+    where = (where + " AND" if where else " WHERE") + " i.timestamp IS NOT NULL"
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                CREATE TEMP TABLE conversation_import (
+                    client_id TEXT, username TEXT, timestamp TIMESTAMP, transcription TEXT,
+                    emotion_x REAL, emotion_y REAL, face_emotion TEXT, ai_response TEXT,
+                    acoustic_features TEXT, transcript_segments TEXT
+                ) ON COMMIT DROP
+                """
+            )
+            _copy_into_staging(cur, path, format_name)
+            cur.execute("SELECT COUNT(*) FROM conversation_import")
+            total = cur.fetchone()[0]
+            cur.execute(
+                f"""
+                INSERT INTO conversation_history ({columns})
+                SELECT COALESCE(i.client_id, 'import-' || md5(concat_ws('|',
+                           i.username, i.timestamp, i.transcription, i.ai_response))),
+                       i.username, i.timestamp, i.transcription, i.emotion_x, i.emotion_y,
+                       i.face_emotion, i.ai_response, i.acoustic_features,
+                       i.transcript_segments
+                FROM conversation_import i{where}
+                ON CONFLICT (client_id, timestamp) DO NOTHING
+                """,
+                params,
+            )
+            inserted = cur.rowcount
+        conn.commit()
+        database.release_db_connection(conn)
+        return total, inserted
+    except Exception:
+        database.release_db_connection(conn, broken=True)
+        raise
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="対話履歴の一括エクスポート・インポート")
+    parser.add_argument("command", choices=("export", "import"))
+    parser.add_argument("path", help="CSV / JSONL / Parquet ファイルのパス")
+    parser.add_argument("--format", choices=FORMATS, default=None, help="ファイル形式（デフォルト: 拡張子から判定）")
+    parser.add_argument("--username", default=None, help="このユーザーの行のみ")
+    parser.add_argument(
+        "--since", type=datetime.fromisoformat, default=None, help="この日時以降の行のみ（ISO形式）"
+    )
+    parser.add_argument(
+        "--until", type=datetime.fromisoformat, default=None, help="この日時より前の行のみ（ISO形式）"
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    try:
+        format_name = detect_format(args.path, args.format)
+        if args.command == "export":
+            count = export_history(args.path, format_name, args.username, args.since, args.until)
+            logger.info(f"{count}行を書き出しました: {args.path}")
+        else:
+            total, inserted = import_history(args.path, format_name, args.username, args.since, args.until)
+            logger.info(f"{total}行中 {inserted}行を追加しました（既存・対象外の行はスキップ）")
+    except (RuntimeError, ValueError, OSError) as e:
+        logger.error(str(e))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
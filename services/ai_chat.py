@@ -1,6 +1,59 @@
 """AI対話サービス（やなこうが実装）- プロンプト構築 + ChatGPT API"""
 
-from openai import OpenAI
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING
+
+from services.metrics import record_usage, track_stage
+from services.rate_limiter import call_openai, with_deadline
+
+if TYPE_CHECKING:
+    # 型ヒント専用（openaiは呼び出し側でクライアント作成時に読み込まれる）
+    from openai import OpenAI
+
+logger = logging.getLogger(__name__)
+
+# 応答の最大トークン数の見積もり（レート制限のTPM計算用）
+ESTIMATED_COMPLETION_TOKENS = 1000
+
+# プロンプトに含める過去の対話の件数と、1件あたりの文字数
+MAX_PROMPT_SESSIONS = 3
+PROMPT_SESSION_CHARS = 100
+
+# 音声の特徴量の説明に使うしきい値（話す速さ: 音節/秒、声の高さの変動: 半音）
+FAST_SPEAKING_RATE = 5.5
+SLOW_SPEAKING_RATE = 3.0
+LIVELY_PITCH_VARIATION = 3.0
+FLAT_PITCH_VARIATION = 1.5
+
+
+def describe_acoustic_features(features: dict) -> list[str]:
+    """音声の特徴量（services/audio_features.py）をプロンプト用の説明文にする"""
+    rate = features["speaking_rate"]
+    if rate >= FAST_SPEAKING_RATE:
+        rate_desc = "速い"
+    elif rate <= SLOW_SPEAKING_RATE:
+        rate_desc = "ゆっくり"
+    else:
+        rate_desc = "普通"
+    lines = [
+        f"- 声の大きさ: {features['rms_db']:.1f} dBFS（変動 {features['rms_variation_db']:.1f} dB）",
+        f"- 話す速さ: 約{rate:.1f}音節/秒（{rate_desc}）",
+    ]
+    variation = features.get("pitch_variation_semitones")
+    if variation is not None:
+        if variation >= LIVELY_PITCH_VARIATION:
+            pitch_desc = "抑揚が大きい"
+        elif variation <= FLAT_PITCH_VARIATION:
+            pitch_desc = "平坦"
+        else:
+            pitch_desc = "普通"
+        lines.append(
+            f"- 声の高さ: 平均 {features['pitch_hz']:.0f} Hz、変動 {variation:.1f} 半音（{pitch_desc}）"
+        )
+    lines.append(f"- 間（沈黙）の割合: {features['pause_ratio']:.0%}")
+    return lines
 
 
 def generate_ai_response(
@@ -8,6 +61,8 @@ def generate_ai_response(
     emotion_coords: tuple[float, float],
     face_emotion: dict | None = None,
     client: OpenAI | None = None,
+    similar_sessions: list[dict] | None = None,
+    acoustic_features: dict | None = None,
 ) -> tuple[str, str]:
     """
     AI応答を生成（プロンプト構築 + ChatGPT API呼び出し）
@@ -20,6 +75,8 @@ def generate_ai_response(
         emotion_coords: 感情座標タプル (x, y)。x, y は -1.0 ～ 1.0
         face_emotion: 顔感情分析結果（オプション、将来実装用、現在はNone）
         client: OpenAIクライアントインスタンス（Noneの場合は内部で取得を試みる）
+        similar_sessions: 似ている過去の対話（services/embeddings.py の find_similar_sessions() の結果、オプション）
+        acoustic_features: 音声の特徴量（services/audio_features.py の extract_acoustic_features() の結果、オプション）
 
     Returns:
         (ai_response, status) のタプル
@@ -75,20 +132,46 @@ def generate_ai_response(
         confidence = face_emotion.get("confidence", 0.0)
         user_prompt += f"\n- 検出された表情: {dominant} (信頼度: {confidence:.2f})"
 
+    # 音声の特徴量がある場合は、声の様子（覚醒度の手がかり）として追加
+    if acoustic_features:
+        user_prompt += "\n\nユーザーの声の様子（録音から推定）：\n"
+        user_prompt += "\n".join(describe_acoustic_features(acoustic_features))
+
+    # 似ている過去の対話がある場合は、経過を踏まえた応答ができるよう追加
+    if similar_sessions:
+        user_prompt += "\n\nユーザーの過去の似た対話："
+        for session in similar_sessions[:MAX_PROMPT_SESSIONS]:
+            past_x, past_y = session["emotion"]
+            user_prompt += (
+                f"\n- {str(session.get('timestamp', ''))[:10]}"
+                f"（快/不快: {past_x:.2f}, 覚醒/落ち着き: {past_y:.2f}）"
+                f"「{session['transcription'][:PROMPT_SESSION_CHARS]}」"
+            )
+
     user_prompt += (
         "\n\nこの感情状態と話した内容を踏まえて、適切な応答を生成してください。"
     )
 
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=0.7,
-        )
-        return response.choices[0].message.content, "completed"
-    except Exception as e:
-        print(f"ChatGPT APIエラー詳細: {str(e)}")
-        return "", "error"
+    with track_stage("generate_ai_response") as metrics:
+        try:
+            response = call_openai(
+                "gpt-4o-mini",
+                lambda: with_deadline(client).chat.completions.create(
+                    model="gpt-4o-mini",
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt},
+                    ],
+                    temperature=0.7,
+                ),
+                # 日本語はおおよそ1文字1トークンとして見積もる
+                estimated_tokens=len(system_prompt)
+                + len(user_prompt)
+                + ESTIMATED_COMPLETION_TOKENS,
+            )
+            record_usage(metrics, response)
+            return response.choices[0].message.content, "completed"
+        except Exception as e:
+            logger.warning(f"ChatGPT APIエラー詳細: {str(e)}")
+            metrics["error"] = True
+            return "", "error"
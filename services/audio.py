@@ -0,0 +1,296 @@
+"""音声の前処理 - 無音区間の検出と除去
+
+録画データ（WebM）から音声を16kHzモノラルで取り出し、フレームごとの
+エネルギー（RMS）で発話区間を検出します。先頭・末尾の無音を取り除き、
+長い間（ま）を短く詰めた音声だけを文字起こしに送ることで、
+Whisper APIに送信する音声の長さ（= 待ち時間と料金）を減らします。
+全体が無音の録画はAPIを呼び出さずに済ませます。
+
+同じデコード結果から、AIへのプロンプトに加える音声の特徴量
+（services/audio_features.py）も計算します。
+"""
+
+from __future__ import annotations
+
+import io
+import logging
+import os
+import time
+import wave
+
+import numpy as np
+
+from services.audio_features import extract_acoustic_features
+from services.media_worker import receive_array, run_media_task, share_array
+from services.metrics import get_registry, track_stage
+from services.recording_store import media_path
+
+logger = logging.getLogger(__name__)
+
+# Whisperの入力と同じサンプリングレート
+SAMPLE_RATE = 16000
+
+# 発話判定の単位（秒）
+FRAME_SECONDS = 0.03
+
+# 発話判定のしきい値（dBFS）。雑音レベル + NOISE_MARGIN_DB を基本とし、
+# SILENCE_FLOOR_DB ～ SPEECH_CEILING_DB の範囲に収める
+NOISE_MARGIN_DB = 12.0
+SILENCE_FLOOR_DB = -50.0
+SPEECH_CEILING_DB = -35.0
+
+# これより短い発話区間はクリック音などとみなして除外（秒）
+MIN_SPEECH_SECONDS = 0.25
+
+# 発話区間の前後に残す余白（秒）。語頭・語尾の欠けを防ぐ
+SPEECH_PADDING_SECONDS = 0.2
+
+# 発話区間の間をこの長さまで詰める（秒）
+DEFAULT_MAX_PAUSE_SECONDS = 1.0
+
+
+def decode_audio(
+    video: bytes | str | os.PathLike, sample_rate: int = SAMPLE_RATE
+) -> np.ndarray | None:
+    """
+    録画データから音声をモノラル float32（-1.0 ～ 1.0）で取り出す
+
+    Returns:
+        音声サンプルの配列。音声トラックがない場合はNone
+    """
+    import av
+
+    with media_path(video) as path, av.open(path) as container:
+        if not container.streams.audio:
+            return None
+        stream = container.streams.audio[0]
+        resampler = av.AudioResampler(format="flt", layout="mono", rate=sample_rate)
+        chunks = []
+        for frame in container.decode(stream):
+            for resampled in resampler.resample(frame):
+                chunks.append(resampled.to_ndarray().reshape(-1))
+        for resampled in resampler.resample(None):
+            chunks.append(resampled.to_ndarray().reshape(-1))
+
+    if not chunks:
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate(chunks).astype(np.float32, copy=False)
+
+
+def _runs(mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """真偽値配列の True が連続する区間の (開始, 終了) インデックス"""
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def detect_speech(
+    samples: np.ndarray, sample_rate: int = SAMPLE_RATE
+) -> list[tuple[int, int]]:
+    """
+    エネルギーに基づいて発話区間を検出
+
+    Args:
+        samples: モノラルの音声サンプル
+        sample_rate: サンプリングレート
+
+    Returns:
+        発話区間の (開始サンプル, 終了サンプル) のリスト（時間順、重なりなし）
+    """
+    frame_length = int(sample_rate * FRAME_SECONDS)
+    frame_count = len(samples) // frame_length
+    if frame_count == 0:
+        return []
+
+    frames = samples[: frame_count * frame_length].reshape(frame_count, frame_length)
+    rms = np.sqrt(np.mean(np.square(frames, dtype=np.float64), axis=1))
+    level_db = 20 * np.log10(np.maximum(rms, 1e-10))
+
+    # 録音ごとの雑音レベル（下位10%）を基準にしきい値を決める
+    threshold = np.clip(
+        np.percentile(level_db, 10) + NOISE_MARGIN_DB, SILENCE_FLOOR_DB, SPEECH_CEILING_DB
+    )
+    voiced = level_db > threshold
+
+    # 短すぎる区間を除外
+    starts, ends = _runs(voiced)
+    min_frames = int(np.ceil(MIN_SPEECH_SECONDS / FRAME_SECONDS))
+    voiced = np.zeros(frame_count, dtype=bool)
+    for start, end in zip(starts, ends):
+        if end - start >= min_frames:
+            voiced[start:end] = True
+    if not voiced.any():
+        return []
+
+    # 前後に余白を付ける（近い区間同士はここで結合される）
+    padding = int(round(SPEECH_PADDING_SECONDS / FRAME_SECONDS))
+    if padding:
+        windows = np.lib.stride_tricks.sliding_window_view(
+            np.pad(voiced, padding), 2 * padding + 1
+        )
+        voiced = windows.any(axis=1)
+
+    starts, ends = _runs(voiced)
+    return [
+        (int(start) * frame_length, min(int(end) * frame_length, len(samples)))
+        for start, end in zip(starts, ends)
+    ]
+
+
+def compact_speech(
+    samples: np.ndarray,
+    segments: list[tuple[int, int]],
+    sample_rate: int = SAMPLE_RATE,
+    max_pause_seconds: float = DEFAULT_MAX_PAUSE_SECONDS,
+) -> np.ndarray:
+    """
+    発話区間だけをつなげた音声を作成
+
+    先頭・末尾の無音は取り除き、区間の間は最大 max_pause_seconds まで残します。
+    """
+    if not segments:
+        return np.zeros(0, dtype=samples.dtype)
+
+    max_pause = int(sample_rate * max_pause_seconds)
+    pieces = []
+    previous_end = None
+    for start, end in segments:
+        if previous_end is not None:
+            pieces.append(samples[previous_end : min(start, previous_end + max_pause)])
+        pieces.append(samples[start:end])
+        previous_end = end
+    return np.concatenate(pieces)
+
+
+def compact_time_map(
+    segments: list[tuple[int, int]],
+    sample_rate: int = SAMPLE_RATE,
+    max_pause_seconds: float = DEFAULT_MAX_PAUSE_SECONDS,
+) -> tuple[list[float], list[float]]:
+    """
+    compact_speech() の音声の時刻を元の音声の時刻に戻すための対応表
+
+    つなげた音声の各部分（発話区間と、詰めた間）の開始時刻を、詰めた後と元の音声の両方で返します。
+
+    Returns:
+        (詰めた後の開始時刻のリスト, 元の音声での開始時刻のリスト)（秒）
+    """
+    max_pause = int(sample_rate * max_pause_seconds)
+    compact_starts = []
+    original_starts = []
+    position = 0
+    previous_end = None
+    for start, end in segments:
+        if previous_end is not None:
+            compact_starts.append(position / sample_rate)
+            original_starts.append(previous_end / sample_rate)
+            position += min(start, previous_end + max_pause) - previous_end
+        compact_starts.append(position / sample_rate)
+        original_starts.append(start / sample_rate)
+        position += end - start
+        previous_end = end
+    return compact_starts, original_starts
+
+
+def to_original_time(
+    times: np.ndarray, time_map: tuple[list[float], list[float]], side: str = "right"
+) -> np.ndarray:
+    """
+    詰めた音声の時刻（秒）を元の音声の時刻に変換
+
+    Args:
+        times: 詰めた音声での時刻の配列
+        time_map: compact_time_map() の結果
+        side: 部分の境界ちょうどの時刻を後の部分（"right"、開始時刻向け）と
+            前の部分（"left"、終了時刻向け）のどちらに含めるか
+    """
+    compact_starts = np.asarray(time_map[0], dtype=np.float64)
+    original_starts = np.asarray(time_map[1], dtype=np.float64)
+    times = np.asarray(times, dtype=np.float64)
+    if len(compact_starts) == 0:
+        return times
+    index = np.clip(np.searchsorted(compact_starts, times, side=side) - 1, 0, None)
+    return original_starts[index] + (times - compact_starts[index])
+
+
+def encode_wav(samples: np.ndarray, sample_rate: int = SAMPLE_RATE) -> bytes:
+    """float32 の音声サンプルを16bit PCMのWAVに変換"""
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2")
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+
+def _prepare_speech_task(path: str, max_pause_seconds: float) -> dict | None:
+    """デコードと発話区間の検出（メディア処理ワーカーで実行）。音声は共有メモリで返す"""
+    samples = decode_audio(path)
+    if samples is None:
+        return None
+    segments = detect_speech(samples)
+    speech = compact_speech(samples, segments, max_pause_seconds=max_pause_seconds)
+
+    # 特徴量の計算に失敗しても文字起こし用の音声は返す
+    started = time.perf_counter()
+    try:
+        features = extract_acoustic_features(samples, segments, SAMPLE_RATE)
+    except Exception as e:
+        logger.warning(f"音声の特徴量を計算できませんでした: {e}")
+        features = None
+    return {
+        "speech": share_array(speech),
+        "sample_count": len(samples),
+        "time_map": compact_time_map(segments, max_pause_seconds=max_pause_seconds),
+        "features": features,
+        "features_seconds": time.perf_counter() - started,
+    }
+
+
+def prepare_speech_audio(
+    video: bytes | str | os.PathLike,
+    max_pause_seconds: float = DEFAULT_MAX_PAUSE_SECONDS,
+) -> dict | None:
+    """
+    録画データから無音を除いた文字起こし用の音声を作成
+
+    デコードと発話区間の検出は共有のメディア処理ワーカー（services/media_worker.py）で実行します。
+
+    Args:
+        video: WebM形式の動画データ（bytes）またはファイルパス
+        max_pause_seconds: 発話区間の間を詰める長さ（秒）
+
+    Returns:
+        {
+            "samples": np.ndarray,  # 無音を除いた16kHzモノラル音声（無音のみの場合は空）
+            "sample_rate": int,
+            "duration_seconds": float,  # 元の音声の長さ
+            "speech_seconds": float,  # 無音を除いた音声の長さ
+            "features": dict | None,  # 音声の特徴量（extract_acoustic_features() の結果）
+            "time_map": tuple[list, list],  # 無音を除いた音声の時刻の対応表（compact_time_map() の結果）
+        }
+        音声を取り出せない場合（PyAV未インストール・音声トラックなし・デコード失敗）はNone
+    """
+    with track_stage("detect_speech") as metrics:
+        try:
+            with media_path(video) as path:
+                result = run_media_task(_prepare_speech_task, path, max_pause_seconds)
+        except Exception as e:
+            logger.warning(f"音声を取り出せませんでした（無音除去をスキップします）: {e}")
+            metrics["error"] = True
+            return None
+        if result is None:
+            return None
+        speech = receive_array(result["speech"])
+    # 特徴量の計算はワーカープロセス内のため、かかった時間をここで記録する
+    get_registry().observe("acoustic_features", result["features_seconds"])
+
+    return {
+        "samples": speech,
+        "sample_rate": SAMPLE_RATE,
+        "duration_seconds": result["sample_count"] / SAMPLE_RATE,
+        "speech_seconds": len(speech) / SAMPLE_RATE,
+        "features": result["features"],
+        "time_map": result["time_map"],
+    }
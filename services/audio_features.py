@@ -0,0 +1,150 @@
+"""音声の特徴量 - 声の大きさ・話す速さ・声の高さの変動・間の割合
+
+録画の音声から覚醒度（arousal）の手がかりになる特徴量をローカルで計算します。
+APIを呼び出さず、1分程度の録音でも0.1秒以内で計算できるよう、すべてNumPyで
+フレーム単位にまとめて処理します。
+
+- 声の大きさ: 発話区間のRMS（dBFS）とフレームごとのばらつき
+- 話す速さ: 音量の包絡線の山（音節の中心）の数 / 発話時間（音節/秒、推定値）
+- 声の高さ: 自己相関による基本周波数（F0）の中央値と、そのばらつき（半音）
+- 間の割合: 最初の発話から最後の発話までのうち、発話のない時間の割合
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+# 声の大きさ・話す速さの計算に使うフレームの長さ（秒）
+ENERGY_FRAME_SECONDS = 0.01
+
+# 包絡線を平滑化する幅（フレーム数）と、音節の中心とみなす山の最小間隔（フレーム数）
+ENVELOPE_SMOOTHING_FRAMES = 5
+SYLLABLE_MIN_GAP_FRAMES = 10
+
+# 山として数える、発話区間の中央値からの高さ（dB）
+SYLLABLE_PROMINENCE_DB = 2.0
+
+# 基本周波数の推定に使うフレームの長さ・間隔（秒）と探索範囲（Hz）
+PITCH_FRAME_SECONDS = 0.04
+PITCH_HOP_SECONDS = 0.02
+PITCH_MIN_HZ = 75.0
+PITCH_MAX_HZ = 400.0
+
+# 有声とみなす正規化自己相関のしきい値
+VOICING_THRESHOLD = 0.5
+
+# 一度にFFTを行うフレーム数（メモリ使用量を抑えるため）
+PITCH_CHUNK_FRAMES = 512
+
+
+def _frame_levels_db(samples: np.ndarray, frame_length: int) -> np.ndarray:
+    """重なりのないフレームごとのRMS（dBFS）"""
+    frame_count = len(samples) // frame_length
+    frames = samples[: frame_count * frame_length].reshape(frame_count, frame_length)
+    rms = np.sqrt(np.mean(np.square(frames, dtype=np.float64), axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+
+def estimate_syllable_rate(speech: np.ndarray, sample_rate: int) -> float:
+    """包絡線の山の数から話す速さ（音節/秒）を推定"""
+    frame_length = int(sample_rate * ENERGY_FRAME_SECONDS)
+    levels = _frame_levels_db(speech, frame_length)
+    if len(levels) < SYLLABLE_MIN_GAP_FRAMES:
+        return 0.0
+
+    kernel = np.ones(ENVELOPE_SMOOTHING_FRAMES) / ENVELOPE_SMOOTHING_FRAMES
+    envelope = np.convolve(levels, kernel, mode="same")
+
+    # 前後 SYLLABLE_MIN_GAP_FRAMES // 2 フレームの中で最大、かつ十分に大きいフレームを山とする
+    half = SYLLABLE_MIN_GAP_FRAMES // 2
+    padded = np.pad(envelope, half, constant_values=-np.inf)
+    local_max = np.lib.stride_tricks.sliding_window_view(padded, 2 * half + 1).max(axis=1)
+    peaks = (envelope >= local_max) & (envelope > np.median(envelope) + SYLLABLE_PROMINENCE_DB)
+    # 同じ高さの山が隣り合う場合は1つとして数える
+    peaks &= ~np.concatenate(([False], peaks[:-1]))
+    return float(np.count_nonzero(peaks)) / (len(speech) / sample_rate)
+
+
+def estimate_pitch(speech: np.ndarray, sample_rate: int) -> np.ndarray:
+    """
+    有声フレームの基本周波数（Hz）を自己相関で推定
+
+    Returns:
+        有声と判定されたフレームの基本周波数の配列
+    """
+    frame_length = int(sample_rate * PITCH_FRAME_SECONDS)
+    hop = int(sample_rate * PITCH_HOP_SECONDS)
+    if len(speech) < frame_length:
+        return np.zeros(0)
+
+    min_lag = int(sample_rate / PITCH_MAX_HZ)
+    max_lag = min(int(sample_rate / PITCH_MIN_HZ), frame_length - 1)
+    window = np.hanning(frame_length)
+    frames = np.lib.stride_tricks.sliding_window_view(speech, frame_length)[::hop]
+
+    pitches = []
+    for start in range(0, len(frames), PITCH_CHUNK_FRAMES):
+        chunk = frames[start : start + PITCH_CHUNK_FRAMES].astype(np.float64)
+        chunk = (chunk - chunk.mean(axis=1, keepdims=True)) * window
+        # ウィーナー＝ヒンチンの定理: パワースペクトルの逆FFTが自己相関
+        spectrum = np.fft.rfft(chunk, n=2 * frame_length)
+        autocorr = np.fft.irfft(np.abs(spectrum) ** 2)[:, : max_lag + 1]
+        energy = autocorr[:, 0]
+        normalized = autocorr[:, min_lag:] / np.maximum(energy, 1e-12)[:, np.newaxis]
+        best = np.argmax(normalized, axis=1)
+        strength = normalized[np.arange(len(best)), best]
+        voiced = (strength > VOICING_THRESHOLD) & (energy > 1e-8)
+        pitches.append(sample_rate / (best[voiced] + min_lag))
+    return np.concatenate(pitches)
+
+
+def extract_acoustic_features(
+    samples: np.ndarray, segments: list[tuple[int, int]], sample_rate: int
+) -> dict | None:
+    """
+    発話区間の音声から特徴量を計算
+
+    Args:
+        samples: モノラルの音声サンプル（float32、-1.0 ～ 1.0）
+        segments: services/audio.py の detect_speech() の発話区間
+        sample_rate: サンプリングレート
+
+    Returns:
+        {
+            "rms_db": float,  # 発話区間の音量（dBFS）
+            "rms_variation_db": float,  # フレームごとの音量の標準偏差（dB）
+            "speaking_rate": float,  # 話す速さ（音節/秒、推定）
+            "pitch_hz": float | None,  # 声の高さの中央値（有声フレームがない場合はNone）
+            "pitch_variation_semitones": float | None,  # 声の高さの標準偏差（半音）
+            "pause_ratio": float,  # 最初から最後の発話までのうち、発話のない時間の割合
+            "speech_seconds": float,  # 発話時間の合計（秒）
+        }
+        発話がない場合はNone
+    """
+    if not segments:
+        return None
+    speech = np.concatenate([samples[start:end] for start, end in segments])
+    speech_seconds = len(speech) / sample_rate
+    span = segments[-1][1] - segments[0][0]
+
+    levels = _frame_levels_db(speech, int(sample_rate * ENERGY_FRAME_SECONDS))
+    rms = np.sqrt(np.mean(np.square(speech, dtype=np.float64)))
+
+    pitches = estimate_pitch(speech, sample_rate)
+    pitch_hz = None
+    pitch_variation = None
+    if len(pitches):
+        pitch_hz = float(np.median(pitches))
+        semitones = 12 * np.log2(pitches / pitch_hz)
+        # オクターブの誤検出を除いてばらつきを求める
+        pitch_variation = float(np.std(semitones[np.abs(semitones) < 12]))
+
+    return {
+        "rms_db": round(float(20 * np.log10(max(rms, 1e-10))), 2),
+        "rms_variation_db": round(float(np.std(levels)) if len(levels) else 0.0, 2),
+        "speaking_rate": round(estimate_syllable_rate(speech, sample_rate), 2),
+        "pitch_hz": round(pitch_hz, 1) if pitch_hz is not None else None,
+        "pitch_variation_semitones": round(pitch_variation, 2) if pitch_variation is not None else None,
+        "pause_ratio": round(1.0 - len(speech) / span, 3) if span > 0 else 0.0,
+        "speech_seconds": round(speech_seconds, 2),
+    }
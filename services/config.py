@@ -0,0 +1,30 @@
+"""設定値の取得 - st.secrets と環境変数の両方に対応
+
+Streamlitアプリでは .streamlit/secrets.toml、CLIやバッチ処理では環境変数から
+同じキーで設定を読み込めるようにします。
+"""
+
+import os
+
+
+def get_setting(key: str, default=None):
+    """
+    設定値を取得（st.secrets を優先し、なければ環境変数）
+
+    Args:
+        key: 設定キー（例: "OPENAI_API_KEY", "DATABASE_URL"）
+        default: どちらにも設定がない場合の値
+
+    Returns:
+        設定値（見つからない場合は default）
+    """
+    try:
+        import streamlit as st
+
+        value = st.secrets.get(key)
+        if value is not None:
+            return value
+    except Exception:
+        # secrets.toml が存在しない場合（CLI実行時など）
+        pass
+    return os.environ.get(key, default)
@@ -2,53 +2,178 @@
 
 import json
 import logging
-import streamlit as st
+import re
+import threading
+import time
+from datetime import datetime, timedelta
 from typing import List, Dict, Optional, Tuple
 
+from services.config import get_setting
+from services.metrics import track_stage
+
 logger = logging.getLogger(__name__)
 
-# psycopg2のインポート（オプショナル）
-try:
-    import psycopg2
-    from psycopg2 import sql
-    PSYCOPG2_AVAILABLE = True
-except ImportError:
-    PSYCOPG2_AVAILABLE = False
-    logger.warning("psycopg2がインストールされていません。データベース機能は使用できません。")
+# コネクションプールの最大接続数
+DEFAULT_DB_POOL_MAX = 10
 
+# プールの接続がすべて使用中の場合に、空きを待つ最大時間（秒）と確認の間隔
+DEFAULT_DB_POOL_WAIT_SECONDS = 2.0
+POOL_WAIT_INTERVAL_SECONDS = 0.05
 
-def get_db_connection():
-    """Supabaseデータベースへの接続を取得（Supabase推奨のDATABASE_URL形式を優先）"""
-    if not PSYCOPG2_AVAILABLE:
+# conversation_history のパーティション（月ごと）の名前
+PARTITION_PREFIX = "conversation_history_p"
+LEGACY_PARTITION = "conversation_history_legacy"
+DEFAULT_PARTITION = "conversation_history_default"
+
+# 事前に作成しておくパーティションの月数
+DEFAULT_PARTITION_MONTHS_AHEAD = 3
+
+# 対話履歴の読み込みで、まず検索する直近の期間（日）
+DEFAULT_HISTORY_RECENT_DAYS = 90
+
+# init_database の同時実行を防ぐアドバイザリロックのキー
+MIGRATION_LOCK_KEY = 7_402_118
+
+_psycopg2 = None
+_psycopg2_checked = False
+_pool = None
+_pool_lock = threading.Lock()
+# pg_trgm 拡張機能が使えるか（None は未確認）
+_trgm_available = None
+
+
+def _load_psycopg2():
+    """psycopg2を初回使用時に読み込む（オプショナル、未インストールの場合はNone）"""
+    global _psycopg2, _psycopg2_checked
+    if not _psycopg2_checked:
+        try:
+            import psycopg2
+            import psycopg2.pool
+
+            _psycopg2 = psycopg2
+        except ImportError:
+            logger.warning("psycopg2がインストールされていません。データベース機能は使用できません。")
+        _psycopg2_checked = True
+    return _psycopg2
+
+
+def _connection_params() -> dict | None:
+    """接続パラメータ（Supabase推奨のDATABASE_URL形式を優先）。未設定の場合はNone"""
+    # Supabase推奨のDATABASE_URL形式を優先的に使用
+    database_url = get_setting("DATABASE_URL")
+    if database_url:
+        return {"dsn": database_url}
+
+    # 後方互換性のため、個別パラメータ形式もサポート
+    db_config = {
+        "host": get_setting("SUPABASE_DB_HOST"),
+        "port": get_setting("SUPABASE_DB_PORT", "5432"),
+        "database": get_setting("SUPABASE_DB_NAME", "postgres"),
+        "user": get_setting("SUPABASE_DB_USER"),
+        "password": get_setting("SUPABASE_DB_PASSWORD"),
+    }
+
+    # 必須項目のチェック
+    if not all([db_config["host"], db_config["user"], db_config["password"]]):
         return None
-    
+    return db_config
+
+
+def is_db_configured() -> bool:
+    """データベースの接続情報が設定されているか（接続は試みない）"""
+    return _connection_params() is not None
+
+
+def _get_pool():
+    """プロセス共通のコネクションプールを取得（初回に作成）"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            psycopg2 = _load_psycopg2()
+            params = _connection_params()
+            if psycopg2 is None or params is None:
+                return None
+            maxconn = int(get_setting("DB_POOL_MAX", DEFAULT_DB_POOL_MAX))
+            _pool = psycopg2.pool.ThreadedConnectionPool(0, maxconn, **params)
+        return _pool
+
+
+def get_db_connection():
+    """
+    Supabaseデータベースへの接続をコネクションプールから取得
+
+    使用後は必ず release_db_connection() でプールに返却してください。
+    使用中の接続が DB_POOL_MAX に達している場合は、DB_POOL_WAIT_SECONDS まで空きを待ちます。
+    """
     try:
-        # Supabase推奨のDATABASE_URL形式を優先的に使用
-        database_url = st.secrets.get("DATABASE_URL")
-        if database_url:
-            # DATABASE_URLから直接接続
-            conn = psycopg2.connect(database_url)
-            return conn
-        
-        # 後方互換性のため、個別パラメータ形式もサポート
-        db_config = {
-            "host": st.secrets.get("SUPABASE_DB_HOST"),
-            "port": st.secrets.get("SUPABASE_DB_PORT", "5432"),
-            "database": st.secrets.get("SUPABASE_DB_NAME", "postgres"),
-            "user": st.secrets.get("SUPABASE_DB_USER"),
-            "password": st.secrets.get("SUPABASE_DB_PASSWORD"),
-        }
-        
-        # 必須項目のチェック
-        if not all([db_config["host"], db_config["user"], db_config["password"]]):
-            return None
-        
-        # 接続を試行
-        conn = psycopg2.connect(**db_config)
-        return conn
-    except (KeyError, AttributeError, Exception) as e:
+        pool = _get_pool()
+    except Exception as e:
         logger.debug(f"データベース接続情報が設定されていません: {e}")
         return None
+    if pool is None:
+        return None
+
+    deadline = time.monotonic() + float(get_setting("DB_POOL_WAIT_SECONDS", DEFAULT_DB_POOL_WAIT_SECONDS))
+    while True:
+        try:
+            conn = pool.getconn()
+            if conn.closed:
+                # DB再起動などで切断された接続は破棄して取り直す
+                pool.putconn(conn, close=True)
+                conn = pool.getconn()
+            return conn
+        except _psycopg2.pool.PoolError as e:
+            # 接続が枯渇している（未設定とは区別して警告する）
+            if time.monotonic() >= deadline:
+                logger.warning(f"データベース接続プールに空きがありません（DB_POOL_MAX を確認してください）: {e}")
+                return None
+            time.sleep(POOL_WAIT_INTERVAL_SECONDS)
+        except Exception as e:
+            logger.debug(f"データベースに接続できません: {e}")
+            return None
+
+
+def release_db_connection(conn, broken: bool = False):
+    """
+    接続をプールに返却
+
+    Args:
+        conn: get_db_connection() で取得した接続
+        broken: 接続が使えなくなっている可能性がある場合True（返却せずに閉じる）
+    """
+    try:
+        if not conn.closed and not broken:
+            # 未確定のトランザクションを破棄してから返却
+            conn.rollback()
+        if _pool is None:
+            conn.close()
+        else:
+            _pool.putconn(conn, close=broken or bool(conn.closed))
+    except Exception:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def warm_up_pool(connections: int = 1) -> int:
+    """
+    コネクションプールに接続を事前に確立（起動直後の初回保存・読み込みを速くする）
+
+    Returns:
+        確立できた接続数
+    """
+    conns = []
+    try:
+        for _ in range(connections):
+            conn = get_db_connection()
+            if conn is None:
+                break
+            conns.append(conn)
+        return len(conns)
+    finally:
+        for conn in conns:
+            release_db_connection(conn)
 
 
 def is_db_available() -> bool:
@@ -59,73 +184,383 @@ def is_db_available() -> bool:
     
     try:
         # 接続テスト
-        conn.close()
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        release_db_connection(conn)
         return True
     except Exception:
+        release_db_connection(conn, broken=True)
         return False
 
 
+def month_start(value) -> datetime:
+    """value を含む月の初日（0時）"""
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    """月の初日 month から months か月後の月の初日"""
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def _partition_name(month: datetime) -> str:
+    return f"{PARTITION_PREFIX}{month:%Y%m}"
+
+
+def _parse_bound(value: str) -> Optional[datetime]:
+    """パーティションの境界値（MINVALUE / MAXVALUE の場合はNone）"""
+    value = value.strip()
+    if value in ("MINVALUE", "MAXVALUE"):
+        return None
+    return datetime.fromisoformat(value.strip("'"))
+
+
+def _list_partitions(cur) -> List[Dict]:
+    """conversation_history のパーティション一覧（lower / upper がNoneの場合は下限・上限なし）"""
+    cur.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'conversation_history'::regclass
+        ORDER BY c.relname
+    """)
+    partitions = []
+    for name, bound in cur.fetchall():
+        match = re.match(r"FOR VALUES FROM \((.+)\) TO \((.+)\)", bound)
+        partitions.append({
+            "name": name,
+            "default": match is None,
+            "lower": _parse_bound(match.group(1)) if match else None,
+            "upper": _parse_bound(match.group(2)) if match else None,
+        })
+    return partitions
+
+
+def _create_partitioned_table(cur):
+    """月ごとのレンジパーティションテーブルと、範囲外の行を受け付けるデフォルトパーティションを作成"""
+    # パーティションテーブルの主キー・一意制約にはパーティションキー（timestamp）を含める必要がある
+    cur.execute("CREATE SEQUENCE IF NOT EXISTS conversation_history_id_seq;")
+    cur.execute("""
+        CREATE TABLE conversation_history (
+            id INTEGER NOT NULL DEFAULT nextval('conversation_history_id_seq'),
+            username TEXT,
+            timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            transcription TEXT,
+            emotion_x REAL,
+            emotion_y REAL,
+            face_emotion TEXT,
+            ai_response TEXT,
+            client_id TEXT,
+            acoustic_features TEXT,
+            transcript_segments TEXT,
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp);
+    """)
+    cur.execute("ALTER SEQUENCE conversation_history_id_seq OWNED BY conversation_history.id;")
+    cur.execute(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF conversation_history DEFAULT;")
+
+
+def _migrate_legacy_table(cur):
+    """
+    パーティション化前の conversation_history をパーティションテーブルに移行
+
+    既存のテーブルは行をコピーせず、現在の月までを範囲とするパーティション
+    （conversation_history_legacy）としてそのまま組み込みます。
+    保持期間を過ぎるとメンテナンス（db_maintenance.py）で削除されます。
+    """
+    # 既存テーブルへのマイグレーション（usernameカラムが存在しない場合に追加）
+    cur.execute("ALTER TABLE conversation_history ADD COLUMN IF NOT EXISTS username TEXT;")
+    cur.execute("ALTER TABLE conversation_history ADD COLUMN IF NOT EXISTS client_id TEXT;")
+    # パーティションとして組み込むには、パーティションテーブルと同じカラムが必要
+    cur.execute("ALTER TABLE conversation_history ADD COLUMN IF NOT EXISTS acoustic_features TEXT;")
+    cur.execute("ALTER TABLE conversation_history ADD COLUMN IF NOT EXISTS transcript_segments TEXT;")
+
+    cur.execute(f"ALTER TABLE conversation_history RENAME TO {LEGACY_PARTITION};")
+    # 一意制約・ユーザー名のインデックスはパーティションテーブル側のインデックスに置き換える
+    cur.execute("DROP INDEX IF EXISTS idx_conversation_client_id;")
+    cur.execute("DROP INDEX IF EXISTS idx_conversation_username;")
+    # 主キーの名前（= インデックス名）が新しいテーブルの主キーと重ならないように変更
+    cur.execute(
+        "SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p'",
+        (LEGACY_PARTITION,),
+    )
+    row = cur.fetchone()
+    if row and row[0] == "conversation_history_pkey":
+        cur.execute(
+            f"ALTER TABLE {LEGACY_PARTITION} RENAME CONSTRAINT conversation_history_pkey "
+            f"TO {LEGACY_PARTITION}_pkey;"
+        )
+    # 時刻のない行はパーティションに振り分けられないため、最も古い時刻として扱う
+    cur.execute(f"UPDATE {LEGACY_PARTITION} SET timestamp = 'epoch' WHERE timestamp IS NULL;")
+    cur.execute(f"ALTER TABLE {LEGACY_PARTITION} ALTER COLUMN timestamp SET NOT NULL;")
+
+    cur.execute(f"SELECT MAX(timestamp) FROM {LEGACY_PARTITION};")
+    latest = cur.fetchone()[0]
+    now = datetime.now()
+    boundary = add_months(month_start(max(latest, now) if latest else now), 1)
+
+    _create_partitioned_table(cur)
+    cur.execute(
+        f"ALTER TABLE conversation_history ATTACH PARTITION {LEGACY_PARTITION} "
+        "FOR VALUES FROM (MINVALUE) TO (%s);",
+        (boundary,),
+    )
+    logger.info(f"conversation_history をパーティションテーブルに移行しました（{boundary:%Y-%m} より前は {LEGACY_PARTITION}）")
+
+
+def _create_indexes(cur) -> bool:
+    """パーティションテーブルのインデックス（各パーティションにも作成される。pg_trgm を使えるかを返す）"""
+    # ローカルの保存先（services/storage.py）から同期する行の重複を防ぐためのID
+    cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_conversation_history_client_id
+        ON conversation_history(client_id, timestamp);
+    """)
+    # ユーザーごとの新しい順の読み込み用
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_conversation_history_username_timestamp
+        ON conversation_history(username, timestamp DESC);
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_conversation_history_timestamp
+        ON conversation_history(timestamp DESC);
+    """)
+
+    # 全文検索用のトライグラムインデックス（日本語の部分一致検索に対応）
+    try:
+        cur.execute("SAVEPOINT create_trgm_index;")
+        cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_conversation_history_transcription_trgm
+            ON conversation_history USING GIN (transcription gin_trgm_ops);
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_conversation_history_ai_response_trgm
+            ON conversation_history USING GIN (ai_response gin_trgm_ops);
+        """)
+        cur.execute("RELEASE SAVEPOINT create_trgm_index;")
+    except Exception as e:
+        # 拡張機能を作成する権限がない場合、検索は関連度なしの部分一致（新しい順）になる
+        cur.execute("ROLLBACK TO SAVEPOINT create_trgm_index;")
+        logger.warning(f"全文検索インデックスを作成できませんでした（関連度順の検索は無効）: {e}")
+    return _query_trgm(cur)
+
+
+def _query_trgm(cur) -> bool:
+    """pg_trgm 拡張機能がインストールされているか"""
+    cur.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm');")
+    return bool(cur.fetchone()[0])
+
+
+def _check_trgm(cur) -> bool:
+    """pg_trgm を使えるか（init_database の結果。未初期化のプロセスでは初回に確認して保持）"""
+    global _trgm_available
+    if _trgm_available is None:
+        _trgm_available = _query_trgm(cur)
+    return _trgm_available
+
+
+def _create_functions(cur):
+    """集計で使う関数（JSONとして読めない値はエラーにせずNULLにする）"""
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION try_jsonb(value TEXT) RETURNS JSONB AS $$
+        BEGIN
+            RETURN value::jsonb;
+        EXCEPTION WHEN others THEN
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql IMMUTABLE;
+    """)
+
+
+def _create_month_partition(cur, month: datetime):
+    """
+    month の月のパーティションを作成
+
+    デフォルトパーティションに同じ期間の行がある場合は、新しいパーティションに移してから追加します。
+    """
+    name = _partition_name(month)
+    end = add_months(month, 1)
+    columns = (
+        "id, username, timestamp, transcription, emotion_x, emotion_y, face_emotion, ai_response, "
+        "client_id, acoustic_features, transcript_segments"
+    )
+    cur.execute(f"CREATE TABLE {name} (LIKE conversation_history INCLUDING DEFAULTS);")
+    cur.execute(
+        f"""
+        WITH moved AS (
+            DELETE FROM {DEFAULT_PARTITION} WHERE timestamp >= %s AND timestamp < %s
+            RETURNING {columns}
+        )
+        INSERT INTO {name} ({columns}) SELECT {columns} FROM moved;
+        """,
+        (month, end),
+    )
+    cur.execute(
+        f"ALTER TABLE conversation_history ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s);",
+        (month, end),
+    )
+
+
+def _ensure_partitions(cur, months_ahead: int) -> List[str]:
+    """今月から months_ahead か月先までのパーティションを作成（作成したパーティション名を返す）"""
+    partitions = [p for p in _list_partitions(cur) if not p["default"]]
+    created = []
+    this_month = month_start(datetime.now())
+    for offset in range(months_ahead + 1):
+        month = add_months(this_month, offset)
+        covered = any(
+            (p["lower"] is None or p["lower"] <= month) and (p["upper"] is None or month < p["upper"])
+            for p in partitions
+        )
+        if not covered:
+            _create_month_partition(cur, month)
+            created.append(_partition_name(month))
+    return created
+
+
+def _months_ahead() -> int:
+    return int(get_setting("HISTORY_PARTITION_MONTHS_AHEAD", DEFAULT_PARTITION_MONTHS_AHEAD))
+
+
 def init_database():
-    """データベーステーブルを初期化（存在しない場合に作成）"""
+    """
+    データベーステーブルを初期化（存在しない場合に作成）
+
+    conversation_history は timestamp による月ごとのレンジパーティションテーブルです。
+    パーティション化前の既存テーブルは移行し、今月から HISTORY_PARTITION_MONTHS_AHEAD か月先までの
+    パーティションを作成します。
+    """
+    global _trgm_available
     conn = get_db_connection()
     if conn is None:
         return False
     
     try:
         with conn.cursor() as cur:
-            # テーブル作成SQL（usernameカラムを含む）
-            create_table_sql = """
-            CREATE TABLE IF NOT EXISTS conversation_history (
-                id SERIAL PRIMARY KEY,
-                username TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                transcription TEXT,
-                emotion_x REAL,
-                emotion_y REAL,
-                face_emotion TEXT,
-                ai_response TEXT
-            );
-            """
-            cur.execute(create_table_sql)
-            
-            # 既存テーブルへのマイグレーション（usernameカラムが存在しない場合に追加）
-            try:
-                cur.execute("""
-                    SELECT column_name 
-                    FROM information_schema.columns 
-                    WHERE table_name='conversation_history' AND column_name='username'
-                """)
-                if cur.fetchone() is None:
-                    # usernameカラムが存在しない場合、追加
-                    cur.execute("ALTER TABLE conversation_history ADD COLUMN username TEXT;")
-                    logger.info("usernameカラムを追加しました")
-            except Exception as e:
-                logger.warning(f"マイグレーション処理中にエラーが発生しました: {e}")
-            
-            # インデックス作成（パフォーマンス向上のため）
-            create_index_sql = """
-            CREATE INDEX IF NOT EXISTS idx_conversation_timestamp 
-            ON conversation_history(timestamp DESC);
-            """
-            cur.execute(create_index_sql)
-            
-            # usernameカラムのインデックス作成
-            create_username_index_sql = """
-            CREATE INDEX IF NOT EXISTS idx_conversation_username 
-            ON conversation_history(username);
-            """
-            cur.execute(create_username_index_sql)
+            # 複数のサーバーが同時に起動しても、マイグレーションは1つずつ実行する
+            cur.execute("SELECT pg_advisory_xact_lock(%s);", (MIGRATION_LOCK_KEY,))
+            cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('conversation_history');")
+            row = cur.fetchone()
+            relkind = row[0] if row else None
+            if relkind is None:
+                _create_partitioned_table(cur)
+            elif relkind == "r":
+                _migrate_legacy_table(cur)
+            # 既存のパーティションテーブルへのマイグレーション（各パーティションにも追加される）
+            cur.execute("ALTER TABLE conversation_history ADD COLUMN IF NOT EXISTS acoustic_features TEXT;")
+            cur.execute("ALTER TABLE conversation_history ADD COLUMN IF NOT EXISTS transcript_segments TEXT;")
+
+            trgm_available = _create_indexes(cur)
+            _create_functions(cur)
+            _ensure_partitions(cur, _months_ahead())
             
         conn.commit()
-        conn.close()
+        _trgm_available = trgm_available
+        release_db_connection(conn)
         return True
     except Exception as e:
         logger.warning(f"データベース初期化エラー: {e}")
-        try:
-            conn.close()
-        except:
-            pass
+        release_db_connection(conn, broken=True)
+        return False
+
+
+def ensure_partitions(months_ahead: Optional[int] = None) -> Optional[List[str]]:
+    """
+    今月から months_ahead か月先までのパーティションを作成（メンテナンス用）
+
+    Returns:
+        作成したパーティション名のリスト。データベースを利用できない場合はNone
+    """
+    conn = get_db_connection()
+    if conn is None:
+        return None
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%s);", (MIGRATION_LOCK_KEY,))
+            created = _ensure_partitions(cur, _months_ahead() if months_ahead is None else months_ahead)
+        conn.commit()
+        release_db_connection(conn)
+        return created
+    except Exception as e:
+        logger.warning(f"パーティションの作成エラー: {e}")
+        release_db_connection(conn, broken=True)
+        return None
+
+
+def expired_partitions(cutoff: datetime) -> Optional[List[str]]:
+    """
+    期間全体が cutoff より前のパーティション名（古い順）
+
+    Returns:
+        パーティション名のリスト。データベースを利用できない場合はNone
+    """
+    conn = get_db_connection()
+    if conn is None:
+        return None
+    try:
+        with conn.cursor() as cur:
+            partitions = _list_partitions(cur)
+        release_db_connection(conn)
+    except Exception as e:
+        logger.warning(f"パーティション一覧の取得エラー: {e}")
+        release_db_connection(conn, broken=True)
+        return None
+    expired = [p for p in partitions if not p["default"] and p["upper"] is not None and p["upper"] <= cutoff]
+    return [p["name"] for p in sorted(expired, key=lambda p: p["upper"])]
+
+
+def drop_partition(name: str) -> bool:
+    """パーティションを切り離して削除（VACUUMを伴わずに古い行を削除できる）"""
+    if name != LEGACY_PARTITION and not re.fullmatch(rf"{PARTITION_PREFIX}\d{{6}}", name):
+        raise ValueError(f"conversation_history のパーティションではありません: {name}")
+    conn = get_db_connection()
+    if conn is None:
         return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"ALTER TABLE conversation_history DETACH PARTITION {name};")
+            cur.execute(f"DROP TABLE {name};")
+        conn.commit()
+        release_db_connection(conn)
+        logger.info(f"パーティション {name} を削除しました")
+        return True
+    except Exception as e:
+        logger.warning(f"パーティションの削除エラー（{name}）: {e}")
+        release_db_connection(conn, broken=True)
+        return False
+
+
+def delete_rows_before(cutoff: datetime) -> int:
+    """
+    cutoff より前の行を削除（パーティション単位で削除できない行用）
+
+    パーティションの刈り込みにより、cutoff を含むパーティション
+    （移行前のテーブル・デフォルトパーティションなど）だけが対象になります。
+
+    Returns:
+        削除した行数（失敗した場合は -1）
+    """
+    conn = get_db_connection()
+    if conn is None:
+        return -1
+    try:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM conversation_history WHERE timestamp < %s;", (cutoff,))
+            deleted = cur.rowcount
+        conn.commit()
+        release_db_connection(conn)
+        return deleted
+    except Exception as e:
+        logger.warning(f"古い行の削除エラー: {e}")
+        release_db_connection(conn, broken=True)
+        return -1
+
+
+def dump_segments(segments: Optional[Dict]) -> Optional[str]:
+    """発話の区間（列ごとの配列）を保存用のJSONに変換（長い録画でも小さくなるよう区切りの空白を省く）"""
+    if not segments or not segments.get("start"):
+        return None
+    return json.dumps(segments, ensure_ascii=False, separators=(",", ":"))
 
 
 def save_conversation_to_db(conversation_data: Dict, username: str = None) -> bool:
@@ -134,7 +569,15 @@ def save_conversation_to_db(conversation_data: Dict, username: str = None) -> bo
     if username is None:
         logger.warning("usernameがNoneのため、データベースへの保存をスキップします")
         return False
-    
+
+    with track_stage("save_conversation_to_db") as metrics:
+        saved = _insert_conversation(conversation_data, username)
+        metrics["error"] = not saved
+        return saved
+
+
+def _insert_conversation(conversation_data: Dict, username: str) -> bool:
+    """conversation_history に1行追加（save_conversation_to_db の本体）"""
     conn = get_db_connection()
     if conn is None:
         logger.warning("データベース接続が取得できませんでした")
@@ -148,29 +591,79 @@ def save_conversation_to_db(conversation_data: Dict, username: str = None) -> bo
         emotion_y = float(emotion[1]) if isinstance(emotion, (tuple, list)) else 0.0
         face_emotion = json.dumps(conversation_data.get("face_emotion")) if conversation_data.get("face_emotion") else None
         ai_response = conversation_data.get("ai_response", "")
-        timestamp = conversation_data.get("timestamp")
+        # timestamp はパーティションキーのため、未設定の場合も保存時刻を入れる
+        timestamp = conversation_data.get("timestamp") or datetime.now().isoformat()
+        client_id = conversation_data.get("client_id")
+        acoustic_features = conversation_data.get("acoustic_features")
+        acoustic_features = json.dumps(acoustic_features) if acoustic_features else None
+        transcript_segments = dump_segments(conversation_data.get("transcript_segments"))
         
         with conn.cursor() as cur:
             insert_sql = """
             INSERT INTO conversation_history 
-            (username, timestamp, transcription, emotion_x, emotion_y, face_emotion, ai_response)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            (username, timestamp, transcription, emotion_x, emotion_y, face_emotion, ai_response, client_id,
+             acoustic_features, transcript_segments)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (client_id, timestamp) DO NOTHING
             """
             cur.execute(
                 insert_sql,
-                (username, timestamp, transcription, emotion_x, emotion_y, face_emotion, ai_response)
+                (username, timestamp, transcription, emotion_x, emotion_y, face_emotion, ai_response, client_id,
+                 acoustic_features, transcript_segments)
             )
         
         conn.commit()
-        conn.close()
+        release_db_connection(conn)
         logger.info(f"データベースへの保存に成功しました（ユーザー名: {username}）")
         return True
     except Exception as e:
         logger.warning(f"データベース保存エラー（ユーザー名: {username}）: {e}")
-        try:
-            conn.close()
-        except:
-            pass
+        release_db_connection(conn, broken=True)
+        return False
+
+
+def insert_conversation_rows(rows: List[Tuple]) -> bool:
+    """
+    複数の行をまとめて追加（ローカルの保存先からの同期用）
+
+    client_id が既に存在する行は追加しません（同期の再実行で重複しない）。
+
+    Args:
+        rows: (client_id, username, timestamp, transcription, emotion_x, emotion_y,
+               face_emotion_json, ai_response, acoustic_features_json, transcript_segments_json)
+               のタプルのリスト
+
+    Returns:
+        すべての行を書き込めた（または既に存在した）場合True
+    """
+    if not rows:
+        return True
+
+    conn = get_db_connection()
+    if conn is None:
+        return False
+
+    try:
+        from psycopg2.extras import execute_values
+
+        with conn.cursor() as cur:
+            execute_values(
+                cur,
+                """
+                INSERT INTO conversation_history
+                (client_id, username, timestamp, transcription, emotion_x, emotion_y, face_emotion, ai_response,
+                 acoustic_features, transcript_segments)
+                VALUES %s
+                ON CONFLICT (client_id, timestamp) DO NOTHING
+                """,
+                rows,
+            )
+        conn.commit()
+        release_db_connection(conn)
+        return True
+    except Exception as e:
+        logger.warning(f"データベースへの同期エラー: {e}")
+        release_db_connection(conn, broken=True)
         return False
 
 
@@ -185,31 +678,62 @@ def load_conversation_history_from_db(username: str = None) -> List[Dict]:
         logger.warning("データベース接続が取得できませんでした")
         return []
     
+    limit = 100
+    recent_days = float(get_setting("HISTORY_RECENT_DAYS", DEFAULT_HISTORY_RECENT_DAYS))
+    recent_since = datetime.now() - timedelta(days=recent_days)
     try:
         with conn.cursor() as cur:
-            # usernameでフィルタリング
+            # usernameでフィルタリング（まず直近のパーティションだけを検索する）
             select_sql = """
-            SELECT timestamp, transcription, emotion_x, emotion_y, face_emotion, ai_response
+            SELECT timestamp, transcription, emotion_x, emotion_y, face_emotion, ai_response, client_id,
+                   acoustic_features, transcript_segments
             FROM conversation_history
-            WHERE username = %s
+            WHERE username = %s AND timestamp >= %s
             ORDER BY timestamp DESC
-            LIMIT 100
+            LIMIT %s
             """
-            cur.execute(select_sql, (username,))
+            cur.execute(select_sql, (username, recent_since, limit))
             rows = cur.fetchall()
+            if len(rows) < limit:
+                # 直近の履歴が少ないユーザーのみ、それより前のパーティションも検索する
+                cur.execute(
+                    """
+                    SELECT timestamp, transcription, emotion_x, emotion_y, face_emotion, ai_response, client_id,
+                           acoustic_features, transcript_segments
+                    FROM conversation_history
+                    WHERE username = %s AND timestamp < %s
+                    ORDER BY timestamp DESC
+                    LIMIT %s
+                    """,
+                    (username, recent_since, limit - len(rows)),
+                )
+                rows += cur.fetchall()
         
-        conn.close()
+        release_db_connection(conn)
         
         # データを辞書形式に変換
         history = []
         for row in rows:
-            timestamp, transcription, emotion_x, emotion_y, face_emotion_json, ai_response = row
+            (timestamp, transcription, emotion_x, emotion_y, face_emotion_json, ai_response, client_id,
+             acoustic_features_json, transcript_segments_json) = row
             face_emotion = None
             if face_emotion_json:
                 try:
                     face_emotion = json.loads(face_emotion_json)
                 except:
                     pass
+            acoustic_features = None
+            if acoustic_features_json:
+                try:
+                    acoustic_features = json.loads(acoustic_features_json)
+                except ValueError:
+                    pass
+            transcript_segments = None
+            if transcript_segments_json:
+                try:
+                    transcript_segments = json.loads(transcript_segments_json)
+                except ValueError:
+                    pass
             
             history.append({
                 "timestamp": timestamp.isoformat() if hasattr(timestamp, "isoformat") else str(timestamp),
@@ -217,14 +741,192 @@ def load_conversation_history_from_db(username: str = None) -> List[Dict]:
                 "emotion": (float(emotion_x), float(emotion_y)),
                 "face_emotion": face_emotion,
                 "ai_response": ai_response or "",
+                "client_id": client_id,
+                "acoustic_features": acoustic_features,
+                "transcript_segments": transcript_segments,
             })
         
         logger.info(f"データベースから{len(history)}件の履歴を読み込みました（ユーザー名: {username}）")
         return history
     except Exception as e:
         logger.warning(f"データベース読み込みエラー（ユーザー名: {username}）: {e}")
-        try:
-            conn.close()
-        except:
-            pass
+        release_db_connection(conn, broken=True)
         return []
+
+
+def search_conversations(
+    username: str, query: str, limit: int = 20, offset: int = 0
+) -> Optional[Dict]:
+    """
+    対話履歴を全文検索（文字起こし・AI応答の部分一致、関連度順）
+
+    pg_trgm のトライグラムインデックスを使用します（3文字未満の検索語は
+    ユーザー名のインデックスで絞り込んだ上での部分一致）。pg_trgm を利用できない場合は
+    関連度なしの部分一致で、新しい順に返します（score は 0）。
+
+    Args:
+        username: ユーザー名
+        query: 検索語
+        limit: 1ページの件数
+        offset: 読み飛ばす件数
+
+    Returns:
+        {"results": list[dict], "total": int}（各結果は履歴と同じ形式に "score" を追加）。
+        データベースを利用できない場合はNone
+    """
+    conn = get_db_connection()
+    if conn is None:
+        return None
+
+    pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    try:
+        with conn.cursor() as cur:
+            if _check_trgm(cur):
+                cur.execute(
+                    """
+                    SELECT timestamp, transcription, emotion_x, emotion_y, face_emotion, ai_response, client_id,
+                           acoustic_features, transcript_segments,
+                           GREATEST(word_similarity(%s, transcription), word_similarity(%s, ai_response)) AS score,
+                           COUNT(*) OVER () AS total
+                    FROM conversation_history
+                    WHERE username = %s AND (transcription ILIKE %s OR ai_response ILIKE %s)
+                    ORDER BY score DESC, timestamp DESC
+                    LIMIT %s OFFSET %s
+                    """,
+                    (query, query, username, pattern, pattern, limit, offset),
+                )
+            else:
+                cur.execute(
+                    """
+                    SELECT timestamp, transcription, emotion_x, emotion_y, face_emotion, ai_response, client_id,
+                           acoustic_features, transcript_segments,
+                           0.0 AS score,
+                           COUNT(*) OVER () AS total
+                    FROM conversation_history
+                    WHERE username = %s AND (transcription ILIKE %s OR ai_response ILIKE %s)
+                    ORDER BY timestamp DESC
+                    LIMIT %s OFFSET %s
+                    """,
+                    (username, pattern, pattern, limit, offset),
+                )
+            rows = cur.fetchall()
+        release_db_connection(conn)
+    except Exception as e:
+        logger.warning(f"検索エラー（ユーザー名: {username}）: {e}")
+        release_db_connection(conn, broken=True)
+        return None
+
+    results = []
+    for row in rows:
+        (timestamp, transcription, emotion_x, emotion_y, face_emotion_json, ai_response, client_id,
+         acoustic_features_json, transcript_segments_json, score, _total) = row
+        face_emotion = None
+        if face_emotion_json:
+            try:
+                face_emotion = json.loads(face_emotion_json)
+            except ValueError:
+                pass
+        acoustic_features = None
+        if acoustic_features_json:
+            try:
+                acoustic_features = json.loads(acoustic_features_json)
+            except ValueError:
+                pass
+        transcript_segments = None
+        if transcript_segments_json:
+            try:
+                transcript_segments = json.loads(transcript_segments_json)
+            except ValueError:
+                pass
+        results.append({
+            "timestamp": timestamp.isoformat() if hasattr(timestamp, "isoformat") else str(timestamp),
+            "transcription": transcription or "",
+            "emotion": (float(emotion_x), float(emotion_y)),
+            "face_emotion": face_emotion,
+            "ai_response": ai_response or "",
+            "client_id": client_id,
+            "acoustic_features": acoustic_features,
+            "transcript_segments": transcript_segments,
+            "score": float(score or 0.0),
+        })
+    total = rows[0][-1] if rows else 0
+    if not rows and offset > 0:
+        # 範囲外のページでは件数を取得できないため、先頭ページで数え直す
+        first = search_conversations(username, query, limit=1, offset=0)
+        total = first["total"] if first else 0
+    return {"results": results, "total": total}
+
+
+# 感情の推移を集計する時間の単位（date_trunc に渡す値）
+TREND_BUCKETS = ("hour", "day", "week", "month")
+
+
+def aggregate_conversation_trends(username: str, bucket: str = "day") -> Optional[Dict]:
+    """
+    対話履歴を時間単位で集計（行を読み込まず、データベース側で集計）
+
+    Args:
+        username: ユーザー名
+        bucket: 集計の単位（"hour" / "day" / "week" / "month"）
+
+    Returns:
+        {
+            "trajectory": [{"bucket": str, "count": int, "emotion_x": float, "emotion_y": float}, ...],  # 古い順
+            "face_emotions": {表情: 件数},  # JSONとして読めない行は "unknown"
+            "total": int,
+        }
+        データベースを利用できない場合はNone
+    """
+    if bucket not in TREND_BUCKETS:
+        raise ValueError(f"未対応の集計単位です: {bucket}")
+
+    conn = get_db_connection()
+    if conn is None:
+        return None
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT date_trunc(%s, timestamp) AS bucket, COUNT(*), AVG(emotion_x), AVG(emotion_y)
+                FROM conversation_history
+                WHERE username = %s
+                GROUP BY bucket
+                ORDER BY bucket
+                """,
+                (bucket, username),
+            )
+            trajectory_rows = cur.fetchall()
+            cur.execute(
+                """
+                SELECT try_jsonb(face_emotion) ->> 'dominant_emotion' AS dominant, COUNT(*)
+                FROM conversation_history
+                WHERE username = %s AND face_emotion IS NOT NULL
+                GROUP BY dominant
+                """,
+                (username,),
+            )
+            face_rows = cur.fetchall()
+        release_db_connection(conn)
+    except Exception as e:
+        logger.warning(f"集計エラー（ユーザー名: {username}）: {e}")
+        release_db_connection(conn, broken=True)
+        return None
+
+    trajectory = [
+        {
+            "bucket": start.isoformat() if hasattr(start, "isoformat") else str(start),
+            "count": int(count),
+            "emotion_x": float(emotion_x or 0.0),
+            "emotion_y": float(emotion_y or 0.0),
+        }
+        for start, count, emotion_x, emotion_y in trajectory_rows
+    ]
+    face_emotions = {}
+    for dominant, count in face_rows:
+        face_emotions[dominant or "unknown"] = face_emotions.get(dominant or "unknown", 0) + int(count)
+    return {
+        "trajectory": trajectory,
+        "face_emotions": face_emotions,
+        "total": sum(entry["count"] for entry in trajectory),
+    }
@@ -0,0 +1,472 @@
+"""似ている過去の対話の検索（埋め込みベクトル + NumPyの全件探索）
+
+文字起こしの埋め込みベクトルと感情座標の近さを組み合わせて、
+ユーザーの過去の対話から現在の対話に似ているものを探します。
+
+- 埋め込みは差し替え可能なプロバイダーで計算します（EMBEDDING_PROVIDER）
+  - "hashing"（既定）: 文字n-gramのハッシュによるローカル計算。APIを使わず、同じ入力には常に同じベクトル
+  - "openai": OpenAIの埋め込みAPI（text-embedding-3-small）
+- ベクトルは対話履歴と同じSQLiteファイル（SQLITE_PATH）の conversation_embeddings に保存します
+- 検索時はユーザーごとのベクトルをメモリ上の行列に読み込み（LRU）、行列積で全件のスコアを計算します。
+  1ユーザーの履歴（数千件）であれば1ミリ秒程度で検索できます
+- 保存先にあってベクトルがない対話（他のサーバーで保存されたものなど）は、初回の読み込み時に計算します。
+  読み込みはバックグラウンドで行い（prepare_similar_sessions()）、読み込みが終わるまでの検索は空の結果になります
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import sqlite3
+import threading
+import unicodedata
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from services.config import get_setting
+from services.metrics import track_stage
+from services.rate_limiter import call_openai, with_deadline
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+logger = logging.getLogger(__name__)
+
+# スコア = TEXT_WEIGHT * 文字起こしの類似度 + EMOTION_WEIGHT * 感情座標の近さ
+TEXT_WEIGHT = 0.7
+EMOTION_WEIGHT = 0.3
+
+# 感情座標（-1.0 ～ 1.0 の2次元）の最大距離
+MAX_EMOTION_DISTANCE = float(np.sqrt(8.0))
+
+# 似ている対話として扱う最小のスコア
+MIN_SIMILARITY_SCORE = 0.3
+
+# ベクトルをメモリに保持するユーザー数の上限
+DEFAULT_INDEX_MAX_USERS = 200
+
+# 同じ文字起こしの埋め込みを再計算しないよう保持する件数（Streamlitの再実行対策）
+QUERY_CACHE_SIZE = 64
+
+EMBEDDING_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversation_embeddings (
+    client_id TEXT NOT NULL,
+    username TEXT NOT NULL,
+    provider TEXT NOT NULL,
+    timestamp TEXT,
+    emotion_x REAL,
+    emotion_y REAL,
+    transcription TEXT,
+    ai_response TEXT,
+    vector BLOB NOT NULL,
+    PRIMARY KEY (client_id, provider)
+);
+CREATE INDEX IF NOT EXISTS idx_embeddings_username_provider
+ON conversation_embeddings(username, provider);
+"""
+
+
+class EmbeddingProvider(ABC):
+    """テキストの埋め込みベクトルを計算するプロバイダーの共通インターフェース"""
+
+    # 保存したベクトルを区別するための名前（モデル・次元数が変わる場合は別の名前にする）
+    key = ""
+    dim = 0
+
+    @abstractmethod
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """
+        テキストの埋め込みを計算
+
+        Returns:
+            (len(texts), 次元数) の float32 配列。各行はL2正規化済み
+        """
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    文字n-gramのハッシュによる埋め込み（ローカル計算、決定的）
+
+    日本語は単語の区切りがないため、文字の2-gram・3-gramを特徴量とし、
+    符号付きのハッシュで固定次元に畳み込みます（feature hashing）。
+    """
+
+    def __init__(self, dim: int = 256, ngram_sizes: tuple[int, ...] = (2, 3)):
+        self.dim = dim
+        self.ngram_sizes = ngram_sizes
+        self.key = f"hashing-{dim}"
+
+    def _embed_one(self, text: str) -> np.ndarray:
+        text = "".join(unicodedata.normalize("NFKC", text).lower().split())
+        hashes = [
+            zlib.crc32(text[i : i + n].encode("utf-8"))
+            for n in self.ngram_sizes
+            for i in range(len(text) - n + 1)
+        ]
+        if not hashes:
+            return np.zeros(self.dim, dtype=np.float64)
+        hashes = np.array(hashes, dtype=np.uint32)
+        # 下位ビットで次元を、最上位ビットで符号を決める
+        signs = np.where(hashes >> 31, -1.0, 1.0)
+        return np.bincount(hashes % self.dim, weights=signs, minlength=self.dim)
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return _normalize_rows(np.stack([self._embed_one(text) for text in texts]))
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """OpenAIの埋め込みAPI"""
+
+    def __init__(self, client: OpenAI, model: str = "text-embedding-3-small", dim: int = 256):
+        self.client = client
+        self.model = model
+        self.dim = dim
+        self.key = f"openai-{model}-{dim}"
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        response = call_openai(
+            self.model,
+            lambda: with_deadline(self.client).embeddings.create(model=self.model, input=texts, dimensions=self.dim),
+            # 日本語はおおよそ1文字1トークンとして見積もる
+            estimated_tokens=sum(len(text) for text in texts),
+        )
+        return _normalize_rows(np.array([item.embedding for item in response.data], dtype=np.float64))
+
+
+def get_embedding_provider(client: OpenAI | None = None) -> EmbeddingProvider:
+    """設定（EMBEDDING_PROVIDER）に従ってプロバイダーを作成（"openai" でクライアントがない場合は "hashing"）"""
+    name = str(get_setting("EMBEDDING_PROVIDER", "hashing")).lower()
+    if name == "openai" and client is not None:
+        return OpenAIEmbeddingProvider(client)
+    return HashingEmbeddingProvider()
+
+
+def _entry_id(username: str, conversation: dict) -> str:
+    """保存時のID（client_id がない古い履歴はユーザー名と時刻から決める）"""
+    if conversation.get("client_id"):
+        return conversation["client_id"]
+    source = f"{username}\0{conversation.get('timestamp', '')}"
+    return "legacy-" + hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """埋め込みベクトルの保存先（対話履歴と同じSQLiteファイル）"""
+
+    def __init__(self, path: str | None = None):
+        from services.storage import SQLiteBackend
+
+        self._sqlite = SQLiteBackend(path)
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def connection(self) -> sqlite3.Connection:
+        conn = self._sqlite.connection()
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    conn.executescript(EMBEDDING_SCHEMA)
+                    self._initialized = True
+        return conn
+
+    def load(self, username: str, provider_key: str) -> tuple[list[dict], np.ndarray]:
+        """ユーザーの保存済みベクトル（古い順）"""
+        rows = self.connection().execute(
+            "SELECT client_id, timestamp, emotion_x, emotion_y, transcription, ai_response, vector "
+            "FROM conversation_embeddings WHERE username = ? AND provider = ? ORDER BY timestamp",
+            (username, provider_key),
+        ).fetchall()
+        entries = [
+            {
+                "client_id": client_id,
+                "timestamp": timestamp,
+                "emotion": (float(emotion_x), float(emotion_y)),
+                "transcription": transcription or "",
+                "ai_response": ai_response or "",
+            }
+            for client_id, timestamp, emotion_x, emotion_y, transcription, ai_response, _ in rows
+        ]
+        vectors = [np.frombuffer(row[-1], dtype=np.float32) for row in rows]
+        return entries, np.stack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+
+    def save(self, username: str, provider_key: str, entries: list[dict], vectors: np.ndarray):
+        with self.connection() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO conversation_embeddings "
+                "(client_id, username, provider, timestamp, emotion_x, emotion_y, transcription, "
+                "ai_response, vector) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        entry["client_id"],
+                        username,
+                        provider_key,
+                        entry["timestamp"],
+                        entry["emotion"][0],
+                        entry["emotion"][1],
+                        entry["transcription"],
+                        entry["ai_response"],
+                        vector.astype(np.float32).tobytes(),
+                    )
+                    for entry, vector in zip(entries, vectors)
+                ],
+            )
+
+
+class _UserIndex:
+    """1ユーザー分のベクトル行列と感情座標"""
+
+    def __init__(self, entries: list[dict], vectors: np.ndarray, dim: int):
+        self.entries = list(entries)
+        self.vectors = vectors if len(entries) else np.zeros((0, dim), dtype=np.float32)
+        self.emotions = np.array([entry["emotion"] for entry in entries], dtype=np.float32).reshape(-1, 2)
+        self.positions = {entry["client_id"]: i for i, entry in enumerate(self.entries)}
+
+    def add(self, entries: list[dict], vectors: np.ndarray):
+        for entry, vector in zip(entries, vectors):
+            position = self.positions.get(entry["client_id"])
+            if position is not None:
+                self.entries[position] = entry
+                self.vectors[position] = vector
+                self.emotions[position] = entry["emotion"]
+                continue
+            self.positions[entry["client_id"]] = len(self.entries)
+            self.entries.append(entry)
+            self.vectors = np.vstack([self.vectors, vector[np.newaxis, :]])
+            self.emotions = np.vstack([self.emotions, np.array([entry["emotion"]], dtype=np.float32)])
+
+    def search(
+        self, vector: np.ndarray, emotion: tuple[float, float], k: int, exclude: str | None
+    ) -> list[dict]:
+        if not self.entries:
+            return []
+        text_similarity = self.vectors @ vector
+        emotion_similarity = 1.0 - np.linalg.norm(
+            self.emotions - np.asarray(emotion, dtype=np.float32), axis=1
+        ) / MAX_EMOTION_DISTANCE
+        scores = TEXT_WEIGHT * text_similarity + EMOTION_WEIGHT * emotion_similarity
+        if exclude in self.positions:
+            scores[self.positions[exclude]] = -np.inf
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            {
+                **self.entries[i],
+                "score": float(scores[i]),
+                "text_similarity": float(text_similarity[i]),
+                "emotion_similarity": float(emotion_similarity[i]),
+            }
+            for i in top
+            if np.isfinite(scores[i])
+        ]
+
+
+class SimilarSessionIndex:
+    """ユーザーごとの対話の埋め込みを保持し、似ている対話を検索する（スレッドセーフ）"""
+
+    def __init__(self, provider: EmbeddingProvider, store: EmbeddingStore, max_users: int):
+        self.provider = provider
+        self.store = store
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._users: OrderedDict[str, _UserIndex] = OrderedDict()
+        self._loading: set[str] = set()
+        self._queries: OrderedDict[str, np.ndarray] = OrderedDict()
+
+    def _embed_query(self, text: str) -> np.ndarray:
+        with self._lock:
+            vector = self._queries.get(text)
+            if vector is not None:
+                self._queries.move_to_end(text)
+                return vector
+        vector = self.provider.embed([text])[0]
+        with self._lock:
+            self._queries[text] = vector
+            while len(self._queries) > QUERY_CACHE_SIZE:
+                self._queries.popitem(last=False)
+        return vector
+
+    def _user_index(self, username: str) -> _UserIndex | None:
+        """読み込み済みのユーザーのベクトル（未読み込みの場合はNone）"""
+        with self._lock:
+            index = self._users.get(username)
+            if index is not None:
+                self._users.move_to_end(username)
+            return index
+
+    def prepare(self, username: str) -> bool:
+        """
+        ユーザーのベクトルをバックグラウンドで読み込む
+
+        Returns:
+            読み込み済みの場合True
+        """
+        with self._lock:
+            if username in self._users:
+                return True
+            if username in self._loading:
+                return False
+            self._loading.add(username)
+        threading.Thread(
+            target=self._load_in_background, args=(username,), name="similar-sessions-load", daemon=True
+        ).start()
+        return False
+
+    def _load_in_background(self, username: str):
+        try:
+            with track_stage("similar_sessions_load"):
+                self._load_user_index(username)
+        except Exception as e:
+            logger.warning(f"似ている対話の検索インデックスの準備エラー（ユーザー名: {username}）: {e}")
+        finally:
+            with self._lock:
+                self._loading.discard(username)
+
+    def _load_user_index(self, username: str) -> _UserIndex:
+        """ユーザーのベクトルを読み込む（保存先にあってベクトルがない対話はここで計算）"""
+        from services.storage import get_storage
+
+        entries, vectors = self.store.load(username, self.provider.key)
+        index = _UserIndex(entries, vectors, self.provider.dim)
+
+        missing = [
+            {
+                "client_id": _entry_id(username, conversation),
+                "timestamp": conversation.get("timestamp"),
+                "emotion": tuple(conversation.get("emotion", (0.0, 0.0))),
+                "transcription": conversation.get("transcription", ""),
+                "ai_response": conversation.get("ai_response", ""),
+            }
+            for conversation in get_storage().load_history(username)
+            if conversation.get("transcription")
+        ]
+        missing = [entry for entry in missing if entry["client_id"] not in index.positions]
+        if missing:
+            missing_vectors = self.provider.embed([entry["transcription"] for entry in missing])
+            self.store.save(username, self.provider.key, missing, missing_vectors)
+            index.add(missing, missing_vectors)
+
+        with self._lock:
+            self._users[username] = index
+            self._users.move_to_end(username)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return index
+
+    def add(self, username: str, conversation: dict):
+        """保存した対話のベクトルを計算して保存"""
+        if not conversation.get("transcription"):
+            return
+        entry = {
+            "client_id": _entry_id(username, conversation),
+            "timestamp": conversation.get("timestamp"),
+            "emotion": tuple(conversation.get("emotion", (0.0, 0.0))),
+            "transcription": conversation["transcription"],
+            "ai_response": conversation.get("ai_response", ""),
+        }
+        vectors = self._embed_query(entry["transcription"])[np.newaxis, :]
+        self.store.save(username, self.provider.key, [entry], vectors)
+        with self._lock:
+            index = self._users.get(username)
+            if index is not None:
+                index.add([entry], vectors)
+
+    def search(
+        self,
+        username: str,
+        transcription: str,
+        emotion: tuple[float, float],
+        k: int = 3,
+        exclude_client_id: str | None = None,
+        min_score: float = MIN_SIMILARITY_SCORE,
+    ) -> list[dict]:
+        """
+        ユーザーの過去の対話から、文字起こしと感情座標が似ているものを検索
+
+        ユーザーのベクトルが未読み込みの場合は、読み込み（履歴全体の埋め込みの計算を含む）を
+        待たずにバックグラウンドで開始し、空のリストを返します。
+
+        Returns:
+            スコアの高い順の対話のリスト（client_id, timestamp, emotion, transcription, ai_response,
+            score, text_similarity, emotion_similarity）
+        """
+        index = self._user_index(username)
+        if index is None:
+            self.prepare(username)
+            return []
+        vector = self._embed_query(transcription)
+        with self._lock:
+            results = index.search(vector, emotion, k, exclude_client_id)
+        return [result for result in results if result["score"] >= min_score]
+
+
+_index: SimilarSessionIndex | None = None
+_index_lock = threading.Lock()
+
+
+def get_similar_session_index(client: OpenAI | None = None) -> SimilarSessionIndex:
+    """プロセス共通の検索インデックス（初回呼び出し時のプロバイダー・保存先で作成）"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SimilarSessionIndex(
+                get_embedding_provider(client),
+                EmbeddingStore(),
+                max_users=int(get_setting("EMBEDDING_INDEX_MAX_USERS", DEFAULT_INDEX_MAX_USERS)),
+            )
+        return _index
+
+
+def find_similar_sessions(
+    username: str | None,
+    transcription: str,
+    emotion: tuple[float, float],
+    k: int = 3,
+    exclude_client_id: str | None = None,
+    client: OpenAI | None = None,
+) -> list[dict]:
+    """似ている過去の対話を検索（ユーザー名・文字起こしがない場合やエラー時は空リスト）"""
+    if not username or not transcription:
+        return []
+    with track_stage("similar_sessions") as metrics:
+        try:
+            return get_similar_session_index(client).search(
+                username, transcription, emotion, k, exclude_client_id
+            )
+        except Exception as e:
+            logger.warning(f"似ている対話の検索エラー（ユーザー名: {username}）: {e}")
+            metrics["error"] = True
+            return []
+
+
+def prepare_similar_sessions(username: str | None, client: OpenAI | None = None):
+    """ユーザーの検索インデックスをバックグラウンドで準備（最初の検索を待たせないため、検索より前に呼ぶ）"""
+    if not username:
+        return
+    try:
+        get_similar_session_index(client).prepare(username)
+    except Exception as e:
+        logger.warning(f"似ている対話の検索インデックスの準備エラー（ユーザー名: {username}）: {e}")
+
+
+def index_conversation(username: str | None, conversation: dict, client: OpenAI | None = None):
+    """保存した対話を検索インデックスに追加（エラー時は記録のみ）"""
+    if not username:
+        return
+    try:
+        get_similar_session_index(client).add(username, conversation)
+    except Exception as e:
+        logger.warning(f"対話の埋め込みの保存エラー（ユーザー名: {username}）: {e}")
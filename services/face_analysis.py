@@ -1,41 +1,47 @@
 """表情認識サービス（GPT-4o Vision使用）- エマが実装"""
 
+from __future__ import annotations
+
 import base64
-import cv2
 import json
-from openai import OpenAI
+import logging
 import os
-import tempfile
+import time
 from collections import Counter
+from typing import TYPE_CHECKING
 
+from services.media_worker import run_media_task
+from services.metrics import record_usage, track_stage
+from services.rate_limiter import MIN_REQUEST_TIMEOUT_SECONDS, call_openai, with_deadline
+from services.recording_store import media_path, media_size
 
-def extract_frames_from_webm(
-    video_data: bytes,
-    interval_seconds: float = 5.0,
-) -> list[bytes]:
-    """
-    WebMから指定間隔でフレームを抽出
+if TYPE_CHECKING:
+    # 型ヒント専用（openaiは呼び出し側でクライアント作成時に読み込まれる）
+    from openai import OpenAI
 
-    Args:
-        video_data: WebM形式の動画データ（bytes）
-        interval_seconds: フレーム抽出間隔（秒）
+logger = logging.getLogger(__name__)
 
-    Returns:
-        抽出したフレームのリスト（各フレームはJPEG形式のbytes）
+# 1フレーム分のVisionリクエストの見積もりトークン数（画像 + プロンプト + 応答）
+ESTIMATED_VISION_TOKENS = 1200
+
+
+def _decode_frames(
+    path: str, interval_seconds: float
+) -> tuple[list[bytes], int, list[float]] | None:
     """
-    temp_video_path = None
-    cap = None
-    try:
-        if not video_data or len(video_data) < 100:
-            return []
+    動画ファイルから指定間隔でフレームを取り出してJPEGに変換（メディア処理ワーカーで実行）
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".webm") as f:
-            f.write(video_data)
-            temp_video_path = f.name
+    Returns:
+        (JPEGフレームのリスト, デコードしたフレーム数, 各フレームの時刻（秒）のリスト)。
+        ファイルを開けない場合はNone
+    """
+    # OpenCVは読み込みに時間がかかるため、初回使用時に読み込む
+    import cv2
 
-        cap = cv2.VideoCapture(temp_video_path)
+    cap = cv2.VideoCapture(path)
+    try:
         if not cap.isOpened():
-            return []
+            return None
 
         fps = cap.get(cv2.CAP_PROP_FPS)
         if not fps or fps <= 0:
@@ -43,6 +49,7 @@ def extract_frames_from_webm(
         interval_frames = max(1, int(round(fps * max(0.1, interval_seconds))))
 
         frames: list[bytes] = []
+        times: list[float] = []
         frame_idx = 0
         while True:
             ret, frame = cap.read()
@@ -52,14 +59,108 @@ def extract_frames_from_webm(
                 ok, buffer = cv2.imencode(".jpg", frame)
                 if ok:
                     frames.append(buffer.tobytes())
+                    # ブラウザの録画はFPSが正確でないことがあるため、フレームの時刻を優先する
+                    position = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+                    times.append(round(position if position > 0 else frame_idx / fps, 2))
             frame_idx += 1
-
-        return frames
+        return frames, frame_idx, times
     finally:
-        if cap is not None:
-            cap.release()
-        if temp_video_path and os.path.exists(temp_video_path):
-            os.remove(temp_video_path)
+        cap.release()
+
+
+def extract_timed_frames(
+    video_data: bytes | str | os.PathLike,
+    interval_seconds: float = 5.0,
+) -> tuple[list[bytes], list[float]]:
+    """
+    WebMから指定間隔でフレームを抽出（各フレームの時刻付き）
+
+    デコードとJPEGエンコードは共有のメディア処理ワーカー（services/media_worker.py）で実行します。
+
+    Args:
+        video_data: WebM形式の動画データ（bytes）またはファイルパス
+        interval_seconds: フレーム抽出間隔（秒）
+
+    Returns:
+        (JPEG形式のフレームのリスト, 各フレームの録画開始からの時刻（秒）のリスト)
+    """
+    if media_size(video_data) < 100:
+        return [], []
+
+    with track_stage("extract_frames_from_webm") as metrics, media_path(video_data) as path:
+        result = run_media_task(_decode_frames, path, interval_seconds)
+        if result is None:
+            metrics["error"] = True
+            return [], []
+
+        frames, frame_count, times = result
+        metrics["frames_decoded"] = frame_count
+        return frames, times
+
+
+def extract_frames_from_webm(
+    video_data: bytes | str | os.PathLike,
+    interval_seconds: float = 5.0,
+) -> list[bytes]:
+    """
+    WebMから指定間隔でフレームを抽出
+
+    Args:
+        video_data: WebM形式の動画データ（bytes）またはファイルパス
+        interval_seconds: フレーム抽出間隔（秒）
+
+    Returns:
+        抽出したフレームのリスト（各フレームはJPEG形式のbytes）
+    """
+    return extract_timed_frames(video_data, interval_seconds)[0]
+
+
+def _request_frame_emotion(frame_image: bytes, client: OpenAI, deadline: float | None = None) -> dict:
+    """1フレームの画像をGPT-4o Visionで分析（API呼び出しに失敗した場合は例外を送出）"""
+    base64_image = base64.b64encode(frame_image).decode("utf-8")
+    prompt = (
+        "この画像の人物の表情から感情を分析してください。"
+        "次のJSONだけを返してください。"
+        '{"emotion":"happy|sad|angry|surprised|neutral|other","confidence":0.0,"description":""}'
+    )
+
+    with track_stage("analyze_emotion_with_gpt4o_vision") as metrics:
+        metrics["bytes_uploaded"] = len(base64_image)
+        response = call_openai(
+            "gpt-4o",
+            lambda: with_deadline(client).chat.completions.create(
+                model="gpt-4o",
+                messages=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": prompt},
+                            {
+                                "type": "image_url",
+                                "image_url": {
+                                    "url": f"data:image/jpeg;base64,{base64_image}"
+                                },
+                            },
+                        ],
+                    }
+                ],
+                temperature=0.2,
+            ),
+            estimated_tokens=ESTIMATED_VISION_TOKENS,
+            deadline=deadline,
+        )
+        record_usage(metrics, response)
+
+    content = response.choices[0].message.content or ""
+    try:
+        data = json.loads(content)
+        return {
+            "emotion": str(data.get("emotion", "neutral")),
+            "confidence": float(data.get("confidence", 0.0)),
+            "description": str(data.get("description", "")),
+        }
+    except json.JSONDecodeError:
+        return {"emotion": "neutral", "confidence": 0.0, "description": content}
 
 
 def analyze_emotion_with_gpt4o_vision(
@@ -79,59 +180,61 @@ def analyze_emotion_with_gpt4o_vision(
     try:
         if not frame_image:
             return {"emotion": "neutral", "confidence": 0.0, "description": ""}
+        return _request_frame_emotion(frame_image, client)
+    except Exception:
+        return {"emotion": "neutral", "confidence": 0.0, "description": ""}
 
-        base64_image = base64.b64encode(frame_image).decode("utf-8")
-        prompt = (
-            "この画像の人物の表情から感情を分析してください。"
-            "次のJSONだけを返してください。"
-            '{"emotion":"happy|sad|angry|surprised|neutral|other","confidence":0.0,"description":""}'
-        )
 
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
-                            },
-                        },
-                    ],
-                }
-            ],
-            temperature=0.2,
-        )
+def aggregate_frame_emotions(
+    results: list[dict],
+    frames_total: int | None = None,
+    frame_times: list[float] | None = None,
+) -> dict | None:
+    """
+    フレームごとの分析結果を集計
 
-        content = response.choices[0].message.content or ""
-        try:
-            data = json.loads(content)
-            return {
-                "emotion": str(data.get("emotion", "neutral")),
-                "confidence": float(data.get("confidence", 0.0)),
-                "description": str(data.get("description", "")),
-            }
-        except json.JSONDecodeError:
-            return {"emotion": "neutral", "confidence": 0.0, "description": content}
-    except Exception:
-        return {"emotion": "neutral", "confidence": 0.0, "description": ""}
+    Args:
+        results: analyze_emotion_with_gpt4o_vision() の結果のリスト
+        frames_total: 抽出したフレーム数（一部のフレームのみ分析した場合に指定）
+        frame_times: 各フレームの時刻（秒）。results と同じ順（指定した場合は "frame_times" に含める）
+
+    Returns:
+        analyze_face_emotion() の face_emotion_result と同じ形式のdict（結果がない場合はNone）
+    """
+    if not results:
+        return None
+
+    emotions = [result.get("emotion", "neutral") for result in results]
+    confidences = [float(result.get("confidence", 0.0)) for result in results]
+    dominant_emotion = Counter(emotions).most_common(1)[0][0]
+    aggregated = {
+        "emotions": emotions,
+        "dominant_emotion": dominant_emotion,
+        "confidence": sum(confidences) / len(confidences),
+        "frame_count": len(results),
+        "partial": frames_total is not None and len(results) < frames_total,
+        "confidences": [round(confidence, 2) for confidence in confidences],
+    }
+    if frame_times is not None:
+        aggregated["frame_times"] = list(frame_times[: len(results)])
+    return aggregated
 
 
 def analyze_face_emotion(
-    video_data: bytes,
+    video_data: bytes | str | os.PathLike,
     client: OpenAI,
     interval_seconds: float = 5.0,
+    deadline: float | None = None,
 ) -> tuple[dict | None, str]:
     """
     WebM録画データから表情認識を実行（GPT-4o Vision使用）
 
     Args:
-        video_data: WebM形式の動画データ（bytes）
+        video_data: WebM形式の動画データ（bytes）またはファイルパス
         client: OpenAIクライアント
         interval_seconds: フレーム抽出間隔（秒、デフォルト: 5.0）
+        deadline: 締め切り（time.monotonic() 基準）。締め切りを過ぎた場合は
+            未分析のフレームを打ち切り、それまでに分析できたフレームだけで集計する
 
     Returns:
         (face_emotion_result, status) のタプル
@@ -139,7 +242,10 @@ def analyze_face_emotion(
             "emotions": list[str],  # 各フレームの感情リスト
             "dominant_emotion": str,  # 最も多い感情
             "confidence": float,  # 平均信頼度
-            "frame_count": int  # 分析したフレーム数
+            "frame_count": int,  # 分析したフレーム数
+            "partial": bool,  # 締め切りにより一部のフレームのみ分析した場合True
+            "confidences": list[float],  # 各フレームの信頼度（emotions と同じ順）
+            "frame_times": list[float],  # 各フレームの録画開始からの時刻（秒、emotions と同じ順）
           } または None
         - status: "completed" または "error"
 
@@ -147,30 +253,33 @@ def analyze_face_emotion(
         Exception: 重大なエラーが発生した場合
     """
     try:
-        frames = extract_frames_from_webm(video_data, interval_seconds)
+        frames, frame_times = extract_timed_frames(video_data, interval_seconds)
         if not frames:
             return None, "error"
 
-        emotions: list[str] = []
-        confidences: list[float] = []
+        results: list[dict] = []
         for frame in frames:
-            result = analyze_emotion_with_gpt4o_vision(frame, client)
-            emotions.append(result.get("emotion", "neutral"))
-            confidences.append(float(result.get("confidence", 0.0)))
-
-        emotion_counts = Counter(emotions)
-        dominant_emotion = emotion_counts.most_common(1)[0][0]
-
-        return (
-            {
-                "emotions": emotions,
-                "dominant_emotion": dominant_emotion,
-                "confidence": sum(confidences) / len(confidences)
-                if confidences
-                else 0.0,
-                "frame_count": len(frames),
-            },
-            "completed",
+            # 最小のタイムアウトも残らない場合、リクエストが締め切りを越えないよう新しいフレームは分析しない
+            if deadline is not None and deadline - time.monotonic() < MIN_REQUEST_TIMEOUT_SECONDS:
+                break
+
+            try:
+                # 締め切りを過ぎたリクエストは打ち切られ、時間が残らない場合は再試行しない
+                results.append(_request_frame_emotion(frame, client, deadline))
+            except Exception:
+                if deadline is not None and deadline - time.monotonic() < MIN_REQUEST_TIMEOUT_SECONDS:
+                    break
+                results.append({"emotion": "neutral", "confidence": 0.0, "description": ""})
+
+        face_emotion = aggregate_frame_emotions(
+            results, frames_total=len(frames), frame_times=frame_times
         )
+        if face_emotion is None:
+            return None, "error"
+        if face_emotion["partial"]:
+            logger.info(
+                f"締め切りのため表情認識を{len(results)}/{len(frames)}フレームで打ち切りました"
+            )
+        return face_emotion, "completed"
     except Exception:
         return None, "error"
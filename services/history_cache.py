@@ -0,0 +1,96 @@
+"""ユーザーごとの対話履歴キャッシュ
+
+ログインやページの再読み込みのたびに保存先から履歴を読み込まないよう、
+直近に読み込んだユーザーの履歴をプロセス内で共有してキャッシュします。
+
+- 保持するユーザー数に上限があり、超えた場合は最も使われていないユーザーから削除（LRU）
+- 保存時はキャッシュも更新（ライトスルー）
+- 複数台構成では他のサーバーでの保存を反映するため、一定時間（TTL）で破棄
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from services.config import get_setting
+
+# キャッシュするユーザー数の上限と有効期間（秒）の既定値
+DEFAULT_MAX_USERS = 1000
+DEFAULT_TTL_SECONDS = 300.0
+
+
+class HistoryCache:
+    """ユーザー名 → 対話履歴（新しい順）のLRUキャッシュ（スレッドセーフ）"""
+
+    def __init__(self, max_users: int, ttl_seconds: float, max_entries: int = 100):
+        """
+        Args:
+            max_users: キャッシュするユーザー数の上限
+            ttl_seconds: 読み込みからの有効期間（秒）
+            max_entries: ユーザーごとに保持する履歴の件数
+        """
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[float, list[dict]]] = OrderedDict()
+
+    def get(self, username: str) -> list[dict] | None:
+        """キャッシュされた履歴（期限切れ・未登録の場合はNone）"""
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                return None
+            loaded_at, history = entry
+            if time.monotonic() - loaded_at > self.ttl_seconds:
+                del self._entries[username]
+                return None
+            self._entries.move_to_end(username)
+            # 呼び出し側で追加・変更してもキャッシュに影響しないようにコピーを返す
+            return list(history)
+
+    def put(self, username: str, history: list[dict]):
+        """保存先から読み込んだ履歴を登録"""
+        with self._lock:
+            self._entries[username] = (time.monotonic(), list(history[: self.max_entries]))
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def add(self, username: str, conversation: dict):
+        """
+        保存した履歴をキャッシュにも追加（ライトスルー）
+
+        キャッシュにないユーザーは次回の読み込み時に保存先から取得するため、何もしません。
+        有効期間は延長しません（他のサーバーでの保存を反映するため）。
+        """
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                return
+            loaded_at, history = entry
+            self._entries[username] = (loaded_at, [conversation, *history][: self.max_entries])
+
+    def invalidate(self, username: str | None = None):
+        """ユーザーのキャッシュを破棄（Noneの場合はすべて）"""
+        with self._lock:
+            if username is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(username, None)
+
+
+_cache: HistoryCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_history_cache() -> HistoryCache:
+    """プロセス共通の履歴キャッシュ（HISTORY_CACHE_MAX_USERS / HISTORY_CACHE_TTL_SECONDS）"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = HistoryCache(
+                max_users=int(get_setting("HISTORY_CACHE_MAX_USERS", DEFAULT_MAX_USERS)),
+                ttl_seconds=float(get_setting("HISTORY_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS)),
+            )
+        return _cache
@@ -0,0 +1,210 @@
+"""メディア処理（デコード・エンコード・音声抽出）用の共有プロセスプール
+
+フレーム抽出やJPEGエンコード、音声のデコードはCPUを多く使うため、
+Streamlitのスクリプトスレッドではなく、全セッションで共有するワーカープロセスで実行します。
+
+- 録画データはファイルパスで渡し、bytes をプロセス間で送りません
+- 大きな配列（デコードした音声など）は共有メモリで受け渡します（share_array / receive_array）
+- 同時に受け付けるタスク数に上限を設け、満杯の場合は空きが出るまで待機します（バックプレッシャー）
+- 待機中・実行中のタスク数を "media_queue_depth" ゲージとして記録します
+
+MEDIA_WORKERS=0 の場合（またはバッチ処理のワーカープロセス内など）は呼び出し元のスレッドで実行します。
+"""
+
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import multiprocessing.context
+import os
+import sys
+import threading
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, TypeVar
+
+from services.config import get_setting
+from services.metrics import get_registry
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 受け付けるタスク数の上限（ワーカー数に対する倍率）
+QUEUE_LIMIT_PER_WORKER = 2
+
+# 空きを待つ最大時間（秒）
+DEFAULT_QUEUE_TIMEOUT_SECONDS = 60.0
+
+
+class MediaWorkerBusy(RuntimeError):
+    """メディア処理の待ち行列が満杯のまま空かなかった場合の例外"""
+
+
+_pool_lock = threading.Lock()
+_pool: ProcessPoolExecutor | None = None
+_slots: threading.BoundedSemaphore | None = None
+_depth_lock = threading.Lock()
+_depth = 0
+_inline = False
+
+
+def _worker_count() -> int:
+    return int(get_setting("MEDIA_WORKERS", os.cpu_count() or 1))
+
+
+def set_inline(inline: bool = True):
+    """プロセスプールを使わず、呼び出し元のスレッドで実行する（ワーカープロセス内などで使用）"""
+    global _inline
+    _inline = inline
+
+
+_main_lock = threading.Lock()
+
+
+class _SpawnProcess(multiprocessing.context.SpawnProcess):
+    """
+    __main__ を再実行しない spawn のワーカープロセス
+
+    spawn は子プロセスで __main__ のファイルを再実行する。Streamlitはスクリプト
+    （frontdesign.py）を __main__ として実行するため、スクリプトのスレッドから
+    そのまま起動するとワーカー内でアプリが実行されて異常終了する。
+    ProcessPoolExecutor はタスクの投入時に必要に応じてワーカーを追加で起動するため、
+    起動のたびに、その間だけファイルを持たない __main__ に差し替える。
+    """
+
+    def start(self):
+        with _main_lock:
+            main_module = sys.modules["__main__"]
+            sys.modules["__main__"] = types.ModuleType("__main__")
+            try:
+                super().start()
+            finally:
+                sys.modules["__main__"] = main_module
+
+
+class _SpawnContext(multiprocessing.context.SpawnContext):
+    Process = _SpawnProcess
+
+
+def _get_pool() -> tuple[ProcessPoolExecutor, threading.BoundedSemaphore] | None:
+    """共有プロセスプールを取得（初回呼び出し時に作成、無効な場合はNone）"""
+    global _pool, _slots
+    if _inline:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            workers = _worker_count()
+            if workers <= 0:
+                return None
+            # Streamlitはスレッドを多用するため、fork ではなく spawn でワーカーを起動する
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=_SpawnContext())
+            limit = int(get_setting("MEDIA_QUEUE_LIMIT", workers * QUEUE_LIMIT_PER_WORKER))
+            _slots = threading.BoundedSemaphore(max(1, limit))
+            get_registry().set_gauge("media_workers", workers, "メディア処理のワーカープロセス数")
+        return _pool, _slots
+
+
+def _reset_pool():
+    """ワーカーが異常終了した場合にプールを作り直す"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def shutdown(wait: bool = True):
+    """
+    共有プロセスプールを終了（次の呼び出しで作り直す）
+
+    multiprocessing の子プロセスは、終了時にプールのワーカーの終了を待ってから
+    プールを閉じるため、そのままでは終了しない。子プロセスで使った場合は終了前に呼び出す。
+    """
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=wait, cancel_futures=True)
+
+
+def _update_depth(delta: int):
+    global _depth
+    with _depth_lock:
+        _depth += delta
+        depth = _depth
+    get_registry().set_gauge(
+        "media_queue_depth", depth, "メディア処理の待機中・実行中のタスク数"
+    )
+
+
+def run_media_task(func: Callable[..., T], *args, timeout: float | None = None) -> T:
+    """
+    メディア処理をワーカープロセスで実行して結果を返す
+
+    Args:
+        func: モジュールのトップレベルに定義された関数（ワーカーに渡せること）
+        *args: func の引数（録画データはファイルパスで渡す）
+        timeout: 待ち行列の空きを待つ最大時間（秒、Noneの場合は MEDIA_QUEUE_TIMEOUT_SECONDS）
+
+    Returns:
+        func の戻り値
+
+    Raises:
+        MediaWorkerBusy: timeout 以内に待ち行列が空かなかった場合
+    """
+    pool = _get_pool()
+    if pool is None:
+        return func(*args)
+    executor, slots = pool
+
+    if timeout is None:
+        timeout = float(get_setting("MEDIA_QUEUE_TIMEOUT_SECONDS", DEFAULT_QUEUE_TIMEOUT_SECONDS))
+
+    _update_depth(1)
+    try:
+        started = time.perf_counter()
+        if not slots.acquire(timeout=timeout):
+            raise MediaWorkerBusy("メディア処理の待ち行列が満杯です")
+        get_registry().observe("media_queue_wait", time.perf_counter() - started)
+        try:
+            return executor.submit(func, *args).result()
+        except BrokenProcessPool:
+            _reset_pool()
+            raise
+        finally:
+            slots.release()
+    finally:
+        _update_depth(-1)
+
+
+def share_array(array):
+    """
+    NumPy配列を共有メモリに書き込み、受け渡し用のハンドルを返す（ワーカー側で使用）
+
+    受け取った側で receive_array() を呼び出すと共有メモリは解放されます。
+    """
+    import numpy as np
+    from multiprocessing import shared_memory
+
+    shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    try:
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+        return {"name": shm.name, "shape": array.shape, "dtype": array.dtype.str}
+    finally:
+        shm.close()
+
+
+def receive_array(handle: dict):
+    """share_array() のハンドルから配列を取り出し、共有メモリを解放"""
+    import numpy as np
+    from multiprocessing import shared_memory
+
+    shm = shared_memory.SharedMemory(name=handle["name"])
+    try:
+        return np.ndarray(handle["shape"], dtype=handle["dtype"], buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
@@ -0,0 +1,234 @@
+"""処理ステージごとの計測（実行時間・送信バイト数・フレーム数・トークン数・キャッシュヒット）
+
+各サービスは track_stage() で処理を囲み、計測値を記録します。
+記録した値は Prometheus のテキスト形式で出力でき（export_prometheus）、
+METRICS_PORT を設定した場合は /metrics エンドポイントとして公開されます。
+"""
+
+import bisect
+import contextlib
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = "abc"
+
+# 実行時間ヒストグラムのバケット（秒）
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# ステージごとに保持する直近の実行時間の数（パーセンタイル計算用）
+RECENT_SAMPLES = 500
+
+COUNTER_FIELDS = (
+    "bytes_uploaded",
+    "frames_decoded",
+    "tokens_in",
+    "tokens_out",
+    "cache_hits",
+)
+
+
+class StageStats:
+    """1ステージ分の累積値"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.duration_sum = 0.0
+        self.bucket_counts = [0] * len(DURATION_BUCKETS)
+        self.counters = dict.fromkeys(COUNTER_FIELDS, 0)
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+
+class MetricsRegistry:
+    """プロセス内で共有する計測値の保存先（スレッドセーフ）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: dict[str, StageStats] = {}
+        self._gauges: dict[str, tuple[float, str]] = {}
+        self._events = deque(maxlen=100)
+
+    def observe(self, stage: str, seconds: float, error: bool = False, values: dict | None = None):
+        """ステージ1回分の計測値を記録"""
+        values = values or {}
+        with self._lock:
+            stats = self._stages.setdefault(stage, StageStats())
+            stats.count += 1
+            stats.errors += int(error)
+            stats.duration_sum += seconds
+            index = bisect.bisect_left(DURATION_BUCKETS, seconds)
+            if index < len(DURATION_BUCKETS):
+                stats.bucket_counts[index] += 1
+            stats.recent.append(seconds)
+            for field in COUNTER_FIELDS:
+                stats.counters[field] += int(values.get(field, 0) or 0)
+            self._events.append(
+                {
+                    "time": datetime.now().isoformat(timespec="seconds"),
+                    "stage": stage,
+                    "seconds": round(seconds, 3),
+                    "error": error,
+                    **{field: values[field] for field in COUNTER_FIELDS if values.get(field)},
+                }
+            )
+
+    def set_gauge(self, name: str, value: float, help_text: str = ""):
+        """現在値を表すメトリクス（キューの長さなど）を設定"""
+        with self._lock:
+            self._gauges[name] = (float(value), help_text)
+
+    def percentile(self, stage: str, q: float, min_samples: int = 1) -> float | None:
+        """直近の実行時間のパーセンタイル（秒）。記録が min_samples 件未満の場合は None"""
+        with self._lock:
+            stats = self._stages.get(stage)
+            samples = sorted(stats.recent) if stats else []
+        if not samples or len(samples) < min_samples:
+            return None
+        index = min(len(samples) - 1, int(round(q / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def summary(self) -> list[dict]:
+        """ステージごとの集計（診断パネル表示用）"""
+        with self._lock:
+            stages = {name: stats for name, stats in self._stages.items()}
+            rows = []
+            for name, stats in sorted(stages.items()):
+                samples = sorted(stats.recent)
+                rows.append(
+                    {
+                        "stage": name,
+                        "count": stats.count,
+                        "errors": stats.errors,
+                        "avg_seconds": round(stats.duration_sum / stats.count, 3),
+                        "p50_seconds": round(samples[len(samples) // 2], 3),
+                        "p95_seconds": round(samples[int(0.95 * (len(samples) - 1))], 3),
+                        **stats.counters,
+                    }
+                )
+        return rows
+
+    def recent_events(self, limit: int = 20) -> list[dict]:
+        """直近の計測イベント（新しい順）"""
+        with self._lock:
+            return list(self._events)[-limit:][::-1]
+
+    def export_prometheus(self) -> str:
+        """Prometheus テキスト形式で出力"""
+        p = METRIC_PREFIX
+        lines = [
+            f"# HELP {p}_stage_duration_seconds 処理ステージの実行時間",
+            f"# TYPE {p}_stage_duration_seconds histogram",
+        ]
+        with self._lock:
+            stages = sorted(self._stages.items())
+            for name, stats in stages:
+                cumulative = 0
+                for bound, count in zip(DURATION_BUCKETS, stats.bucket_counts):
+                    cumulative += count
+                    lines.append(
+                        f'{p}_stage_duration_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}'
+                    )
+                lines.append(f'{p}_stage_duration_seconds_bucket{{stage="{name}",le="+Inf"}} {stats.count}')
+                lines.append(f'{p}_stage_duration_seconds_sum{{stage="{name}"}} {stats.duration_sum}')
+                lines.append(f'{p}_stage_duration_seconds_count{{stage="{name}"}} {stats.count}')
+
+            lines.append(f"# TYPE {p}_stage_errors_total counter")
+            for name, stats in stages:
+                lines.append(f'{p}_stage_errors_total{{stage="{name}"}} {stats.errors}')
+            for field in COUNTER_FIELDS:
+                lines.append(f"# TYPE {p}_stage_{field}_total counter")
+                for name, stats in stages:
+                    lines.append(f'{p}_stage_{field}_total{{stage="{name}"}} {stats.counters[field]}')
+
+            for name, (value, help_text) in sorted(self._gauges.items()):
+                if help_text:
+                    lines.append(f"# HELP {p}_{name} {help_text}")
+                lines.append(f"# TYPE {p}_{name} gauge")
+                lines.append(f"{p}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+_registry = MetricsRegistry()
+
+
+def get_registry() -> MetricsRegistry:
+    """プロセス共通の計測値レジストリを取得"""
+    return _registry
+
+
+@contextlib.contextmanager
+def track_stage(stage: str):
+    """
+    処理ステージの実行時間と計測値を記録するコンテキストマネージャ
+
+    使用例:
+        with track_stage("transcribe_video") as m:
+            m["bytes_uploaded"] = len(video_data)
+            ...
+            if failed:
+                m["error"] = True
+
+    yieldされるdictに COUNTER_FIELDS のキーと "error" を設定できます。
+    例外が発生した場合はエラーとして記録し、例外はそのまま送出します。
+    """
+    values: dict = {}
+    started = time.perf_counter()
+    error = False
+    try:
+        yield values
+    except BaseException:
+        error = True
+        raise
+    finally:
+        error = error or bool(values.pop("error", False))
+        _registry.observe(stage, time.perf_counter() - started, error, values)
+
+
+def record_usage(values: dict, response):
+    """APIレスポンスの usage から入出力トークン数を計測値に加算"""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    values["tokens_in"] = values.get("tokens_in", 0) + (getattr(usage, "prompt_tokens", 0) or 0)
+    values["tokens_out"] = values.get("tokens_out", 0) + (getattr(usage, "completion_tokens", 0) or 0)
+
+
+def export_prometheus() -> str:
+    """プロセス共通レジストリの内容を Prometheus テキスト形式で出力"""
+    return _registry.export_prometheus()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = export_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # アクセスログは出力しない
+        pass
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer | None:
+    """/metrics エンドポイントをバックグラウンドスレッドで公開"""
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logger.warning(f"メトリクスサーバーを起動できませんでした（port={port}）: {e}")
+        return None
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    logger.info(f"メトリクスを http://{host}:{port}/metrics で公開しています")
+    return server
@@ -0,0 +1,418 @@
+"""セッション処理パイプライン - Streamlitに依存しない非同期エンドツーエンド処理
+
+録画データから「音声の前処理 → 文字起こし・表情認識 → AI応答生成 → 保存」までを
+awaitableなステージのDAGとして実行します。依存関係のないステージ
+（文字起こしと表情認識）は並行して実行されます。
+
+Streamlit（frontdesign.py）、CLI、テストから同じエンジンを利用できます。
+
+セッション全体の予算（PIPELINE_SLA_SECONDS）とステージごとの締め切りを持ち、
+締め切りを過ぎたステージは打ち切られます。表情認識は締め切りまでに分析できた
+フレームだけで集計し、間に合わなければ表情データなしで続行します。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import TYPE_CHECKING, Awaitable, Callable
+
+from services.ai_chat import generate_ai_response
+from services.config import get_setting
+from services.embeddings import find_similar_sessions, index_conversation, prepare_similar_sessions
+from services.face_analysis import analyze_face_emotion
+from services.rate_limiter import MIN_REQUEST_TIMEOUT_SECONDS, current_deadline, request_deadline
+from services.recording_store import media_size
+from services.storage import get_storage
+from services.transcription import prepare_transcription_audio, transcribe_video_with_segments
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+logger = logging.getLogger(__name__)
+
+StageFunc = Callable[[dict], Awaitable[object]]
+
+# セッション全体の予算（秒）の既定値
+DEFAULT_SLA_SECONDS = 90.0
+
+# ステージごとの締め切り（秒）の既定値（PIPELINE_<STAGE>_DEADLINE_SECONDS で上書き可能）
+DEFAULT_STAGE_DEADLINES = {
+    "audio": 10.0,
+    "transcription": 60.0,
+    "face_analysis": 30.0,
+    "ai_response": 30.0,
+}
+
+# 表情認識が部分的な結果を集計して返すために、ステージの締め切りより前に打ち切る余裕（秒）
+# 最後のフレームのリクエストは打ち切り時刻で終わるが、接続・送信・受信のタイムアウトは
+# 個別に適用されるため、最小のタイムアウト分と集計の時間を上乗せする
+FACE_ANALYSIS_GRACE_SECONDS = MIN_REQUEST_TIMEOUT_SECONDS + 1.0
+
+
+def get_sla_seconds() -> float:
+    """セッション全体の予算（PIPELINE_SLA_SECONDS）"""
+    return float(get_setting("PIPELINE_SLA_SECONDS", DEFAULT_SLA_SECONDS))
+
+
+def get_stage_deadline(name: str) -> float | None:
+    """ステージの締め切り（秒）。設定がないステージはNone"""
+    value = get_setting(
+        f"PIPELINE_{name.upper()}_DEADLINE_SECONDS", DEFAULT_STAGE_DEADLINES.get(name)
+    )
+    return float(value) if value is not None else None
+
+
+def stage_deadline() -> float | None:
+    """
+    実行中のステージの締め切り（time.monotonic() 基準）。締め切りがない場合はNone
+
+    ステージ内のAPI呼び出し（call_openai()）は、この締め切りでリクエストを打ち切り、
+    時間が残らない場合は再試行しません。
+    """
+    return current_deadline()
+
+
+class StageError(Exception):
+    """ステージが結果を返せなかった場合の例外（依存ステージはスキップされる）"""
+
+    def __init__(self, message: str, status: str = "error"):
+        """
+        Args:
+            message: ログに出力するメッセージ
+            status: ステージの状態（"error" 以外の理由で結果がない場合に指定）
+        """
+        super().__init__(message)
+        self.status = status
+
+
+class Stage:
+    """パイプラインの1ステージ"""
+
+    def __init__(
+        self,
+        name: str,
+        func: StageFunc,
+        depends_on: tuple[str, ...] = (),
+        deadline: float | None = None,
+        fallback: Callable[[], object] | None = None,
+        budgeted: bool = True,
+    ):
+        """
+        Args:
+            name: ステージ名（結果・計測値のキーになる）
+            func: 依存ステージの結果dictを受け取り、結果を返すコルーチン関数
+            depends_on: 先に完了している必要があるステージ名
+            deadline: 締め切り（ステージ開始からの秒数、Noneの場合はセッションの予算のみ）
+            fallback: 締め切りを過ぎた場合の結果を返す関数（Noneの場合は "timeout" になる）
+            budgeted: セッション全体の予算の対象とするか
+        """
+        self.name = name
+        self.func = func
+        self.depends_on = depends_on
+        self.deadline = deadline
+        self.fallback = fallback
+        self.budgeted = budgeted
+
+
+async def run_stages(stages: list[Stage], budget_seconds: float | None = None) -> dict:
+    """
+    ステージのDAGを実行
+
+    各ステージは依存ステージの完了を待ってから開始します。
+    依存ステージが失敗・スキップした場合、そのステージは "skipped" になります。
+
+    ステージは自身の締め切りとセッション全体の残り予算のうち早い方で打ち切られます。
+    打ち切られたステージは fallback があれば "degraded"（結果は fallback の戻り値）、
+    なければ "timeout" になります。"degraded" は依存ステージから見て完了扱いです。
+    StageError に status を指定した場合は、その状態（例: "no_speech"）になります。
+
+    Args:
+        stages: 実行するステージ（依存先が先に並んでいること）
+        budget_seconds: セッション全体の予算（秒、Noneの場合は無制限）
+
+    Returns:
+        {
+            "results": dict[str, object],  # ステージ名 → 結果
+            "statuses": dict[str, str],  # "completed" / "degraded" / "timeout" / "error" / "skipped" など
+            "timings": dict[str, float],  # ステージ名 → 実行時間（秒）
+        }
+    """
+    tasks: dict[str, asyncio.Task] = {}
+    results: dict[str, object] = {}
+    statuses: dict[str, str] = {}
+    timings: dict[str, float] = {}
+    session_deadline = time.monotonic() + budget_seconds if budget_seconds is not None else None
+
+    async def run(stage: Stage):
+        if stage.depends_on:
+            await asyncio.wait([tasks[name] for name in stage.depends_on])
+            if any(
+                statuses.get(name) not in ("completed", "degraded")
+                for name in stage.depends_on
+            ):
+                statuses[stage.name] = "skipped"
+                return
+
+        started = time.perf_counter()
+        deadline = session_deadline if stage.budgeted else None
+        if stage.deadline is not None:
+            stage_end = time.monotonic() + stage.deadline
+            deadline = stage_end if deadline is None else min(deadline, stage_end)
+        try:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            with request_deadline(deadline):
+                results[stage.name] = await asyncio.wait_for(stage.func(results), timeout)
+            statuses[stage.name] = "completed"
+        except asyncio.TimeoutError:
+            if stage.fallback is not None:
+                logger.warning(f"ステージ「{stage.name}」が締め切りを過ぎたため、部分的な結果で続行します")
+                results[stage.name] = stage.fallback()
+                statuses[stage.name] = "degraded"
+            else:
+                logger.warning(f"ステージ「{stage.name}」が締め切りを過ぎました")
+                statuses[stage.name] = "timeout"
+        except Exception as e:
+            status = e.status if isinstance(e, StageError) else "error"
+            if status == "error":
+                logger.warning(f"ステージ「{stage.name}」でエラーが発生しました: {e}")
+            else:
+                logger.info(f"ステージ「{stage.name}」は結果を返しませんでした（{status}）: {e}")
+            statuses[stage.name] = status
+        finally:
+            timings[stage.name] = time.perf_counter() - started
+
+    for stage in stages:
+        missing = [name for name in stage.depends_on if name not in tasks]
+        if missing:
+            raise ValueError(
+                f"ステージ「{stage.name}」の依存先が未定義です: {', '.join(missing)}"
+            )
+        tasks[stage.name] = asyncio.create_task(run(stage))
+
+    await asyncio.gather(*tasks.values())
+    return {"results": results, "statuses": statuses, "timings": timings}
+
+
+def _analysis_stages(
+    video: bytes | str | os.PathLike, client: OpenAI
+) -> list[Stage]:
+    """録画データの読み込み・音声の前処理・文字起こし・表情認識ステージを構築"""
+
+    async def load(_results: dict) -> bytes | str | os.PathLike:
+        # ファイルパスはメモリに読み込まず、そのまま各サービスに渡す
+        if media_size(video) < 100:
+            raise StageError("録画データが空、または見つかりません")
+        return video
+
+    async def audio(results: dict) -> dict | None:
+        # 無音除去と音声の特徴量の計算を1回のデコードで行う（失敗した場合はNone）
+        return await asyncio.to_thread(prepare_transcription_audio, results["load"])
+
+    async def transcription(results: dict) -> dict:
+        # {"text": str, "segments": 発話の区間（列ごとの配列）}
+        # 音声の前処理が失敗・打ち切りになった場合（None）は、デコードをやり直さず録画ファイルをそのまま送る
+        transcript, status = await asyncio.to_thread(
+            transcribe_video_with_segments,
+            results["load"],
+            client,
+            speech=results["audio"],
+            skip_vad=True,
+        )
+        if status == "no_speech":
+            # 発話がない録画ではAI応答の生成・保存を行わない
+            raise StageError("発話が検出されませんでした", status="no_speech")
+        if status != "completed":
+            raise StageError("文字起こしに失敗しました")
+        return transcript
+
+    async def face_analysis(results: dict) -> dict | None:
+        # 表情認識は任意：失敗してもNoneで続行する。締め切りの少し前に
+        # 新しいフレームの分析を打ち切り、分析済みのフレームだけで集計する
+        deadline = stage_deadline()
+        if deadline is not None:
+            deadline -= FACE_ANALYSIS_GRACE_SECONDS
+        face_emotion, status = await asyncio.to_thread(
+            analyze_face_emotion, results["load"], client, deadline=deadline
+        )
+        return face_emotion if status == "completed" else None
+
+    return [
+        Stage("load", load),
+        Stage(
+            "audio",
+            audio,
+            ("load",),
+            deadline=get_stage_deadline("audio"),
+            # 間に合わない場合は前処理なしで文字起こしする（音声の特徴量もなし）
+            fallback=lambda: None,
+        ),
+        Stage(
+            "transcription",
+            transcription,
+            ("load", "audio"),
+            deadline=get_stage_deadline("transcription"),
+        ),
+        Stage(
+            "face_analysis",
+            face_analysis,
+            ("load",),
+            deadline=get_stage_deadline("face_analysis"),
+            # 集計も間に合わなかった場合は表情データなしで続行する
+            fallback=lambda: None,
+        ),
+    ]
+
+
+def _acoustic_features(results: dict) -> dict | None:
+    """音声の前処理ステージの結果から特徴量を取り出す"""
+    audio = results.get("audio")
+    return audio.get("features") if audio else None
+
+
+async def analyze_recording(
+    video: bytes | str | os.PathLike,
+    client: OpenAI,
+    budget_seconds: float | None = None,
+) -> dict:
+    """
+    録画データの文字起こしと表情認識を並行実行
+
+    結果の "transcription" は {"text": str, "segments": dict}（発話の区間の時刻付き）、
+    "audio" には音声の特徴量（"features"）が含まれます。
+
+    Args:
+        video: WebM形式の動画データ（bytes）またはファイルパス
+        client: OpenAIクライアント
+        budget_seconds: 全体の予算（秒、Noneの場合は PIPELINE_SLA_SECONDS）
+
+    Returns:
+        run_stages() と同じ形式のdict
+    """
+    if budget_seconds is None:
+        budget_seconds = get_sla_seconds()
+    return await run_stages(_analysis_stages(video, client), budget_seconds)
+
+
+async def process_session(
+    video: bytes | str | os.PathLike,
+    emotion_coords: tuple[float, float],
+    username: str | None = None,
+    client: OpenAI | None = None,
+    budget_seconds: float | None = None,
+) -> tuple[dict, str]:
+    """
+    1セッション分の処理（文字起こし・表情認識 → AI応答生成 → 保存）を実行
+
+    Args:
+        video: WebM形式の動画データ（bytes）またはファイルパス
+        emotion_coords: 感情座標タプル (x, y)。x, y は -1.0 ～ 1.0
+        username: 保存先のユーザー名（Noneの場合はデータベースに保存しない）
+        client: OpenAIクライアント（Noneの場合は環境変数から作成を試みる）
+        budget_seconds: セッション全体の予算（秒、Noneの場合は PIPELINE_SLA_SECONDS）。
+            保存ステージは予算の対象外
+
+    Returns:
+        (session, status) のタプル
+        - session: {
+            "transcription": str,
+            "transcript_segments": dict | None,  # 発話の区間 {"start": [...], "end": [...], "text": [...]}
+            "emotion": tuple[float, float],
+            "face_emotion": dict | None,
+            "acoustic_features": dict | None,  # 音声の特徴量（services/audio_features.py）
+            "ai_response": str,
+            "timestamp": str,
+            "saved": bool,
+            "stage_status": dict[str, str],
+            "timings": dict[str, float],  # ステージごとの実行時間（秒）
+          }
+        - status: "completed"、"no_speech"（発話がないためAI応答・保存なし）または "error"
+    """
+    if client is None:
+        try:
+            from openai import OpenAI
+
+            client = OpenAI(max_retries=0)
+        except Exception as e:
+            logger.warning(f"OpenAIクライアントを作成できませんでした: {e}")
+            return {}, "error"
+
+    timestamp = datetime.now().isoformat()
+    # 文字起こし・表情認識の間に、AI応答で使う似ている過去の対話の検索インデックスを準備する
+    prepare_similar_sessions(username, client)
+
+    async def ai_response(results: dict) -> str:
+        similar = await asyncio.to_thread(
+            find_similar_sessions, username, results["transcription"]["text"], emotion_coords, client=client
+        )
+        response, status = await asyncio.to_thread(
+            generate_ai_response,
+            results["transcription"]["text"],
+            emotion_coords,
+            face_emotion=results["face_analysis"],
+            client=client,
+            similar_sessions=similar,
+            acoustic_features=_acoustic_features(results),
+        )
+        if status != "completed":
+            raise StageError("AI応答生成に失敗しました")
+        return response
+
+    async def save(results: dict) -> bool:
+        if username is None:
+            return False
+        conversation_data = {
+            "transcription": results["transcription"]["text"],
+            "transcript_segments": results["transcription"]["segments"],
+            "emotion": emotion_coords,
+            "face_emotion": results["face_analysis"],
+            "ai_response": results["ai_response"],
+            "timestamp": timestamp,
+            "client_id": uuid.uuid4().hex,
+            "acoustic_features": _acoustic_features(results),
+        }
+        saved = await asyncio.to_thread(
+            get_storage().save_conversation, conversation_data, username
+        )
+        if saved:
+            await asyncio.to_thread(index_conversation, username, conversation_data, client)
+        return saved
+
+    if budget_seconds is None:
+        budget_seconds = get_sla_seconds()
+
+    stages = _analysis_stages(video, client) + [
+        Stage(
+            "ai_response",
+            ai_response,
+            ("transcription", "face_analysis"),
+            deadline=get_stage_deadline("ai_response"),
+        ),
+        # 生成済みの応答を破棄しないよう、保存は予算の対象外にする
+        Stage("save", save, ("ai_response",), budgeted=False),
+    ]
+    run = await run_stages(stages, budget_seconds)
+    results = run["results"]
+
+    transcript = results.get("transcription") or {}
+    session = {
+        "transcription": transcript.get("text", ""),
+        "transcript_segments": transcript.get("segments"),
+        "emotion": emotion_coords,
+        "face_emotion": results.get("face_analysis"),
+        "acoustic_features": _acoustic_features(results),
+        "ai_response": results.get("ai_response", ""),
+        "timestamp": timestamp,
+        "saved": bool(results.get("save", False)),
+        "stage_status": run["statuses"],
+        "timings": run["timings"],
+    }
+    if run["statuses"].get("transcription") == "no_speech":
+        status = "no_speech"
+    else:
+        status = "completed" if run["statuses"].get("ai_response") == "completed" else "error"
+    return session, status
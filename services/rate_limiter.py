@@ -0,0 +1,373 @@
+"""OpenAI APIのレート制限・同時実行制御
+
+モデルごとに「1分あたりのリクエスト数（RPM）」と「1分あたりのトークン数（TPM）」の
+トークンバケットを持ち、プロセス内の全セッションで共有します。
+
+- 待機中のリクエストは優先度順（対話セッション > バッチ処理）に許可されます
+- 429（Rate limit）を受けた場合は Retry-After に従ってモデル全体を一時停止し、再試行します
+- タイムアウト・接続エラー・5xx の再試行とヘッジ（重複リクエスト）は
+  モデルごとのポリシー（services/retry_policy.py）に従います
+- 締め切り（パイプラインのステージの締め切りなど）までに時間が残らない場合は、
+  待ち行列での待機・リクエスト・再試行・ヘッジを行わず RequestDeadlineExceeded を送出します
+
+各サービスは OpenAI API を直接呼ばず、call_openai() を経由して呼び出してください。
+"""
+
+import contextlib
+import contextvars
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from typing import Callable, TypeVar
+
+from services.config import get_setting
+from services.metrics import get_registry
+from services.retry_policy import (
+    backoff_delay,
+    classify_error,
+    get_retry_policy,
+    hedge_delay,
+    latency_stage,
+    run_hedged,
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 優先度（値が小さいほど優先）
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+# モデルごとのデフォルト上限（RATE_LIMIT_<MODEL>_RPM / _TPM で上書き可能）
+DEFAULT_LIMITS = {
+    "whisper-1": {"rpm": 50, "tpm": None},
+    "gpt-4o": {"rpm": 500, "tpm": 30000},
+    "gpt-4o-mini": {"rpm": 500, "tpm": 200000},
+}
+FALLBACK_LIMITS = {"rpm": 60, "tpm": None}
+
+MAX_RATE_LIMIT_RETRIES = 5
+
+# 締め切り直前でもリクエストに与える最小のタイムアウト（秒）
+MIN_REQUEST_TIMEOUT_SECONDS = 1.0
+
+class RequestDeadlineExceeded(TimeoutError):
+    """締め切りまでにリクエストを送る時間が残らなかった場合の例外（リクエストは送られていない）"""
+
+
+_priority: contextvars.ContextVar[int | None] = contextvars.ContextVar(
+    "openai_priority", default=None
+)
+_default_priority = PRIORITY_INTERACTIVE
+
+_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar(
+    "openai_deadline", default=None
+)
+
+
+def set_default_priority(priority: int):
+    """プロセス全体のデフォルト優先度を設定（バッチ処理のワーカーなどで使用）"""
+    global _default_priority
+    _default_priority = priority
+
+
+@contextlib.contextmanager
+def request_priority(priority: int):
+    """このコンテキスト内のAPI呼び出しの優先度を設定"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    """現在のコンテキストの優先度"""
+    priority = _priority.get()
+    return _default_priority if priority is None else priority
+
+
+@contextlib.contextmanager
+def request_deadline(deadline: float | None):
+    """このコンテキスト内のAPI呼び出しの締め切り（time.monotonic() 基準、Noneの場合はなし）を設定"""
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def current_deadline() -> float | None:
+    """現在のコンテキストの締め切り（time.monotonic() 基準）。締め切りがない場合はNone"""
+    return _deadline.get()
+
+
+def with_deadline(client):
+    """
+    現在のコンテキストの締め切りでリクエストが打ち切られるクライアント
+
+    call_openai() に渡す request の中で呼び出すと、再試行・ヘッジのたびに
+    その時点の残り時間がタイムアウトになります。締め切りがない場合は client をそのまま返します。
+    """
+    deadline = current_deadline()
+    if deadline is None:
+        return client
+    return client.with_options(
+        timeout=max(MIN_REQUEST_TIMEOUT_SECONDS, deadline - time.monotonic())
+    )
+
+
+def _has_time_for(deadline: float | None, wait: float) -> bool:
+    """wait 秒待った後に、最小限のタイムアウトでリクエストを送る時間が残っているか"""
+    return deadline is None or deadline - time.monotonic() >= wait + MIN_REQUEST_TIMEOUT_SECONDS
+
+
+class TokenBucket:
+    """一定速度で補充されるトークンバケット（スレッドセーフではない）"""
+
+    def __init__(self, capacity: float, per_seconds: float = 60.0):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / per_seconds
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """amount 分のトークンが使えるまでの待ち時間（秒）"""
+        self._refill(now)
+        # 1回のリクエストが容量を超える場合は満杯になれば許可する
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float, now: float):
+        self._refill(now)
+        self.tokens -= amount
+
+
+class ModelLimiter:
+    """1モデル分のRPM/TPMバケットと優先度付き待ち行列"""
+
+    def __init__(self, rpm: float, tpm: float | None):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.paused_until = 0.0
+        self._cond = threading.Condition()
+        self._waiters: list[tuple[int, int]] = []
+        self._seq = itertools.count()
+
+    def _wait_time(self, tokens: float, now: float) -> float:
+        wait = max(self.paused_until - now, self.requests.wait_time(1, now))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens, now))
+        return wait
+
+    def acquire(self, tokens: float, priority: int, deadline: float | None = None):
+        """
+        リクエスト1回分の枠を確保（確保できるまでブロック）
+
+        Args:
+            deadline: 締め切り（time.monotonic() 基準）。確保後に最小限のタイムアウトで
+                リクエストを送る時間が残らなくなった場合は、枠を確保せずに待ち行列から外れる
+
+        Raises:
+            RequestDeadlineExceeded: 締め切りまでに枠を確保できなかった場合
+        """
+        ticket = (priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - MIN_REQUEST_TIMEOUT_SECONDS - now
+                        if remaining <= 0:
+                            raise RequestDeadlineExceeded("締め切りまでにレート制限の枠を確保できませんでした")
+                    if self._waiters[0] == ticket:
+                        wait = self._wait_time(tokens, now)
+                        if wait <= 0:
+                            self.requests.consume(1, now)
+                            if self.tokens is not None:
+                                self.tokens.consume(tokens, now)
+                            return
+                        self._cond.wait(timeout=wait if remaining is None else min(wait, remaining))
+                    else:
+                        # 優先度の高いリクエストが先に許可されるまで待つ
+                        self._cond.wait(timeout=remaining)
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+    def try_acquire(self, tokens: float) -> bool:
+        """待たずに確保できる場合のみ枠を確保（待機中のリクエストがある場合は確保しない）"""
+        with self._cond:
+            now = time.monotonic()
+            if self._waiters or self._wait_time(tokens, now) > 0:
+                return False
+            self.requests.consume(1, now)
+            if self.tokens is not None:
+                self.tokens.consume(tokens, now)
+            return True
+
+    def settle(self, estimated_tokens: float, actual_tokens: float):
+        """実際の使用トークン数で見積もりとの差分を精算"""
+        if self.tokens is None:
+            return
+        with self._cond:
+            self.tokens.consume(actual_tokens - estimated_tokens, time.monotonic())
+
+    def pause(self, seconds: float):
+        """429受信時にモデル全体のリクエストを一時停止"""
+        with self._cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self._cond.notify_all()
+
+
+class RateLimiter:
+    """モデル名ごとの ModelLimiter を管理"""
+
+    def __init__(self, limits: dict | None = None):
+        self._limits = limits if limits is not None else _configured_limits()
+        self._models: dict[str, ModelLimiter] = {}
+        self._lock = threading.Lock()
+
+    def for_model(self, model: str) -> ModelLimiter:
+        with self._lock:
+            limiter = self._models.get(model)
+            if limiter is None:
+                limit = self._limits.get(model, FALLBACK_LIMITS)
+                limiter = ModelLimiter(limit["rpm"], limit.get("tpm"))
+                self._models[model] = limiter
+            return limiter
+
+
+def _configured_limits() -> dict:
+    """デフォルト上限に設定値（RATE_LIMIT_GPT_4O_RPM など）を反映"""
+    limits = {}
+    for model, default in DEFAULT_LIMITS.items():
+        key = model.upper().replace("-", "_").replace(".", "_")
+        rpm = get_setting(f"RATE_LIMIT_{key}_RPM")
+        tpm = get_setting(f"RATE_LIMIT_{key}_TPM")
+        limits[model] = {
+            "rpm": float(rpm) if rpm else default["rpm"],
+            "tpm": float(tpm) if tpm else default["tpm"],
+        }
+    return limits
+
+
+_rate_limiter: RateLimiter | None = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """プロセス共通のレートリミッターを取得"""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter()
+        return _rate_limiter
+
+
+def _retry_after_seconds(error: Exception, attempt: int) -> float:
+    """429レスポンスの Retry-After、なければ指数バックオフ（ジッター付き）"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return min(60.0, 2.0**attempt) * (0.5 + random.random() / 2)
+
+
+def call_openai(
+    model: str,
+    request: Callable[[], T],
+    estimated_tokens: int = 0,
+    priority: int | None = None,
+    deadline: float | None = None,
+) -> T:
+    """
+    レート制限・再試行ポリシーを適用してOpenAI APIを呼び出す
+
+    Args:
+        model: モデル名（"whisper-1", "gpt-4o", "gpt-4o-mini" など）
+        request: API呼び出しを行う関数（再試行・ヘッジ時に再度呼ばれるため、
+            複数回・複数スレッドから呼ばれても安全であること）。
+            クライアントは with_deadline(client) で取得すると締め切りでリクエストが打ち切られる
+        estimated_tokens: 見積もりトークン数（入力 + 出力）
+        priority: 優先度（Noneの場合は現在のコンテキストの優先度）
+        deadline: 締め切り（time.monotonic() 基準、Noneの場合は現在のコンテキストの締め切り）。
+            待ち行列での待機も締め切りまでで、最小限のタイムアウトも残らない場合は
+            リクエスト・再試行・ヘッジを行わない
+
+    Returns:
+        request() の戻り値
+
+    Raises:
+        RequestDeadlineExceeded: リクエストを送る前に締め切りまでの時間が残らなくなった場合
+        Exception: request() が送出した例外（再試行しないエラー、再試行上限超過、または締め切り）
+    """
+    limiter = get_rate_limiter().for_model(model)
+    policy = get_retry_policy(model)
+    if priority is None:
+        priority = current_priority()
+    if deadline is None:
+        deadline = current_deadline()
+
+    retries = dict.fromkeys(("rate_limit", "other"), 0)
+    with request_deadline(deadline):
+        while True:
+            if not _has_time_for(deadline, 0):
+                raise RequestDeadlineExceeded("締め切りまでにリクエストを送る時間が残っていません")
+            limiter.acquire(estimated_tokens, priority, deadline)
+            delay = hedge_delay(model, policy)
+            if delay is not None and not _has_time_for(deadline, delay):
+                delay = None
+            started = time.monotonic()
+            try:
+                if delay is None:
+                    response = request()
+                else:
+                    response = run_hedged(
+                        request, delay, lambda: limiter.try_acquire(estimated_tokens)
+                    )
+            except Exception as e:
+                kind = classify_error(e)
+                if kind == "rate_limit":
+                    wait = _retry_after_seconds(e, retries["rate_limit"])
+                    if retries["rate_limit"] >= MAX_RATE_LIMIT_RETRIES or not _has_time_for(deadline, wait):
+                        raise
+                    retries["rate_limit"] += 1
+                    logger.warning(f"{model}: レート制限（429）のため {wait:.1f}秒 待機して再試行します")
+                    limiter.pause(wait)
+                    continue
+                if kind is None or retries["other"] >= policy.max_retries:
+                    raise
+                wait = backoff_delay(policy, retries["other"])
+                # 締め切りで打ち切られたタイムアウトや、待機後に時間が残らない場合は再試行しない
+                if not _has_time_for(deadline, wait):
+                    raise
+                retries["other"] += 1
+                logger.warning(f"{model}: {kind} エラーのため {wait:.1f}秒 待機して再試行します: {e}")
+                time.sleep(wait)
+                continue
+
+            # ヘッジの待ち時間の基準にするため、成功したリクエストのレイテンシを記録する
+            get_registry().observe(latency_stage(model), time.monotonic() - started)
+            usage = getattr(response, "usage", None)
+            total_tokens = getattr(usage, "total_tokens", None)
+            if isinstance(total_tokens, int):
+                limiter.settle(estimated_tokens, total_tokens)
+            return response
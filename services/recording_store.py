@@ -0,0 +1,196 @@
+"""録画ファイルの保存先管理
+
+録画データ（WebM）を st.session_state に bytes で保持せず、セッションごとの
+ディレクトリにファイルとして保存します。セッション側はファイルパスのみを保持し、
+各サービスはパスを直接読み込みます。
+
+放置されたファイル（ブラウザを閉じたセッションなど）は cleanup_recordings() で
+経過時間と合計サイズに基づいて削除されます。
+"""
+
+import contextlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from services.config import get_setting
+
+logger = logging.getLogger(__name__)
+
+# 放置された録画ファイルの保持期間（秒）と保存先全体の上限サイズ（バイト）
+DEFAULT_MAX_AGE_SECONDS = 60 * 60
+DEFAULT_MAX_TOTAL_BYTES = 2 * 1024**3
+
+# 合計サイズの上限を超えた場合でも削除しない、最近更新されたファイルの経過時間（秒）
+# （録画中・分析待ちのファイルを他のセッションの掃除で消さないため）
+DEFAULT_MIN_AGE_SECONDS = 10 * 60
+
+# cleanup_recordings() を実際に実行する最小間隔（秒）
+CLEANUP_INTERVAL_SECONDS = 5 * 60
+
+_cleanup_lock = threading.Lock()
+_last_cleanup_at = 0.0
+
+
+def get_recording_root() -> str:
+    """録画ファイルの保存先ディレクトリ（RECORDING_DIR、未設定時は一時ディレクトリ）"""
+    root = get_setting("RECORDING_DIR") or os.path.join(tempfile.gettempdir(), "abc_recordings")
+    os.makedirs(root, exist_ok=True)
+    return root
+
+
+def new_session_id() -> str:
+    """録画ファイルをまとめるセッションIDを発行"""
+    return uuid.uuid4().hex
+
+
+def _session_dir(session_id: str) -> str:
+    # パス区切りなどを含むIDでディレクトリ外に書き込まないようにする
+    safe_id = re.sub(r"[^0-9A-Za-z_-]", "_", session_id)
+    path = os.path.join(get_recording_root(), safe_id)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def new_recording_path(session_id: str) -> str:
+    """セッション用の新しい録画ファイルパスを発行（ファイルはまだ作成しない）"""
+    filename = f"{datetime.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:8]}.webm"
+    return os.path.join(_session_dir(session_id), filename)
+
+
+def discard_recording(path: str | None):
+    """録画ファイルを削除（存在しない場合は何もしない）"""
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"録画ファイルを削除できませんでした: {path}: {e}")
+
+
+def media_size(video: bytes | str | os.PathLike | None) -> int:
+    """録画データ（bytes またはファイルパス）のサイズ。存在しない場合は0"""
+    if video is None:
+        return 0
+    if isinstance(video, (bytes, bytearray)):
+        return len(video)
+    try:
+        return os.path.getsize(video)
+    except OSError:
+        return 0
+
+
+@contextlib.contextmanager
+def media_path(video: bytes | str | os.PathLike, suffix: str = ".webm"):
+    """
+    録画データをファイルパスとして扱うコンテキストマネージャ
+
+    ファイルパスが渡された場合はそのまま返し、bytes の場合のみ一時ファイルに書き出して
+    終了時に削除します。
+    """
+    if not isinstance(video, (bytes, bytearray)):
+        yield os.fspath(video)
+        return
+
+    temp_path = None
+    try:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as f:
+            f.write(video)
+            temp_path = f.name
+        yield temp_path
+    finally:
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def cleanup_recordings(
+    max_age_seconds: float | None = None,
+    max_total_bytes: int | None = None,
+    force: bool = False,
+) -> int:
+    """
+    放置された録画ファイルを削除
+
+    1. 最終更新から max_age_seconds 以上経過したファイルを削除
+    2. 残りの合計が max_total_bytes を超える場合、古いファイルから削除
+       （最終更新から RECORDING_MIN_AGE_SECONDS 未満のファイルは使用中の可能性があるため残す）
+    3. 空のまま max_age_seconds 以上経過したセッションディレクトリを削除
+       （録画ファイルのパスを発行した直後の、録画開始前のディレクトリは残す）
+
+    CLEANUP_INTERVAL_SECONDS 以内の再実行は（force=True でない限り）スキップします。
+
+    Returns:
+        削除したファイル数
+    """
+    global _last_cleanup_at
+    with _cleanup_lock:
+        now = time.time()
+        if not force and now - _last_cleanup_at < CLEANUP_INTERVAL_SECONDS:
+            return 0
+        _last_cleanup_at = now
+
+    if max_age_seconds is None:
+        max_age_seconds = float(get_setting("RECORDING_MAX_AGE_SECONDS", DEFAULT_MAX_AGE_SECONDS))
+    if max_total_bytes is None:
+        max_total_bytes = int(get_setting("RECORDING_MAX_TOTAL_BYTES", DEFAULT_MAX_TOTAL_BYTES))
+    min_age_seconds = min(
+        max_age_seconds, float(get_setting("RECORDING_MIN_AGE_SECONDS", DEFAULT_MIN_AGE_SECONDS))
+    )
+
+    root = get_recording_root()
+    files = []
+    for dirpath, _dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+    removed = 0
+    remaining = []
+    # 古いファイルを削除したディレクトリ（削除でディレクトリの更新時刻が新しくなるため記録する）
+    stale_dirs = set()
+    for mtime, size, path in files:
+        if now - mtime > max_age_seconds:
+            discard_recording(path)
+            stale_dirs.add(os.path.dirname(path))
+            removed += 1
+        else:
+            remaining.append((mtime, size, path))
+
+    total = sum(size for _, size, _ in remaining)
+    for mtime, size, path in sorted(remaining):
+        if total <= max_total_bytes:
+            break
+        if now - mtime < min_age_seconds:
+            logger.warning(
+                "録画ファイルの合計サイズが上限を超えていますが、使用中の可能性がある新しいファイルは削除しません"
+            )
+            break
+        discard_recording(path)
+        total -= size
+        removed += 1
+
+    for entry in os.scandir(root):
+        try:
+            if not entry.is_dir() or os.listdir(entry.path):
+                continue
+            if entry.path in stale_dirs or now - entry.stat().st_mtime > max_age_seconds:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        except OSError:
+            # 他のセッションが同時に削除・作成した場合
+            continue
+
+    if removed:
+        logger.info(f"放置された録画ファイルを{removed}件削除しました")
+    return removed
@@ -0,0 +1,190 @@
+"""OpenAI API呼び出しの再試行・ヘッジ（重複リクエスト）ポリシー
+
+call_openai()（services/rate_limiter.py）が使用します。
+
+- 再試行: エラーを分類し（タイムアウト・接続エラー・429・5xx）、再試行可能なものだけを
+  ジッター付き指数バックオフで再試行します。それ以外（400番台など）は即座に送出します
+- ヘッジ: 応答が直近のp95レイテンシを超えても返らない場合、同じリクエストをもう1件送信し、
+  先に成功した方の結果を使います（遅い方の結果は破棄されます）
+
+ポリシーはモデルごとに設定できます（RETRY_<MODEL>_MAX_RETRIES / RETRY_<MODEL>_HEDGE）。
+OpenAIクライアント側の自動再試行は二重にならないよう max_retries=0 で作成してください。
+"""
+
+from __future__ import annotations
+
+import contextvars
+import logging
+import random
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, TypeVar
+
+from services.config import get_setting
+from services.metrics import get_registry
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# ヘッジを判断するために必要な直近のレイテンシの記録数
+HEDGE_MIN_SAMPLES = 20
+
+# ヘッジ用のスレッド数（プロセス全体）
+HEDGE_THREADS = 16
+
+RETRYABLE_ERRORS = ("timeout", "connection", "rate_limit", "server")
+
+
+class RetryPolicy:
+    """1モデル分の再試行・ヘッジの設定"""
+
+    def __init__(
+        self,
+        max_retries: int = 2,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+        hedge: bool = False,
+        hedge_percentile: float = 95.0,
+        min_hedge_delay: float = 1.0,
+    ):
+        """
+        Args:
+            max_retries: タイムアウト・接続エラー・5xx の再試行回数（429は MAX_RATE_LIMIT_RETRIES）
+            base_delay: バックオフの初期値（秒）
+            max_delay: バックオフの上限（秒）
+            hedge: ヘッジ（重複リクエスト）を送るか
+            hedge_percentile: ヘッジを送るまでの待ち時間とするレイテンシのパーセンタイル
+            min_hedge_delay: ヘッジを送るまでの最小の待ち時間（秒）
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_delay = min_hedge_delay
+
+
+# モデルごとの既定ポリシー。音声ファイルのアップロードと画像分析は重複させると
+# 料金・帯域の負担が大きいため、既定ではテキスト応答のみヘッジする
+DEFAULT_POLICIES = {
+    "whisper-1": RetryPolicy(max_retries=2, base_delay=1.0, hedge=False),
+    "gpt-4o": RetryPolicy(max_retries=2, hedge=False),
+    "gpt-4o-mini": RetryPolicy(max_retries=2, hedge=True),
+}
+
+
+def get_retry_policy(model: str) -> RetryPolicy:
+    """モデルのポリシー（既定値に RETRY_<MODEL>_MAX_RETRIES / _HEDGE の設定を反映）"""
+    default = DEFAULT_POLICIES.get(model, RetryPolicy())
+    key = model.upper().replace("-", "_").replace(".", "_")
+    max_retries = get_setting(f"RETRY_{key}_MAX_RETRIES")
+    hedge = get_setting(f"RETRY_{key}_HEDGE")
+    return RetryPolicy(
+        max_retries=int(max_retries) if max_retries is not None else default.max_retries,
+        base_delay=default.base_delay,
+        max_delay=default.max_delay,
+        hedge=str(hedge).lower() in ("1", "true", "yes") if hedge is not None else default.hedge,
+        hedge_percentile=default.hedge_percentile,
+        min_hedge_delay=default.min_hedge_delay,
+    )
+
+
+def classify_error(error: Exception) -> str | None:
+    """
+    エラーの種類を分類
+
+    Returns:
+        "timeout" / "connection" / "rate_limit" / "server"（再試行可能）、
+        再試行しないエラーの場合はNone
+    """
+    status_code = getattr(error, "status_code", None)
+    if status_code == 429:
+        return "rate_limit"
+    if isinstance(status_code, int) and status_code >= 500:
+        return "server"
+    if isinstance(error, TimeoutError):
+        return "timeout"
+    try:
+        import openai
+    except ImportError:
+        return None
+    # APITimeoutError は APIConnectionError のサブクラスのため先に判定する
+    if isinstance(error, openai.APITimeoutError):
+        return "timeout"
+    if isinstance(error, openai.APIConnectionError):
+        return "connection"
+    return None
+
+
+def backoff_delay(policy: RetryPolicy, attempt: int) -> float:
+    """attempt 回目の再試行までの待ち時間（フルジッター付き指数バックオフ）"""
+    return random.uniform(0, min(policy.max_delay, policy.base_delay * 2**attempt))
+
+
+def latency_stage(model: str) -> str:
+    """モデルごとのAPIレイテンシを記録するステージ名"""
+    return f"openai_request:{model}"
+
+
+def hedge_delay(model: str, policy: RetryPolicy) -> float | None:
+    """ヘッジを送るまでの待ち時間（秒）。ヘッジしない場合・記録が足りない場合はNone"""
+    if not policy.hedge:
+        return None
+    latency = get_registry().percentile(
+        latency_stage(model), policy.hedge_percentile, min_samples=HEDGE_MIN_SAMPLES
+    )
+    if latency is None:
+        return None
+    return max(policy.min_hedge_delay, latency)
+
+
+_executor_lock = threading.Lock()
+_executor: ThreadPoolExecutor | None = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=HEDGE_THREADS, thread_name_prefix="hedge")
+        return _executor
+
+
+def run_hedged(
+    request: Callable[[], T],
+    delay: float,
+    allow_hedge: Callable[[], bool],
+) -> T:
+    """
+    request() を実行し、delay 秒以内に返らなければ同じリクエストをもう1件送信
+
+    先に成功した方の結果を返します。両方失敗した場合は最初に失敗した方の例外を送出します。
+    実行中のHTTPリクエストは中断できないため、遅い方は完了後に結果が破棄されます。
+
+    Args:
+        request: API呼び出しを行う関数（複数のスレッドから同時に呼ばれても安全であること）
+        delay: ヘッジを送るまでの待ち時間（秒）
+        allow_hedge: ヘッジを送ってよいか（レート制限の枠を確保できた場合にTrue）
+    """
+    executor = _get_executor()
+    # 締め切りなどのコンテキスト変数を引き継ぐため、呼び出し元のコンテキストで実行する
+    futures: list[Future] = [executor.submit(contextvars.copy_context().run, request)]
+    done, _ = wait(futures, timeout=delay)
+    if not done and allow_hedge():
+        get_registry().observe("openai_hedge", 0.0)
+        futures.append(executor.submit(contextvars.copy_context().run, request))
+
+    first_error = None
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            error = future.exception()
+            if error is None:
+                for other in pending:
+                    other.cancel()
+                return future.result()
+            if first_error is None:
+                first_error = error
+    raise first_error
@@ -0,0 +1,644 @@
+"""対話履歴の保存先（ストレージバックエンド）
+
+STORAGE_BACKEND で保存先を選択します。
+- "postgres": Supabase (PostgreSQL) に直接保存（services/database.py）
+- "sqlite": ローカルのSQLite（WALモード）に保存。単一サーバー構成向け
+- "spool": まずローカルのSQLiteに保存し、バックグラウンドでPostgreSQLへ同期する。
+  保存はネットワークを待たず、PostgreSQLの停止中に保存した履歴も復旧後に同期される
+- "auto"（既定）: PostgreSQLの接続情報が設定されていれば "spool"、なければ "sqlite"
+
+どのバックエンドも save_conversation / load_history の形式は
+services/database.py の save_conversation_to_db / load_conversation_history_from_db と同じです。
+"""
+
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from services import database
+from services.config import get_setting
+from services.metrics import get_registry, track_stage
+
+logger = logging.getLogger(__name__)
+
+# 履歴の読み込み件数
+HISTORY_LIMIT = 100
+
+# ローカルに保存した行をPostgreSQLへ同期する間隔（秒）と、失敗時の最大間隔
+SPOOL_SYNC_INTERVAL_SECONDS = 2.0
+SPOOL_MAX_BACKOFF_SECONDS = 60.0
+SPOOL_SYNC_BATCH_SIZE = 100
+
+# 同期済みの行をローカルに残す日数
+DEFAULT_SPOOL_RETENTION_DAYS = 30
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversation_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    client_id TEXT UNIQUE,
+    username TEXT,
+    timestamp TEXT,
+    transcription TEXT,
+    emotion_x REAL,
+    emotion_y REAL,
+    face_emotion TEXT,
+    ai_response TEXT,
+    synced INTEGER NOT NULL DEFAULT 0,
+    acoustic_features TEXT,
+    transcript_segments TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_conversation_username_timestamp
+ON conversation_history(username, timestamp DESC);
+CREATE INDEX IF NOT EXISTS idx_conversation_unsynced
+ON conversation_history(id) WHERE synced = 0;
+"""
+
+# 全文検索用のFTS5インデックス（trigramトークナイザで日本語の部分一致検索に対応）。
+# 本体テーブルの変更はトリガーでインデックスに反映する
+SQLITE_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS conversation_fts USING fts5(
+    transcription, ai_response,
+    content='conversation_history', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS conversation_fts_insert AFTER INSERT ON conversation_history BEGIN
+    INSERT INTO conversation_fts(rowid, transcription, ai_response)
+    VALUES (new.id, new.transcription, new.ai_response);
+END;
+CREATE TRIGGER IF NOT EXISTS conversation_fts_delete AFTER DELETE ON conversation_history BEGIN
+    INSERT INTO conversation_fts(conversation_fts, rowid, transcription, ai_response)
+    VALUES ('delete', old.id, old.transcription, old.ai_response);
+END;
+CREATE TRIGGER IF NOT EXISTS conversation_fts_update AFTER UPDATE OF transcription, ai_response
+ON conversation_history BEGIN
+    INSERT INTO conversation_fts(conversation_fts, rowid, transcription, ai_response)
+    VALUES ('delete', old.id, old.transcription, old.ai_response);
+    INSERT INTO conversation_fts(rowid, transcription, ai_response)
+    VALUES (new.id, new.transcription, new.ai_response);
+END;
+"""
+
+# trigramトークナイザで検索できる最小の文字数
+FTS_MIN_QUERY_LENGTH = 3
+
+# 感情の推移の集計単位ごとの、ISO形式のタイムスタンプを区間の開始時刻に切り捨てる式
+# （PostgreSQLの date_trunc と同じ区切り。週は月曜始まり）
+SQLITE_TREND_BUCKETS = {
+    "hour": "substr(timestamp, 1, 13) || ':00:00'",
+    "day": "substr(timestamp, 1, 10)",
+    "week": "date(substr(timestamp, 1, 10), 'weekday 0', '-6 days')",
+    "month": "substr(timestamp, 1, 7) || '-01'",
+}
+
+
+
+def _prepare_row(conversation_data: Dict, username: str) -> tuple:
+    """
+    保存する1行（client_id, username, timestamp, transcription, emotion_x, emotion_y, face_emotion,
+    ai_response, acoustic_features, transcript_segments）
+    """
+    emotion = conversation_data.get("emotion", (0.0, 0.0))
+    is_pair = isinstance(emotion, (tuple, list))
+    face_emotion = conversation_data.get("face_emotion")
+    acoustic_features = conversation_data.get("acoustic_features")
+    return (
+        conversation_data.get("client_id") or uuid.uuid4().hex,
+        username,
+        conversation_data.get("timestamp") or datetime.now().isoformat(),
+        conversation_data.get("transcription", ""),
+        float(emotion[0]) if is_pair else 0.0,
+        float(emotion[1]) if is_pair else 0.0,
+        json.dumps(face_emotion) if face_emotion else None,
+        conversation_data.get("ai_response", ""),
+        json.dumps(acoustic_features) if acoustic_features else None,
+        database.dump_segments(conversation_data.get("transcript_segments")),
+    )
+
+
+def _empty_trends() -> Dict:
+    """履歴がない場合の集計結果"""
+    return {"trajectory": [], "face_emotions": {}, "total": 0}
+
+
+def _loads_json(value: str | None):
+    """JSON文字列を読み込む（空・不正な値はNone）"""
+    if not value:
+        return None
+    try:
+        return json.loads(value)
+    except ValueError:
+        return None
+
+
+def _row_to_conversation(row: tuple) -> Dict:
+    """
+    (timestamp, transcription, emotion_x, emotion_y, face_emotion, ai_response, client_id,
+    acoustic_features, transcript_segments) を履歴の形式に変換
+    """
+    (timestamp, transcription, emotion_x, emotion_y, face_emotion_json, ai_response, client_id,
+     acoustic_features_json, transcript_segments_json) = row
+    return {
+        "timestamp": timestamp,
+        "transcription": transcription or "",
+        "emotion": (float(emotion_x), float(emotion_y)),
+        "face_emotion": _loads_json(face_emotion_json),
+        "ai_response": ai_response or "",
+        "client_id": client_id,
+        "acoustic_features": _loads_json(acoustic_features_json),
+        "transcript_segments": _loads_json(transcript_segments_json),
+    }
+
+
+class StorageBackend(ABC):
+    """対話履歴の保存先の共通インターフェース"""
+
+    name = ""
+
+    @abstractmethod
+    def init(self) -> bool:
+        """テーブルなどを初期化（成功した場合True）"""
+
+    @abstractmethod
+    def save_conversation(self, conversation_data: Dict, username: str) -> bool:
+        """対話履歴を1件保存（保存できた場合True）"""
+
+    @abstractmethod
+    def load_history(self, username: str, limit: int = HISTORY_LIMIT) -> List[Dict]:
+        """ユーザーの対話履歴を新しい順に読み込む"""
+
+    @abstractmethod
+    def search_history(
+        self, username: str, query: str, limit: int = 20, offset: int = 0
+    ) -> Dict:
+        """
+        対話履歴を全文検索（文字起こし・AI応答の部分一致、関連度順）
+
+        Returns:
+            {"results": list[dict], "total": int}（各結果は履歴と同じ形式に "score" を追加）
+        """
+
+    @abstractmethod
+    def emotion_trends(self, username: str, bucket: str = "day") -> Dict:
+        """
+        感情の推移・表情の分布・対話の頻度を集計（保存先で集計し、行は読み込まない）
+
+        Args:
+            bucket: 集計の単位（"hour" / "day" / "week" / "month"）
+
+        Returns:
+            services/database.py の aggregate_conversation_trends() と同じ形式
+        """
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """未反映の書き込みを反映（同期が不要なバックエンドでは何もしない）"""
+        return True
+
+
+class PostgresBackend(StorageBackend):
+    """Supabase (PostgreSQL) に直接保存"""
+
+    name = "postgres"
+
+    def init(self) -> bool:
+        return database.is_db_available() and database.init_database()
+
+    def save_conversation(self, conversation_data: Dict, username: str) -> bool:
+        return database.save_conversation_to_db(conversation_data, username)
+
+    def load_history(self, username: str, limit: int = HISTORY_LIMIT) -> List[Dict]:
+        return database.load_conversation_history_from_db(username)[:limit]
+
+    def search_history(self, username: str, query: str, limit: int = 20, offset: int = 0) -> Dict:
+        query = query.strip()
+        if username is None or not query:
+            return {"results": [], "total": 0}
+        with track_stage("search_history"):
+            found = database.search_conversations(username, query, limit, offset)
+        return found or {"results": [], "total": 0}
+
+    def emotion_trends(self, username: str, bucket: str = "day") -> Dict:
+        if username is None:
+            return _empty_trends()
+        with track_stage("emotion_trends"):
+            trends = database.aggregate_conversation_trends(username, bucket)
+        return trends or _empty_trends()
+
+
+def default_sqlite_path() -> str:
+    """SQLITE_PATH 未設定時のデータベースファイル（XDG_DATA_HOME、未設定時は ~/.local/share 配下）
+
+    同期前の履歴を保持するため、再起動で消える一時ディレクトリは使いません。
+    """
+    data_home = os.environ.get("XDG_DATA_HOME") or os.path.join(os.path.expanduser("~"), ".local", "share")
+    return os.path.join(data_home, "abc", "history.sqlite3")
+
+
+class SQLiteBackend(StorageBackend):
+    """ローカルのSQLite（WALモード）に保存"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str | None = None):
+        """
+        Args:
+            path: データベースファイルのパス（Noneの場合は SQLITE_PATH、未設定時は default_sqlite_path()）
+        """
+        self.path = path or get_setting("SQLITE_PATH") or default_sqlite_path()
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        self.fts_available = False
+
+    def connection(self) -> sqlite3.Connection:
+        """スレッドごとの接続を取得（初回にテーブルを作成）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            # WALモード: 書き込み中も読み込みをブロックせず、コミットごとのfsyncを減らす
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    conn.executescript(SQLITE_SCHEMA)
+                    self._migrate(conn)
+                    self.fts_available = self._init_fts(conn)
+                    self._initialized = True
+        return conn
+
+    def _migrate(self, conn: sqlite3.Connection):
+        """既存のデータベースファイルに不足しているカラムを追加"""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(conversation_history)")}
+        for column in ("acoustic_features", "transcript_segments"):
+            if column not in columns:
+                with conn:
+                    conn.execute(f"ALTER TABLE conversation_history ADD COLUMN {column} TEXT")
+
+    def _init_fts(self, conn: sqlite3.Connection) -> bool:
+        """全文検索インデックスを作成（SQLiteがtrigramトークナイザに対応していない場合はFalse）"""
+        try:
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'conversation_fts'"
+            ).fetchone()
+            conn.executescript(SQLITE_FTS_SCHEMA)
+            if not exists:
+                # 既存の行をインデックスに登録
+                with conn:
+                    conn.execute("INSERT INTO conversation_fts(conversation_fts) VALUES ('rebuild')")
+            return True
+        except sqlite3.Error as e:
+            logger.warning(f"SQLiteの全文検索インデックスを作成できませんでした（部分一致で検索します）: {e}")
+            return False
+
+    def init(self) -> bool:
+        try:
+            self.connection()
+            return True
+        except sqlite3.Error as e:
+            logger.warning(f"SQLiteの初期化エラー: {e}")
+            return False
+
+    def insert_row(self, row: tuple, synced: bool = False) -> bool:
+        """_prepare_row() の行を追加"""
+        try:
+            conn = self.connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR IGNORE INTO conversation_history "
+                    "(client_id, username, timestamp, transcription, emotion_x, emotion_y, "
+                    "face_emotion, ai_response, acoustic_features, transcript_segments, synced) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (*row, int(synced)),
+                )
+            return True
+        except sqlite3.Error as e:
+            logger.warning(f"SQLiteへの保存エラー（ユーザー名: {row[1]}）: {e}")
+            return False
+
+    def save_conversation(self, conversation_data: Dict, username: str) -> bool:
+        if username is None:
+            logger.warning("usernameがNoneのため、保存をスキップします")
+            return False
+        with track_stage("save_conversation_to_sqlite") as metrics:
+            saved = self.insert_row(_prepare_row(conversation_data, username))
+            metrics["error"] = not saved
+            return saved
+
+    def load_history(self, username: str, limit: int = HISTORY_LIMIT) -> List[Dict]:
+        if username is None:
+            return []
+        try:
+            rows = self.connection().execute(
+                "SELECT timestamp, transcription, emotion_x, emotion_y, face_emotion, ai_response, client_id, "
+                "acoustic_features, transcript_segments "
+                "FROM conversation_history WHERE username = ? ORDER BY timestamp DESC LIMIT ?",
+                (username, limit),
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"SQLiteからの読み込みエラー（ユーザー名: {username}）: {e}")
+            return []
+
+        return [_row_to_conversation(row) for row in rows]
+
+    def search_history(self, username: str, query: str, limit: int = 20, offset: int = 0) -> Dict:
+        query = query.strip()
+        if username is None or not query:
+            return {"results": [], "total": 0}
+
+        columns = (
+            "h.timestamp, h.transcription, h.emotion_x, h.emotion_y, h.face_emotion, "
+            "h.ai_response, h.client_id, h.acoustic_features, h.transcript_segments"
+        )
+        with track_stage("search_history"):
+            conn = self.connection()
+            if self.fts_available and len(query) >= FTS_MIN_QUERY_LENGTH:
+                # 検索語全体を1つのフレーズとして扱う（FTS5の構文として解釈させない）
+                phrase = '"' + query.replace('"', '""') + '"'
+                # CROSS JOIN で結合順を固定し、先にFTSインデックスで候補を絞り込む
+                # （ユーザー名のインデックスから結合すると行ごとにMATCHが評価される）
+                source = (
+                    "FROM conversation_fts f CROSS JOIN conversation_history h ON h.id = f.rowid "
+                    "WHERE conversation_fts MATCH ? AND h.username = ?"
+                )
+                params = (phrase, username)
+                # bm25() は関連度が高いほど小さい値を返すため、符号を反転してスコアにする
+                select = f"SELECT {columns}, -bm25(conversation_fts) AS score {source} "
+                order = "ORDER BY score DESC, h.timestamp DESC"
+            else:
+                # 3文字未満の検索語はtrigramで検索できないため、ユーザーの履歴を部分一致で絞り込む
+                pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                source = (
+                    "FROM conversation_history h WHERE h.username = ? AND "
+                    "(h.transcription LIKE ? ESCAPE '\\' OR h.ai_response LIKE ? ESCAPE '\\')"
+                )
+                params = (username, pattern, pattern)
+                select = f"SELECT {columns}, 1.0 AS score {source} "
+                order = "ORDER BY h.timestamp DESC"
+
+            try:
+                total = conn.execute(f"SELECT COUNT(*) {source}", params).fetchone()[0]
+                rows = conn.execute(f"{select}{order} LIMIT ? OFFSET ?", (*params, limit, offset)).fetchall()
+            except sqlite3.Error as e:
+                logger.warning(f"SQLiteでの検索エラー（ユーザー名: {username}）: {e}")
+                return {"results": [], "total": 0}
+
+        results = []
+        for row in rows:
+            conversation = _row_to_conversation(row[:-1])
+            conversation["score"] = float(row[-1])
+            results.append(conversation)
+        return {"results": results, "total": total}
+
+    def emotion_trends(self, username: str, bucket: str = "day") -> Dict:
+        if bucket not in SQLITE_TREND_BUCKETS:
+            raise ValueError(f"未対応の集計単位です: {bucket}")
+        if username is None:
+            return _empty_trends()
+
+        with track_stage("emotion_trends"):
+            conn = self.connection()
+            try:
+                trajectory_rows = conn.execute(
+                    f"SELECT {SQLITE_TREND_BUCKETS[bucket]} AS bucket, COUNT(*), AVG(emotion_x), AVG(emotion_y) "
+                    "FROM conversation_history WHERE username = ? GROUP BY bucket ORDER BY bucket",
+                    (username,),
+                ).fetchall()
+                face_rows = conn.execute(
+                    "SELECT CASE WHEN json_valid(face_emotion) "
+                    "THEN json_extract(face_emotion, '$.dominant_emotion') END AS dominant, COUNT(*) "
+                    "FROM conversation_history WHERE username = ? AND face_emotion IS NOT NULL "
+                    "GROUP BY dominant",
+                    (username,),
+                ).fetchall()
+            except sqlite3.Error as e:
+                logger.warning(f"SQLiteでの集計エラー（ユーザー名: {username}）: {e}")
+                return _empty_trends()
+
+        trajectory = [
+            {
+                "bucket": start,
+                "count": count,
+                "emotion_x": float(emotion_x or 0.0),
+                "emotion_y": float(emotion_y or 0.0),
+            }
+            for start, count, emotion_x, emotion_y in trajectory_rows
+        ]
+        face_emotions = {}
+        for dominant, count in face_rows:
+            face_emotions[dominant or "unknown"] = face_emotions.get(dominant or "unknown", 0) + count
+        return {
+            "trajectory": trajectory,
+            "face_emotions": face_emotions,
+            "total": sum(entry["count"] for entry in trajectory),
+        }
+
+
+class SpoolingBackend(StorageBackend):
+    """
+    ローカルのSQLiteに保存し、バックグラウンドでPostgreSQLへ同期
+
+    同期はクライアント側で発行したIDで重複を防ぐため、同期の途中で停止しても
+    再実行で二重に登録されることはありません。
+    """
+
+    name = "spool"
+
+    def __init__(self, local: SQLiteBackend | None = None):
+        self.local = local or SQLiteBackend()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._sync_lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._postgres_ready = False
+
+    def init(self) -> bool:
+        # PostgreSQLの接続確認とマイグレーションは初回描画を待たせないよう同期スレッドで行い、
+        # 準備ができるまではローカルへの保存と読み込みだけを使う
+        if not self.local.init():
+            return False
+        self._start_sync_thread()
+        return True
+
+    def _connect_postgres(self) -> bool:
+        """PostgreSQLの接続確認とテーブルの初期化（同期スレッドで実行）"""
+        self._postgres_ready = database.is_db_available() and database.init_database()
+        return self._postgres_ready
+
+    def _start_sync_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._sync_loop, name="storage-spool", daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def save_conversation(self, conversation_data: Dict, username: str) -> bool:
+        saved = self.local.save_conversation(conversation_data, username)
+        if saved:
+            self._start_sync_thread()
+            self._wake.set()
+        return saved
+
+    def load_history(self, username: str, limit: int = HISTORY_LIMIT) -> List[Dict]:
+        local = self.local.load_history(username, limit)
+        # PostgreSQLに接続できない間は、接続のタイムアウトを待たずにローカルの履歴だけを返す
+        remote = []
+        if username and self._postgres_ready:
+            remote = database.load_conversation_history_from_db(username)
+
+        # 同じ行（client_id）は1件にまとめ、他のサーバーで保存した履歴と結合する
+        merged = {}
+        for index, entry in enumerate(remote + local):
+            merged.setdefault(entry.get("client_id") or f"row-{index}", entry)
+        return sorted(merged.values(), key=lambda entry: entry["timestamp"], reverse=True)[:limit]
+
+    def search_history(self, username: str, query: str, limit: int = 20, offset: int = 0) -> Dict:
+        # PostgreSQLには全サーバーの履歴があるため優先し、接続できない間はローカルを検索する
+        # （同期待ちの行は数秒以内に同期されるため、PostgreSQLの結果には含めない）
+        query = query.strip()
+        if username is None or not query:
+            return {"results": [], "total": 0}
+        if self._postgres_ready:
+            with track_stage("search_history"):
+                found = database.search_conversations(username, query, limit, offset)
+            if found is not None:
+                return found
+        return self.local.search_history(username, query, limit, offset)
+
+    def emotion_trends(self, username: str, bucket: str = "day") -> Dict:
+        # 検索と同様に、全サーバーの履歴があるPostgreSQLを優先する
+        if username is None:
+            return _empty_trends()
+        if self._postgres_ready:
+            with track_stage("emotion_trends"):
+                trends = database.aggregate_conversation_trends(username, bucket)
+            if trends is not None:
+                return trends
+        return self.local.emotion_trends(username, bucket)
+
+    def pending_count(self) -> int:
+        """PostgreSQLへの同期を待っている行数"""
+        try:
+            return self.local.connection().execute(
+                "SELECT COUNT(*) FROM conversation_history WHERE synced = 0"
+            ).fetchone()[0]
+        except sqlite3.Error:
+            return 0
+
+    def sync_once(self) -> int:
+        """
+        未同期の行を1回分PostgreSQLへ書き込む
+
+        Returns:
+            同期した行数（失敗した場合は -1）
+        """
+        with self._sync_lock:
+            conn = self.local.connection()
+            rows = conn.execute(
+                "SELECT id, client_id, username, timestamp, transcription, emotion_x, emotion_y, "
+                "face_emotion, ai_response, acoustic_features, transcript_segments "
+                "FROM conversation_history WHERE synced = 0 "
+                "ORDER BY id LIMIT ?",
+                (SPOOL_SYNC_BATCH_SIZE,),
+            ).fetchall()
+            if not rows:
+                return 0
+
+            if not self._postgres_ready and not self._connect_postgres():
+                return -1
+
+            with track_stage("sync_spool_to_db"):
+                if not database.insert_conversation_rows([row[1:] for row in rows]):
+                    self._postgres_ready = False
+                    return -1
+            with conn:
+                conn.executemany(
+                    "UPDATE conversation_history SET synced = 1 WHERE id = ?",
+                    [(row[0],) for row in rows],
+                )
+            return len(rows)
+
+    def _prune(self):
+        """保持期間を過ぎた同期済みの行を削除"""
+        days = float(get_setting("SPOOL_RETENTION_DAYS", DEFAULT_SPOOL_RETENTION_DAYS))
+        cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+        with self.local.connection() as conn:
+            conn.execute(
+                "DELETE FROM conversation_history WHERE synced = 1 AND timestamp < ?", (cutoff,)
+            )
+
+    def _sync_loop(self):
+        interval = SPOOL_SYNC_INTERVAL_SECONDS
+        while not self._stop.is_set():
+            try:
+                # 同期待ちの行がなくても、PostgreSQLの準備ができるまで接続を再試行する
+                if not self._postgres_ready and not self._connect_postgres():
+                    synced = -1
+                else:
+                    synced = self.sync_once()
+                    while synced == SPOOL_SYNC_BATCH_SIZE:
+                        synced = self.sync_once()
+                if synced < 0:
+                    # PostgreSQLに接続できない間は間隔を広げて再試行する
+                    interval = min(SPOOL_MAX_BACKOFF_SECONDS, interval * 2)
+                else:
+                    interval = SPOOL_SYNC_INTERVAL_SECONDS
+                    if synced:
+                        self._prune()
+                get_registry().set_gauge(
+                    "storage_spool_pending", self.pending_count(), "PostgreSQLへの同期待ちの行数"
+                )
+            except Exception as e:
+                logger.warning(f"PostgreSQLへの同期中にエラーが発生しました: {e}")
+                interval = min(SPOOL_MAX_BACKOFF_SECONDS, interval * 2)
+            self._wake.wait(interval)
+            self._wake.clear()
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """未同期の行を同期（プロセス終了時など）。すべて同期できた場合True"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                synced = self.sync_once()
+            except Exception:
+                return False
+            if synced == 0:
+                return True
+            if synced < 0:
+                return False
+        return False
+
+
+def _create_backend() -> StorageBackend:
+    """設定（STORAGE_BACKEND）に従ってバックエンドを作成"""
+    name = str(get_setting("STORAGE_BACKEND", "auto")).lower()
+    if name == "auto":
+        name = "spool" if database.is_db_configured() else "sqlite"
+    if name == "postgres":
+        return PostgresBackend()
+    if name == "spool":
+        return SpoolingBackend()
+    return SQLiteBackend()
+
+
+_storage: StorageBackend | None = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> StorageBackend:
+    """プロセス共通の保存先を取得（初回に初期化）"""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            _storage = _create_backend()
+            _storage.init()
+        return _storage
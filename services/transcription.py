@@ -1,11 +1,264 @@
-"""文字起こし（たいきが実装）"""
+"""文字起こし（たいきが実装）
 
+文字起こしエンジン（バックエンド）は TRANSCRIPTION_BACKEND で選択します。
+- "openai": Whisper API（whisper-1）
+- "local": ローカルのWhisper系モデル（faster-whisper、CPU・int8量子化）
+- "auto": ローカルモデルが設定されていればローカル、なければAPI（既定）
+選択したバックエンドが失敗した場合は、利用可能な別のバックエンドで再試行します。
+
+発話の区間（セグメント）ごとの時刻も取得し、無音を除いた音声の時刻は元の録画の時刻に戻して
+列ごとの配列（{"start": [...], "end": [...], "text": [...]}）で返します。
+"""
+
+from __future__ import annotations
+
+import logging
 import os
-import tempfile
-from openai import OpenAI
+import threading
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from services.audio import (
+    DEFAULT_MAX_PAUSE_SECONDS,
+    encode_wav,
+    prepare_speech_audio,
+    to_original_time,
+)
+from services.config import get_setting
+from services.metrics import track_stage
+from services.rate_limiter import call_openai, with_deadline
+from services.recording_store import media_path, media_size
+
+if TYPE_CHECKING:
+    # 型ヒント専用（openaiは呼び出し側でクライアント作成時に読み込まれる）
+    from openai import OpenAI
+
+logger = logging.getLogger(__name__)
+
+# Whisper APIにアップロードできるファイルサイズの上限
+WHISPER_MAX_BYTES = 25 * 1024 * 1024
+
+# ローカルモデルの既定の量子化設定（CPU向け）
+DEFAULT_LOCAL_COMPUTE_TYPE = "int8"
+
+_local_model_lock = threading.Lock()
+_local_model = None
+
+
+def _is_vad_enabled() -> bool:
+    """送信前に無音を除去するか（TRANSCRIPTION_VAD 設定、既定は有効）"""
+    return str(get_setting("TRANSCRIPTION_VAD", "true")).lower() in ("1", "true", "yes")
+
+
+def prepare_transcription_audio(video_data: bytes | str | os.PathLike) -> dict | None:
+    """
+    文字起こし用の無音を除いた音声を作成（TRANSCRIPTION_MAX_PAUSE_SECONDS の設定で間を詰める）
+
+    Returns:
+        services/audio.py の prepare_speech_audio() の結果（音声の特徴量を含む）
+    """
+    max_pause = float(get_setting("TRANSCRIPTION_MAX_PAUSE_SECONDS", DEFAULT_MAX_PAUSE_SECONDS))
+    return prepare_speech_audio(video_data, max_pause_seconds=max_pause)
+
+
+def _field(item, name: str):
+    """セグメントの値を取得（SDKのオブジェクト・dictのどちらにも対応）"""
+    return item.get(name) if isinstance(item, dict) else getattr(item, name, None)
+
+
+def segment_columns(segments, speech: dict | None = None) -> dict:
+    """
+    文字起こしのセグメントを列ごとの配列に変換
+
+    Args:
+        segments: start / end / text を持つセグメントのリスト
+        speech: セグメントの時刻が無音を除いた音声のものである場合、その prepare_speech_audio() の結果
+            （元の録画の時刻に戻す）
+
+    Returns:
+        {"start": list[float], "end": list[float], "text": list[str]}（時刻は秒、小数点以下2桁）
+    """
+    segments = [segment for segment in segments or [] if _field(segment, "start") is not None]
+    starts = np.array([float(_field(segment, "start")) for segment in segments], dtype=np.float64)
+    ends = np.array([float(_field(segment, "end") or 0.0) for segment in segments], dtype=np.float64)
+    if speech is not None and speech.get("time_map"):
+        starts = to_original_time(starts, speech["time_map"])
+        # 終了時刻が詰めた間の境界ちょうどの場合は、前の部分の終わりとして扱う
+        ends = to_original_time(ends, speech["time_map"], side="left")
+    return {
+        "start": np.round(starts, 2).tolist(),
+        "end": np.round(np.maximum(ends, starts), 2).tolist(),
+        "text": [str(_field(segment, "text") or "").strip() for segment in segments],
+    }
+
+
+def empty_segments() -> dict:
+    """セグメントがない場合（無音・エラー時）の列"""
+    return {"start": [], "end": [], "text": []}
+
+
+class TranscriptionBackend(ABC):
+    """文字起こしエンジンの共通インターフェース"""
+
+    name = ""
+
+    @abstractmethod
+    def is_available(self, client: OpenAI | None) -> bool:
+        """このバックエンドを使用できるか"""
+
+    @abstractmethod
+    def transcribe(
+        self,
+        video_data: bytes | str | os.PathLike,
+        speech: dict | None,
+        client: OpenAI | None,
+    ) -> tuple[str, dict]:
+        """
+        文字起こしを実行（失敗時は例外を送出）
+
+        Args:
+            video_data: WebM形式の動画データ（bytes）またはファイルパス
+            speech: prepare_speech_audio() の結果（無音除去を行わなかった場合はNone）
+            client: OpenAIクライアントインスタンス
+
+        Returns:
+            (テキスト, segment_columns() の形式のセグメント（元の録画の時刻）)
+        """
 
 
-def transcribe_video(video_data: bytes, client: OpenAI) -> tuple[str, str]:
+class OpenAIWhisperBackend(TranscriptionBackend):
+    """Whisper API（whisper-1）"""
+
+    name = "openai"
+
+    def is_available(self, client: OpenAI | None) -> bool:
+        return client is not None
+
+    def transcribe(self, video_data, speech, client) -> tuple[str, dict]:
+        with track_stage("transcribe_video") as metrics:
+            upload = None
+            if speech is not None:
+                wav = encode_wav(speech["samples"], speech["sample_rate"])
+                # WAVはWebMより大きいため、上限を超える長さの場合は元の録画を送信する
+                if len(wav) <= WHISPER_MAX_BYTES:
+                    upload = ("audio.wav", wav)
+
+            if upload is not None:
+                response = call_openai(
+                    "whisper-1",
+                    lambda: with_deadline(client).audio.transcriptions.create(
+                        model="whisper-1", file=upload, language="ja", response_format="verbose_json"
+                    ),
+                )
+                metrics["bytes_uploaded"] = len(upload[1])
+                return response.text, segment_columns(getattr(response, "segments", None), speech)
+            else:
+                with media_path(video_data) as path:
+
+                    def request():
+                        # 再試行・ヘッジで同時に呼ばれても安全なよう、呼び出しごとに開き直す
+                        with open(path, "rb") as f:
+                            return with_deadline(client).audio.transcriptions.create(
+                                model="whisper-1",
+                                file=("audio.m4a", f),
+                                language="ja",
+                                response_format="verbose_json",
+                            )
+
+                    response = call_openai("whisper-1", request)
+                metrics["bytes_uploaded"] = media_size(video_data)
+            return response.text, segment_columns(getattr(response, "segments", None))
+
+
+def _load_local_model():
+    """ローカルモデルを読み込む（プロセスにつき1回）"""
+    global _local_model
+    with _local_model_lock:
+        if _local_model is None:
+            from faster_whisper import WhisperModel
+
+            _local_model = WhisperModel(
+                get_setting("LOCAL_WHISPER_MODEL_PATH"),
+                device="cpu",
+                compute_type=get_setting("LOCAL_WHISPER_COMPUTE_TYPE", DEFAULT_LOCAL_COMPUTE_TYPE),
+                cpu_threads=int(get_setting("LOCAL_WHISPER_CPU_THREADS", 0)),
+            )
+        return _local_model
+
+
+class LocalWhisperBackend(TranscriptionBackend):
+    """
+    ローカルのWhisper系モデル（faster-whisper、CPUのみ）
+
+    LOCAL_WHISPER_MODEL_PATH にCTranslate2形式に変換済みのモデルのディレクトリを
+    指定します。ネットワークに接続せず、APIの料金もかかりません。
+    バッチ処理ではワーカープロセスごとにモデルを読み込むため、CPUコア数に応じて
+    スループットが向上します（LOCAL_WHISPER_CPU_THREADS でプロセスあたりのスレッド数を指定）。
+    """
+
+    name = "local"
+
+    def is_available(self, client: OpenAI | None) -> bool:
+        path = get_setting("LOCAL_WHISPER_MODEL_PATH")
+        if not path or not os.path.isdir(path):
+            return False
+        try:
+            import faster_whisper  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def transcribe(self, video_data, speech, client) -> tuple[str, dict]:
+        model = _load_local_model()
+        with track_stage("transcribe_video_local"):
+            if speech is not None:
+                segments, _info = model.transcribe(speech["samples"], language="ja")
+                segments = list(segments)
+            else:
+                with media_path(video_data) as path:
+                    segments, _info = model.transcribe(path, language="ja")
+                    # segments は遅延評価のため、ファイルが削除される前に読み切る
+                    segments = list(segments)
+            text = "".join(segment.text for segment in segments).strip()
+            return text, segment_columns(segments, speech)
+
+
+BACKENDS: dict[str, TranscriptionBackend] = {
+    backend.name: backend for backend in (OpenAIWhisperBackend(), LocalWhisperBackend())
+}
+
+
+def warm_up_local_backend() -> bool:
+    """ローカルモデルが設定されていれば事前に読み込む（読み込んだ場合True）"""
+    if str(get_setting("TRANSCRIPTION_BACKEND", "auto")).lower() == "openai":
+        return False
+    if not BACKENDS["local"].is_available(None):
+        return False
+    _load_local_model()
+    return True
+
+
+def get_backends(client: OpenAI | None) -> list[TranscriptionBackend]:
+    """
+    設定（TRANSCRIPTION_BACKEND）に従って、試行する順に利用可能なバックエンドを返す
+
+    指定したバックエンドを先頭に、利用可能なその他のバックエンドをフォールバックとして並べます。
+    """
+    preferred = str(get_setting("TRANSCRIPTION_BACKEND", "auto")).lower()
+    if preferred not in BACKENDS:
+        preferred = "local" if BACKENDS["local"].is_available(client) else "openai"
+    order = [preferred] + [name for name in BACKENDS if name != preferred]
+    return [BACKENDS[name] for name in order if BACKENDS[name].is_available(client)]
+
+
+def transcribe_video(
+    video_data: bytes | str | os.PathLike,
+    client: OpenAI | None,
+    speech: dict | None = None,
+    skip_vad: bool = False,
+) -> tuple[str, str]:
     """
     録画データから音声を抽出して文字起こし
 
@@ -13,36 +266,72 @@ def transcribe_video(video_data: bytes, client: OpenAI) -> tuple[str, str]:
     詳細は services/INTERFACE.md を参照してください。
 
     Args:
-        video_data: WebM形式の動画データ（bytes）
-        client: OpenAIクライアントインスタンス
+        video_data: WebM形式の動画データ（bytes）またはファイルパス
+        client: OpenAIクライアントインスタンス（ローカルモデルのみを使う場合はNone可）
+        speech: 作成済みの prepare_transcription_audio() の結果（Noneの場合は内部で作成）
+        skip_vad: Trueの場合、speech がNoneでも音声を作成せず録画ファイルをそのまま送る
 
     Returns:
         (transcription_text, status) のタプル
-        - transcription_text: 文字起こし結果のテキスト（エラー時は空文字列）
-        - status: "completed" または "error"
+        - transcription_text: 文字起こし結果のテキスト（エラー時・発話がない場合は空文字列）
+        - status: "completed"、"no_speech"（録画全体が無音）または "error"
 
     Raises:
         Exception: 重大なエラーが発生した場合（UI層でキャッチする想定）
     """
-    if not video_data or len(video_data) < 100:
-        return "", "error"
+    result, status = transcribe_video_with_segments(video_data, client, speech, skip_vad=skip_vad)
+    return result["text"], status
 
-    temp_input_path = None
-    try:
-        with tempfile.NamedTemporaryFile(delete=False) as f:
-            f.write(video_data)
-            temp_input_path = f.name
 
-        with open(temp_input_path, "rb") as f:
-            response = client.audio.transcriptions.create(
-                model="whisper-1", file=("audio.m4a", f), language="ja"
-            )
+def transcribe_video_with_segments(
+    video_data: bytes | str | os.PathLike,
+    client: OpenAI | None,
+    speech: dict | None = None,
+    skip_vad: bool = False,
+) -> tuple[dict, str]:
+    """
+    録画データから音声を抽出して、発話の区間ごとの時刻付きで文字起こし
+
+    Args:
+        video_data: WebM形式の動画データ（bytes）またはファイルパス
+        client: OpenAIクライアントインスタンス（ローカルモデルのみを使う場合はNone可）
+        speech: 作成済みの prepare_transcription_audio() の結果（Noneの場合は内部で作成）
+        skip_vad: Trueの場合、speech がNoneでも音声を作成せず録画ファイルをそのまま送る
+            （音声の前処理を別に実行済みで、失敗・打ち切りになった場合など）
+
+    Returns:
+        (result, status) のタプル
+        - result: {
+            "text": str,  # 文字起こし結果のテキスト（エラー時・発話がない場合は空文字列）
+            "segments": {"start": list[float], "end": list[float], "text": list[str]},
+                # 発話の区間（元の録画での時刻、秒）
+          }
+        - status: "completed"、"no_speech"（録画全体が無音）または "error"
+    """
+    empty = {"text": "", "segments": empty_segments()}
+    size = media_size(video_data)
+    if size < 100:
+        return empty, "error"
+
+    backends = get_backends(client)
+    if not backends:
+        logger.warning("利用可能な文字起こしエンジンがありません")
+        return empty, "error"
 
-        return response.text, "completed"
+    # 無音を除いた音声を作成（音声を取り出せない場合は録画ファイルをそのまま使う）
+    if not _is_vad_enabled():
+        speech = None
+    elif speech is None and not skip_vad:
+        speech = prepare_transcription_audio(video_data)
+    if speech is not None and speech["speech_seconds"] == 0:
+        # 全体が無音の場合は文字起こしを行わない
+        logger.info("発話が検出されなかったため、文字起こしをスキップしました")
+        return empty, "no_speech"
 
-    except Exception as e:
-        print(f"Whisperエラー詳細: {str(e)}")
-        return "", "error"
-    finally:
-        if temp_input_path and os.path.exists(temp_input_path):
-            os.remove(temp_input_path)
+    for backend in backends:
+        try:
+            text, segments = backend.transcribe(video_data, speech, client)
+            return {"text": text, "segments": segments}, "completed"
+        except Exception as e:
+            logger.warning(f"文字起こしエラー詳細（{backend.name}）: {str(e)}")
+    return empty, "error"
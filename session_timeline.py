@@ -0,0 +1,127 @@
+"""ステップ3のセッションのタイムライン（発話と表情を同じ時間軸に並べる）
+
+文字起こしの発話の区間（services/transcription.py の "segments"）と、表情認識の
+各フレームの時刻（services/face_analysis.py の "frame_times"）は、どちらも
+列ごとの配列（{"start": [...], "end": [...], "text": [...]} など）で保存されています。
+ここでは配列のまま図にし、発話・表情ごとにトレースを1つにまとめるため、
+1時間の録画でも図の大きさは区間の数に比例するだけで済みます。
+区間が多い場合は、隣り合う区間をNumPyでまとめてからブラウザに送ります。
+"""
+
+import numpy as np
+
+# 図に描く発話の区間の上限
+MAX_TIMELINE_SEGMENTS = 500
+
+# ホバーに表示する発話の文字数
+SEGMENT_HOVER_CHARS = 60
+
+# 表情の行の並び（上から）
+EMOTION_ROWS = ("happy", "surprised", "neutral", "other", "sad", "angry")
+
+SPEECH_ROW = "発話"
+
+
+def merge_segments(segments: dict, max_segments: int = MAX_TIMELINE_SEGMENTS) -> dict:
+    """
+    発話の区間を連続する max_segments 個のグループにまとめる
+
+    各グループの開始は最初の区間の開始、終了は最後の区間の終了、テキストは区間のテキストを
+    つなげたもの（先頭の SEGMENT_HOVER_CHARS 文字）とします。
+
+    Args:
+        segments: {"start": list[float], "end": list[float], "text": list[str]}（時刻順）
+        max_segments: まとめた後の区間数の上限
+
+    Returns:
+        segments と同じ形式のdict（区間数が max_segments 以下の場合はそのまま）
+    """
+    count = len(segments["start"])
+    if count <= max_segments:
+        return segments
+
+    starts = np.asarray(segments["start"], dtype=np.float64)
+    ends = np.asarray(segments["end"], dtype=np.float64)
+    # 各グループの先頭のインデックス（区間数がほぼ等しくなるように分ける）
+    group_starts = np.linspace(0, count, max_segments, endpoint=False).astype(np.int64)
+    group_ends = np.append(group_starts[1:], count)
+    texts = segments["text"]
+    return {
+        "start": np.minimum.reduceat(starts, group_starts).tolist(),
+        "end": np.maximum.reduceat(ends, group_starts).tolist(),
+        "text": [
+            "".join(texts[first:last])[:SEGMENT_HOVER_CHARS]
+            for first, last in zip(group_starts, group_ends)
+        ],
+    }
+
+
+def has_timeline(transcript_segments: dict | None, face_emotion: dict | None) -> bool:
+    """タイムラインに描ける時刻付きのデータがあるか"""
+    return bool(
+        (transcript_segments and transcript_segments.get("start"))
+        or (face_emotion and face_emotion.get("frame_times"))
+    )
+
+
+def build_timeline_figure(transcript_segments: dict | None, face_emotion: dict | None) -> dict:
+    """
+    発話の区間（横棒）と各フレームの表情（点）のタイムラインの図
+
+    Args:
+        transcript_segments: 文字起こしの発話の区間（列ごとの配列、Noneの場合は表情のみ）
+        face_emotion: analyze_face_emotion() の結果（"frame_times" がない場合は発話のみ）
+    """
+    data = []
+    rows = [SPEECH_ROW]
+
+    if transcript_segments and transcript_segments.get("start"):
+        segments = merge_segments(transcript_segments)
+        starts = np.asarray(segments["start"], dtype=np.float64)
+        durations = np.maximum(np.asarray(segments["end"], dtype=np.float64) - starts, 0.05)
+        data.append(
+            {
+                "type": "bar",
+                "orientation": "h",
+                "base": starts.round(2).tolist(),
+                "x": durations.round(2).tolist(),
+                "y": [SPEECH_ROW] * len(starts),
+                "text": [text[:SEGMENT_HOVER_CHARS] for text in segments["text"]],
+                "textposition": "none",
+                "name": SPEECH_ROW,
+                "hovertemplate": "%{base:.1f}秒 ～<br>%{text}<extra></extra>",
+            }
+        )
+
+    if face_emotion and face_emotion.get("frame_times"):
+        times = face_emotion["frame_times"]
+        emotions = face_emotion["emotions"][: len(times)]
+        confidences = face_emotion.get("confidences") or [1.0] * len(emotions)
+        rows += [emotion for emotion in EMOTION_ROWS if emotion in emotions]
+        rows += sorted(set(emotions) - set(rows))
+        data.append(
+            {
+                "type": "scatter",
+                "mode": "markers",
+                "x": times[: len(emotions)],
+                "y": emotions,
+                # 信頼度が高いフレームほど大きく描く
+                "marker": {"size": [6 + 10 * float(c) for c in confidences[: len(emotions)]]},
+                "customdata": confidences[: len(emotions)],
+                "name": "表情",
+                "hovertemplate": "%{x:.1f}秒<br>%{y}（信頼度: %{customdata:.2f}）<extra></extra>",
+            }
+        )
+
+    return {
+        "data": data,
+        "layout": {
+            "title": {"text": "発話と表情のタイムライン"},
+            "xaxis": {"title": {"text": "録画開始からの時間（秒）"}, "rangemode": "tozero"},
+            # 上から 発話 → 表情 の順に並べる
+            "yaxis": {"type": "category", "categoryorder": "array", "categoryarray": rows[::-1]},
+            "showlegend": False,
+            "height": 120 + 40 * len(rows),
+            "margin": {"t": 40, "b": 40},
+        },
+    }
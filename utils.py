@@ -3,14 +3,15 @@
 セッション状態の初期化、対話履歴の管理、OpenAIクライアントの取得を提供します。
 """
 
+import logging
+import uuid
+
 import streamlit as st
-from openai import OpenAI
-from services.database import (
-    is_db_available,
-    init_database,
-    load_conversation_history_from_db,
-    save_conversation_to_db,
-)
+from services.config import get_setting
+from services.history_cache import get_history_cache
+from services.metrics import start_metrics_server, track_stage
+from services.recording_store import cleanup_recordings, new_session_id
+from services.storage import get_storage
 
 
 def init_session_state():
@@ -25,8 +26,10 @@ def init_session_state():
         st.session_state["recording_started_at"] = None
 
     # 録画データ
-    if "recorded_video_data" not in st.session_state:
-        st.session_state["recorded_video_data"] = None  # 録画した動画データ（bytes）
+    if "recorded_video_path" not in st.session_state:
+        st.session_state["recorded_video_path"] = None  # 録画した動画ファイルのパス
+    if "recording_session_id" not in st.session_state:
+        st.session_state["recording_session_id"] = new_session_id()  # 録画ファイルの保存先
     if "analysis_trigger" not in st.session_state:
         st.session_state["analysis_trigger"] = False  # 分析開始のトリガー
     if "recording_path" not in st.session_state:
@@ -39,8 +42,11 @@ def init_session_state():
         st.session_state["transcription_result"] = None  # 文字起こし結果のテキスト
     if "transcription_status" not in st.session_state:
         st.session_state["transcription_status"] = (
-            "idle"  # 処理状態（"idle", "processing", "completed", "error")
+            "idle"  # 処理状態（"idle", "processing", "completed", "no_speech", "error")
         )
+    if "transcript_segments_result" not in st.session_state:
+        # 発話の区間 {"start": list[float], "end": list[float], "text": list[str]}（dict | None）
+        st.session_state["transcript_segments_result"] = None
 
     # 表情認識結果
     if "face_emotion_result" not in st.session_state:
@@ -50,6 +56,10 @@ def init_session_state():
             "idle"  # 処理状態（"idle", "processing", "completed", "error")
         )
 
+    # 音声の特徴量（services/audio_features.py）
+    if "acoustic_features_result" not in st.session_state:
+        st.session_state["acoustic_features_result"] = None  # 特徴量（dict | None）
+
     # 対話関連
     # ユーザー名が設定されている場合、データベースから履歴を再読み込み
     if "username" in st.session_state and st.session_state["username"]:
@@ -68,49 +78,121 @@ def init_session_state():
         st.session_state["conversation_history"] = []
     if "ai_response" not in st.session_state:
         st.session_state["ai_response"] = None  # AI応答
+    if "similar_sessions" not in st.session_state:
+        st.session_state["similar_sessions"] = None  # 似ている過去の対話（list | None、未検索はNone）
 
-    # データベースの初期化（初回のみ、利用可能な場合）
+    # 放置された録画ファイルの削除（プロセス内で一定間隔ごと）
+    cleanup_recordings()
+
+    # 保存先の初期化（プロセスにつき1回。PostgreSQLの準備は同期スレッドで行うため待たない）
     if "db_initialized" not in st.session_state:
-        if is_db_available():
-            init_database()
+        get_storage()
         st.session_state["db_initialized"] = True
 
 
 def load_conversation_history(username: str = None):
-    """対話履歴を読み込む（データベースから、または空リスト）"""
-    if username and is_db_available():
-        try:
-            history = load_conversation_history_from_db(username)
+    """対話履歴を読み込む（キャッシュ、保存先、または空リスト）"""
+    if username:
+        with track_stage("load_conversation_history") as metrics:
+            cache = get_history_cache()
+            history = cache.get(username)
+            if history is not None:
+                metrics["cache_hits"] = 1
+                return history
+            try:
+                history = get_storage().load_history(username)
+            except Exception as e:
+                # エラー時は空リストを返す（メモリのみモード）
+                logging.warning(f"対話履歴の読み込みエラー（ユーザー名: {username}）: {e}")
+                metrics["error"] = True
+                return []
+            cache.put(username, history)
             return history
-        except Exception as e:
-            # エラー時は空リストを返す（メモリのみモード）
-            return []
     return []
 
 
 def save_conversation(conversation_data, username: str = None):
-    """対話履歴を保存（session_stateには常に保存、DBは利用可能な場合のみ）"""
+    """対話履歴を保存（session_stateには常に保存し、保存先（services/storage.py）・キャッシュ・類似検索のインデックスにも保存）"""
     # session_stateには常に保存
     if "conversation_history" not in st.session_state:
         st.session_state["conversation_history"] = []
     st.session_state["conversation_history"].append(conversation_data)
 
-    # データベースが利用可能な場合のみ保存
-    if username and is_db_available():
+    if username:
+        # 保存先・キャッシュ・類似検索のインデックスで同じ対話を指すID
+        conversation_data.setdefault("client_id", uuid.uuid4().hex)
         try:
-            success = save_conversation_to_db(conversation_data, username)
-            if not success:
-                import logging
-                logging.warning(f"データベースへの保存に失敗しました（ユーザー名: {username}）")
+            success = get_storage().save_conversation(conversation_data, username)
+            if success:
+                # numpy を使うため、ユーザー名入力・ステップ1の初回描画では読み込まない
+                from services.embeddings import index_conversation
+
+                get_history_cache().add(username, conversation_data)
+                index_conversation(username, conversation_data, get_openai_client())
+            else:
+                logging.warning(f"対話履歴の保存に失敗しました（ユーザー名: {username}）")
         except Exception as e:
             # エラー時はスキップ（メモリのみモードで継続）
-            import logging
-            logging.warning(f"データベース保存エラー（ユーザー名: {username}）: {e}")
+            logging.warning(f"対話履歴の保存エラー（ユーザー名: {username}）: {e}")
+
+
+def search_conversation_history(username: str, query: str, page: int = 0, page_size: int = 10):
+    """
+    対話履歴を全文検索（関連度順、ページ単位）
+
+    Returns:
+        {"results": list[dict], "total": int}（エラー時は空の結果）
+    """
+    if not username or not query or not query.strip():
+        return {"results": [], "total": 0}
+    try:
+        return get_storage().search_history(
+            username, query, limit=page_size, offset=page * page_size
+        )
+    except Exception as e:
+        logging.warning(f"対話履歴の検索エラー（ユーザー名: {username}）: {e}")
+        return {"results": [], "total": 0}
 
 
+def load_emotion_trends(username: str, bucket: str = "day"):
+    """
+    感情の推移・表情の分布・対話の頻度の集計を取得
+
+    Returns:
+        {"trajectory": list[dict], "face_emotions": dict, "total": int}（エラー時は空の結果）
+    """
+    if not username:
+        return {"trajectory": [], "face_emotions": {}, "total": 0}
+    try:
+        return get_storage().emotion_trends(username, bucket)
+    except Exception as e:
+        logging.warning(f"対話履歴の集計エラー（ユーザー名: {username}）: {e}")
+        return {"trajectory": [], "face_emotions": {}, "total": 0}
+
+
+@st.cache_resource
 def get_openai_client():
-    """OpenAIクライアントを取得"""
+    """OpenAIクライアントを取得（プロセス内で共有）"""
+    from openai import OpenAI
+
     try:
-        return OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+        # 再試行は call_openai()（services/retry_policy.py）で行うため、クライアント側では行わない
+        return OpenAI(api_key=st.secrets["OPENAI_API_KEY"], max_retries=0)
     except (KeyError, AttributeError):
         return None
+
+
+@st.cache_resource
+def start_metrics_endpoint():
+    """METRICS_PORT が設定されている場合、/metrics エンドポイントを起動（プロセスにつき1回）"""
+    port = get_setting("METRICS_PORT")
+    if not port:
+        return None
+    return start_metrics_server(int(port))
+
+
+def is_diagnostics_enabled() -> bool:
+    """診断パネルを表示するか（SHOW_DIAGNOSTICS 設定または debug_mode）"""
+    if st.session_state.get("debug_mode", False):
+        return True
+    return str(get_setting("SHOW_DIAGNOSTICS", "")).lower() in ("1", "true", "yes")
@@ -0,0 +1,100 @@
+"""コールドスタート対策（バックグラウンドでの事前読み込み）
+
+重いモジュール（plotly, cv2, aiortc, streamlit_webrtc, openai, psycopg2）と
+分析・AI応答のサービス（services.pipeline、numpy を使う services.embeddings を含む）は
+それぞれを使うステップで読み込むため、ユーザー名入力・ステップ1の初回描画は
+これらを待ちません。初回描画後に start_background_warmup() が別スレッドで
+モジュールを読み込み、データベース接続プールを準備しておくことで、
+ステップ2以降に進んだ時点の待ち時間も短くします。
+ローカルの文字起こしモデルが設定されている場合は、そのモデルも読み込みます。
+"""
+
+import importlib
+import logging
+import threading
+import time
+
+from services.metrics import get_registry, track_stage
+
+logger = logging.getLogger(__name__)
+
+# 事前に読み込むモジュール（使用される順）
+WARMUP_MODULES = (
+    "plotly.graph_objects",
+    "aiortc.contrib.media",
+    "streamlit_webrtc",
+    "services.pipeline",
+    "openai",
+    "cv2",
+    "psycopg2",
+)
+
+_warmup_lock = threading.Lock()
+_warmup_started = False
+_first_render_reported = False
+
+
+def _warm_up():
+    started = time.perf_counter()
+    for module in WARMUP_MODULES:
+        with track_stage(f"warmup_import:{module}") as stage:
+            try:
+                importlib.import_module(module)
+            except Exception as e:
+                # 未インストールのモジュールは使用時にエラーを表示するため、ここでは記録のみ
+                stage["error"] = str(e)
+                logger.info(f"モジュール {module} を事前に読み込めませんでした: {e}")
+
+    with track_stage("warmup_db_pool") as stage:
+        try:
+            from services.database import warm_up_pool
+
+            warm_up_pool()
+        except Exception as e:
+            stage["error"] = str(e)
+            logger.info(f"データベース接続プールを準備できませんでした: {e}")
+
+    with track_stage("warmup_local_whisper") as stage:
+        try:
+            from services.transcription import warm_up_local_backend
+
+            warm_up_local_backend()
+        except Exception as e:
+            stage["error"] = str(e)
+            logger.info(f"ローカルの文字起こしモデルを読み込めませんでした: {e}")
+
+    elapsed = time.perf_counter() - started
+    get_registry().set_gauge(
+        "warmup_seconds", elapsed, "バックグラウンドでの事前読み込みにかかった時間（秒）"
+    )
+    logger.info(f"事前読み込みが完了しました（{elapsed:.2f}秒）")
+
+
+def start_background_warmup():
+    """事前読み込みをバックグラウンドで開始（プロセスにつき1回）"""
+    global _warmup_started
+    with _warmup_lock:
+        if _warmup_started:
+            return
+        _warmup_started = True
+    threading.Thread(target=_warm_up, name="warmup", daemon=True).start()
+
+
+def report_first_render(elapsed_seconds: float):
+    """
+    プロセス起動後、最初の描画までの時間を記録（プロセスにつき1回）
+
+    Args:
+        elapsed_seconds: スクリプト開始から描画完了までの秒数
+    """
+    global _first_render_reported
+    with _warmup_lock:
+        if _first_render_reported:
+            return
+        _first_render_reported = True
+    get_registry().set_gauge(
+        "cold_start_first_render_seconds",
+        elapsed_seconds,
+        "プロセス起動後の初回描画までの時間（秒）",
+    )
+    logger.info(f"初回描画までの時間: {elapsed_seconds:.2f}秒")